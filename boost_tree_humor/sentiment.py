@@ -0,0 +1,161 @@
+"""Sentiment providers for the feature bucket of the boosted decision tree model. Each provider scores lines of
+text as negative, positive and neutral probabilities. LexiconSentimentProvider scores offline from a word valence
+lexicon, so feature builds need no network and are repeatable. HTTPSentimentProvider asks the TwitterHawk service
+and keeps every score on disk, so a line is sent to the service only once."""
+import fcntl
+import hashlib
+import os
+import time
+import cPickle as pickle
+
+import numpy as np
+import nltk
+
+from tools import dump_pickle_atomically
+from config import SENTIMENT_LEXICON_FILE_PATH
+from config import SENTIMENT_HTTP_CACHE_FILE_PATH
+from config import BOOST_TREE_SENTIMENT_PROVIDER
+from twitter_hawk import TwitterHawk
+from twitter_hawk import TWITTERHAWK_ADDRESS
+from twitter_hawk import TWITTERHAWK_TIMEOUT
+
+# Weight of each token without lexicon valence toward the neutral score.
+SENTIMENT_NEUTRAL_WEIGHT = 1.0
+# NLTK resource of the VADER lexicon, which nltk.download('vader_lexicon') installs zipped. Used if
+# SENTIMENT_LEXICON_FILE_PATH is missing.
+NLTK_VADER_LEXICON = 'sentiment/vader_lexicon.zip/vader_lexicon/vader_lexicon.txt'
+
+
+class SentimentProvider(object):
+    """Interface of sentiment providers. key identifies the provider and its settings, so that features
+    computed with a different provider are recomputed (see tree_processing.calculate_tree_features)."""
+    key = None
+
+    def score(self, lines):
+        """Returns a [lines, 3] numpy array of negative, positive and neutral sentiment for each line."""
+        raise NotImplementedError
+
+
+class LexiconSentimentProvider(SentimentProvider):
+    """Linear sentiment scorer over a word valence lexicon (i.e. VADER: one 'word<TAB>valence<TAB>...' line per word).
+    The negative and positive scores of a line are the summed magnitudes of the negative and positive valences of
+    its tokens, the neutral score is SENTIMENT_NEUTRAL_WEIGHT per token without valence. Scores are normalized to
+    sum to one. All lines are scored at once with numpy. The provider key holds a hash of the lexicon contents."""
+    def __init__(self, lexicon_path=SENTIMENT_LEXICON_FILE_PATH, neutral_weight=SENTIMENT_NEUTRAL_WEIGHT):
+        lexicon_text = read_sentiment_lexicon(lexicon_path)
+        self.word_to_valence = parse_sentiment_lexicon(lexicon_text)
+        self.neutral_weight = neutral_weight
+        self.key = 'lexicon %s %s' % (hashlib.sha1(lexicon_text).hexdigest(), neutral_weight)
+
+    def score(self, lines):
+        line_tokens = [line.lower().split() for line in lines]
+        np_line_lengths = np.array([len(tokens) for tokens in line_tokens], dtype=np.int64)
+        np_scores = np.zeros([len(lines), 3])
+        if np.sum(np_line_lengths) > 0:
+            # Look up each distinct token once, then reduce token valences per line.
+            unique_tokens, np_token_index = np.unique([token for tokens in line_tokens for token in tokens],
+                                                      return_inverse=True)
+            np_unique_valences = np.array([self.word_to_valence.get(token, 0.0) for token in unique_tokens])
+            np_valences = np_unique_valences[np_token_index]
+            np_line_ids = np.repeat(np.arange(len(lines)), np_line_lengths)
+            np_scores[:, 0] = np.bincount(np_line_ids, weights=np.maximum(-np_valences, 0), minlength=len(lines))
+            np_scores[:, 1] = np.bincount(np_line_ids, weights=np.maximum(np_valences, 0), minlength=len(lines))
+            np_scores[:, 2] = self.neutral_weight * np.bincount(np_line_ids, weights=(np_valences == 0),
+                                                                minlength=len(lines))
+        # Lines without any tokens are neutral.
+        np_scores[np.sum(np_scores, axis=1) == 0, 2] = 1.0
+        return np_scores / np.sum(np_scores, axis=1, keepdims=True)
+
+
+def read_sentiment_lexicon(lexicon_path):
+    """Returns the contents of the lexicon file at lexicon_path. If it does not exist, returns the contents of the
+    VADER lexicon installed by nltk.download, which is read from inside its zip file."""
+    if os.path.exists(lexicon_path):
+        with open(lexicon_path, 'rb') as f:
+            return f.read()
+    lexicon_file = nltk.data.find(NLTK_VADER_LEXICON).open()
+    try:
+        return lexicon_file.read()
+    finally:
+        lexicon_file.close()
+
+
+def parse_sentiment_lexicon(lexicon_text):
+    """Returns a dictionary from word to valence, read from the first two tab separated columns of lexicon_text."""
+    word_to_valence = {}
+    for line in lexicon_text.splitlines():
+        columns = line.strip().split('\t')
+        if len(columns) >= 2:
+            word_to_valence[columns[0]] = float(columns[1])
+    return word_to_valence
+
+
+class HTTPSentimentProvider(SentimentProvider):
+    """Scores lines with the TwitterHawk service. Lines are sent in chunks of chunk_size over one pooled
+    connection, and failed requests (including requests taking longer than timeout seconds) are retried
+    max_retries times with exponential backoff before an IOError is raised. Scores are cached by line hash
+    in cache_path, which is saved after every chunk, so a line already scored by this or an earlier run is
+    never sent again."""
+    def __init__(self, address=TWITTERHAWK_ADDRESS, cache_path=SENTIMENT_HTTP_CACHE_FILE_PATH, chunk_size=500,
+                 max_retries=3, retry_delay=1.0, timeout=TWITTERHAWK_TIMEOUT):
+        self.client = TwitterHawk(address, timeout=timeout)
+        self.cache_path = cache_path
+        self.chunk_size = chunk_size
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        self.key = 'http %s' % address
+        self.line_to_sentiment = {}
+        if os.path.exists(cache_path):
+            self.line_to_sentiment = pickle.load(open(cache_path, 'rb'))
+
+    def score(self, lines):
+        line_keys = [hashlib.sha1(line).hexdigest() for line in lines]
+        key_to_line = {}
+        for line, line_key in zip(lines, line_keys):
+            if line_key not in self.line_to_sentiment:
+                key_to_line[line_key] = line
+        missing_keys = sorted(key_to_line.keys())
+        for start in range(0, len(missing_keys), self.chunk_size):
+            chunk_keys = missing_keys[start:start + self.chunk_size]
+            chunk_sentiments = self.analyze([key_to_line[line_key] for line_key in chunk_keys])
+            self.line_to_sentiment.update(zip(chunk_keys, chunk_sentiments))
+            self.save_cache()
+        return np.reshape([self.line_to_sentiment[line_key] for line_key in line_keys], [len(lines), 3])
+
+    def analyze(self, lines):
+        """Returns (negative, positive, neutral) for each line, retrying failed requests."""
+        tweets = [{'id': index, 'text': line} for index, line in enumerate(lines)]
+        for attempt in range(self.max_retries + 1):
+            results = self.client.analyze(tweets)
+            if results is not None and len(results) == len(lines):
+                return [(result['negative'], result['positive'], result['neutral']) for result in results]
+            if attempt < self.max_retries:
+                time.sleep(self.retry_delay * 2 ** attempt)
+        raise IOError('TwitterHawk failed to score %s lines after %s attempts' % (len(lines), self.max_retries + 1))
+
+    def save_cache(self):
+        """Save the cache, keeping scores other processes saved since it was loaded. The read, merge and
+        write happen under an exclusive lock on a file next to the cache, so worker processes scoring
+        hashtags in parallel (see tree_processing) never drop each other's scores."""
+        cache_dir = os.path.dirname(self.cache_path)
+        if cache_dir != '' and not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(self.cache_path + '.lock', 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                if os.path.exists(self.cache_path):
+                    saved_line_to_sentiment = pickle.load(open(self.cache_path, 'rb'))
+                    saved_line_to_sentiment.update(self.line_to_sentiment)
+                    self.line_to_sentiment = saved_line_to_sentiment
+                dump_pickle_atomically(self.line_to_sentiment, self.cache_path)
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def get_sentiment_provider(name=BOOST_TREE_SENTIMENT_PROVIDER):
+    """Returns a new sentiment provider: 'lexicon' (LexiconSentimentProvider) or 'http' (HTTPSentimentProvider)."""
+    if name == 'lexicon':
+        return LexiconSentimentProvider()
+    elif name == 'http':
+        return HTTPSentimentProvider()
+    raise ValueError('Unknown sentiment provider: %s' % name)
@@ -1,4 +1,15 @@
 """David Donahue 2016. Testing script for tree model functionality."""
+import cPickle as pickle
+import os
+import shutil
+import tempfile
+import zipfile
+
+import nltk
+import numpy as np
+
+import sentiment
+import tree_processing
 from tree_processing import calculate_sentiment_value_of_lines
 from tools import remove_hashtag_from_tweets
 
@@ -8,6 +19,9 @@ def main():
     # Tester functions go here.
     test_calculate_sentiment_of_lines()
     test_remove_hashtag_from_tweets()
+    test_tree_feature_registry()
+    test_sentiment_providers()
+    test_calculate_tweet_pos()
 
 
 def test_calculate_sentiment_of_lines():
@@ -18,8 +32,10 @@ def test_calculate_sentiment_of_lines():
     example_tweet3 = 'I am having an average day'
     tweets = [example_tweet1, example_tweet2, example_tweet3]
     tweet_sentiments = calculate_sentiment_value_of_lines(tweets)
-    assert tweet_sentiments[1] > tweet_sentiments[2]
-    assert tweet_sentiments[2] > tweet_sentiments[0]
+    # Compare polarity, positive minus negative sentiment.
+    tweet_polarities = [positive - negative for negative, positive, neutral in tweet_sentiments]
+    assert tweet_polarities[1] > tweet_polarities[2]
+    assert tweet_polarities[2] > tweet_polarities[0]
 
 
 def test_remove_hashtag_from_tweets():
@@ -31,5 +47,117 @@ def test_remove_hashtag_from_tweets():
     assert tweets_without_hashtags[2] == 'of tweet'
 
 
+def test_tree_feature_registry():
+    """Check that features are cached per tweet and that pair rows keep each feature's columns together."""
+    calculated_tweets = []
+
+    def calculate_first_letter(tweets, context):
+        calculated_tweets.extend(tweets)
+        return np.array([[ord(tweet[0])] for tweet in tweets])
+
+    features = [tree_processing.TreeFeature('first_letter', 1, calculate_first_letter),
+                tree_processing.TreeFeature('hashtag_words', 2, lambda context: [len(context['tweets']), 7],
+                                            per_hashtag=True),
+                tree_processing.TreeFeature('length', 2, tree_processing.calculate_tweet_lengths)]
+    tweets = ['a b', 'cd', 'a b', 'efg h']
+    unique_tweets, np_first_index, np_second_index = \
+        tree_processing.index_unique_tweets(tweets, ['a b', 'cd'], ['efg h', 'a b'])
+    assert unique_tweets == ['a b', 'cd', 'efg h']
+    context = {'tweets': unique_tweets}
+    cache_dir = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(cache_dir, 'hashtag' + tree_processing.TREE_FEATURE_CACHE_SUFFIX)
+        feature_values = tree_processing.calculate_tree_features(features, context, {}, cache_path)
+        np_data = tree_processing.assemble_tree_feature_pairs(features, feature_values, np_first_index,
+                                                              np_second_index)
+        assert np_data.tolist() == [[ord('a'), ord('e'), 3, 7, 2, 3, 2, 5],
+                                    [ord('c'), ord('a'), 3, 7, 1, 2, 2, 3]]
+        assert calculated_tweets == unique_tweets
+        # Only new tweets are computed on the next run.
+        context = {'tweets': unique_tweets + ['ij']}
+        tree_processing.calculate_tree_features(features, context, {}, cache_path)
+        assert calculated_tweets == unique_tweets + ['ij']
+    finally:
+        shutil.rmtree(cache_dir)
+
+
+def test_sentiment_providers():
+    """Check lexicon scores and that the HTTP provider sends each line once, in chunks."""
+    test_dir = tempfile.mkdtemp()
+    try:
+        lexicon_path = os.path.join(test_dir, 'lexicon.txt')
+        open(lexicon_path, 'wb').write('good\t2.0\t0.5\t[2, 2]\nbad\t-2.5\t0.5\t[-3, -2]\n')
+        provider = sentiment.LexiconSentimentProvider(lexicon_path)
+        np_scores = provider.score(['I am having a bad day', 'a GOOD day', '', 'good bad'])
+        assert np.allclose(np.sum(np_scores, axis=1), 1.0)
+        assert np_scores[0, 0] > np_scores[0, 1] and np_scores[1, 1] > np_scores[1, 0]
+        assert np_scores[2].tolist() == [0.0, 0.0, 1.0]
+        assert np.allclose(np_scores[3], [2.5 / 4.5, 2.0 / 4.5, 0.0])
+        # Without the lexicon file, the VADER lexicon of nltk.download is read from inside its zip file.
+        nltk_data_dir = os.path.join(test_dir, 'nltk_data')
+        os.makedirs(os.path.join(nltk_data_dir, 'sentiment'))
+        with zipfile.ZipFile(os.path.join(nltk_data_dir, 'sentiment', 'vader_lexicon.zip'), 'w') as lexicon_zip:
+            lexicon_zip.write(lexicon_path, 'vader_lexicon/vader_lexicon.txt')
+        nltk.data.path.insert(0, nltk_data_dir)
+        try:
+            zipped_provider = sentiment.LexiconSentimentProvider(os.path.join(test_dir, 'missing_lexicon.txt'))
+        finally:
+            nltk.data.path.remove(nltk_data_dir)
+        assert zipped_provider.key == provider.key
+        assert np.array_equal(zipped_provider.score(['good bad']), np_scores[3:])
+
+        class FakeTwitterHawk(object):
+            def __init__(self):
+                self.requests = []
+
+            def analyze(self, tweets):
+                self.requests.append([tweet['text'] for tweet in tweets])
+                return [{'negative': 0.0, 'positive': len(tweet['text']), 'neutral': 1.0} for tweet in tweets]
+
+        cache_path = os.path.join(test_dir, 'sentiment_cache.cpkl')
+        provider = sentiment.HTTPSentimentProvider(cache_path=cache_path, chunk_size=2)
+        provider.client = FakeTwitterHawk()
+        assert provider.score(['a', 'bb', 'a', 'ccc'])[:, 1].tolist() == [1, 2, 1, 3]
+        assert sorted([len(request) for request in provider.client.requests]) == [1, 2]
+        provider = sentiment.HTTPSentimentProvider(cache_path=cache_path, chunk_size=2)
+        provider.client = FakeTwitterHawk()
+        assert provider.score(['ccc', 'dddd'])[:, 1].tolist() == [3, 4]
+        assert provider.client.requests == [['dddd']]
+        # Providers of parallel workers load the cache before either saves, and keep each other's scores.
+        first_worker_provider = sentiment.HTTPSentimentProvider(cache_path=cache_path)
+        second_worker_provider = sentiment.HTTPSentimentProvider(cache_path=cache_path)
+        first_worker_provider.client = FakeTwitterHawk()
+        second_worker_provider.client = FakeTwitterHawk()
+        first_worker_provider.score(['eeeee'])
+        second_worker_provider.score(['ffffff'])
+        provider = sentiment.HTTPSentimentProvider(cache_path=cache_path)
+        provider.client = FakeTwitterHawk()
+        assert provider.score(['eeeee', 'ffffff', 'a'])[:, 1].tolist() == [5, 6, 1]
+        assert provider.client.requests == []
+        assert [file_name for file_name in os.listdir(test_dir) if file_name.endswith('.tmp')] == []
+    finally:
+        shutil.rmtree(test_dir)
+
+
+def test_calculate_tweet_pos():
+    """Check POS tag histograms from cached tags."""
+    test_dir = tempfile.mkdtemp()
+    try:
+        cache_path = os.path.join(test_dir, 'pos_tag_cache.cpkl')
+        pickle.dump({'key': 'test', 'tags': {('the', 'dog'): ('DT', 'NN'), ('dogs', 'dogs', 'dogs'): ('NNS',) * 3}},
+                    open(cache_path, 'wb'))
+        pos_tags = tree_processing.tag_token_sequences_with_cache([('dogs', 'dogs', 'dogs'), ('the', 'dog')], 'test',
+                                                                  cache_path=cache_path)
+        np_pos = tree_processing.calculate_tweet_pos(['the dog', 'dogs dogs dogs', 'the dog'], {'pos_tags': pos_tags})
+        assert np_pos.dtype == np.uint8
+        assert np_pos.shape == (3, len(tree_processing.POS_TAGS))
+        assert np_pos[0, tree_processing.POS_TAGS.index('DT')] == 1
+        assert np_pos[0, tree_processing.POS_TAGS.index('NN')] == 1
+        assert np_pos[1, tree_processing.POS_TAGS.index('NNS')] == 3
+        assert np.sum(np_pos) == 7
+    finally:
+        shutil.rmtree(test_dir)
+
+
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -1,11 +1,13 @@
 import cPickle as pickle
+import os
 
 import numpy as np
 
-from tf_emb_char_humor.humor_ensemble_processing import num_groups
+from tf_emb_char_humor.humor_ensemble_processing import num_groups, divide_hashtags_into_groups
 from boost_tree_humor.tree_model import XGBoostTreeModel, load_tree_data
 from config import HUMOR_TRAIN_PREDICTION_HASHTAGS, BOOST_TREE_TWEET_PAIR_TRAIN_DIR, \
-    BOOST_TREE_TRAIN_TWEET_PAIR_PREDICTIONS
+    BOOST_TREE_TRAIN_TWEET_PAIR_PREDICTIONS, BOOST_TREE_TRAIN_FOLD_PREDICTIONS_DIR
+from tools import BuildManifest, BUILD_MANIFEST_FILE, hash_build_inputs, dump_pickle_atomically
 
 xgboost_params = {
     'objective': 'binary:logistic',
@@ -35,15 +37,29 @@ def get_train_data(hashtag_names, current_group_hashtags):
 
 
 def main():
+    """Makes out-of-fold boost tree predictions on all training hashtags. The predictions of each group are
+    saved as soon as the group is done and recorded in a build manifest, so a rerun after an interruption
+    only trains the groups that are missing."""
     hashtag_names = get_hashtag_names()
     print 'Hashtag names:', len(hashtag_names), 'num groups:', num_groups
 
+    manifest = BuildManifest(os.path.join(BOOST_TREE_TRAIN_FOLD_PREDICTIONS_DIR, BUILD_MANIFEST_FILE),
+                             {'hashtag_names': hashtag_names, 'num_groups': num_groups,
+                              'xgboost_params': xgboost_params})
+    # Every fold trains on the hashtags outside its group and predicts on those inside, so it goes stale
+    # when the tree data of any hashtag is rebuilt.
+    tree_data_hashes = [hash_build_inputs([BOOST_TREE_TWEET_PAIR_TRAIN_DIR + hashtag_name + '_data.npy',
+                                           BOOST_TREE_TWEET_PAIR_TRAIN_DIR + hashtag_name + '_labels.npy'])
+                        for hashtag_name in hashtag_names]
     hashtag_predictions = []
-    for hashtag_group_index in range(num_groups):
-        num_hashtags = len(hashtag_names)
-        num_hashtags_in_group = num_hashtags / num_groups + 1
-        starting_hashtag_index = num_hashtags_in_group * hashtag_group_index
-        hashtags_in_group = hashtag_names[starting_hashtag_index:starting_hashtag_index + num_hashtags_in_group]
+    for hashtag_group_index, hashtags_in_group in enumerate(divide_hashtags_into_groups(hashtag_names, num_groups)):
+        fold_name = 'boost_tree_fold_%s' % hashtag_group_index
+        fold_hash = hash_build_inputs([], words=hashtags_in_group + tree_data_hashes)
+        fold_predictions_path = os.path.join(BOOST_TREE_TRAIN_FOLD_PREDICTIONS_DIR, fold_name + '.cpkl')
+        if manifest.is_fresh(fold_name, fold_hash):
+            print 'Group:', hashtag_group_index, 'already done'
+            hashtag_predictions.extend(pickle.load(open(fold_predictions_path, 'rb')))
+            continue
 
         print 'Group:', hashtag_group_index, 'hashtags:', len(hashtags_in_group)
 
@@ -61,6 +77,7 @@ def main():
 
         # get the predictions on individual hashtags
         hashtags_in_group_accuracies = []
+        group_predictions = []
         for hashtag_name in hashtags_in_group:
             data_predict, labels_predict = load_tree_data(hashtag_name, BOOST_TREE_TWEET_PAIR_TRAIN_DIR)
 
@@ -70,10 +87,15 @@ def main():
 
             hashtags_in_group_accuracies.append(accuracy_predict)
 
-            hashtag_predictions.append(predictions)
+            group_predictions.append(predictions)
 
         print 'Group:', hashtag_group_index, 'mean accuracy:', np.mean(hashtags_in_group_accuracies)
 
+        dump_pickle_atomically(group_predictions, fold_predictions_path)
+        manifest.record(fold_name, fold_hash, [fold_predictions_path])
+        manifest.save()
+        hashtag_predictions.extend(group_predictions)
+
     # save the predictions from the boost tree model
     with open(BOOST_TREE_TRAIN_TWEET_PAIR_PREDICTIONS, 'wb') as f:
         pickle.dump(hashtag_predictions, f)
@@ -2,23 +2,31 @@
 import numpy as np
 import random
 import os
+import sys
 import cPickle as pickle
-from collections import Counter
+import hashlib
 
-import scipy.spatial.distance
-from nltk import pos_tag
+import nltk
 
-from tools import get_hashtag_file_names, extract_tweet_pairs_by_combination
+from tools import get_hashtag_file_names
+from tools import generate_tweet_pair_index_chunks
 from tools import load_tweets_from_hashtag
 from tools import extract_tweet_pairs_by_rank
 from tools import remove_hashtag_from_tweets
+from tools import map_hashtags
+from tools import get_worker_count
+from tools import BuildManifest
+from tools import BUILD_MANIFEST_FILE
+from tools import hash_build_inputs
+from tools import segment_reduce
+from tools import dump_pickle_atomically
 from config import SEMEVAL_HUMOR_TRAIN_DIR, HUMOR_WORD_TO_GLOVE_FILE_PATH, SEMEVAL_HUMOR_EVAL_DIR, \
     BOOST_TREE_TWEET_PAIR_TRIAL_DIR
 from config import TWEET_PAIR_LABEL_RANDOM_SEED
 from config import BOOST_TREE_TWEET_PAIR_TRAIN_DIR
 from config import BOOST_TREE_TWEET_PAIR_EVAL_DIR
-from twitter_hawk import TwitterHawk
-from twitter_hawk import TWITTERHAWK_ADDRESS
+from config import BOOST_TREE_POS_TAG_CACHE_FILE_PATH
+from sentiment import get_sentiment_provider
 from config import SEMEVAL_HUMOR_TRIAL_DIR
 
 
@@ -34,6 +42,17 @@ from config import SEMEVAL_HUMOR_TRIAL_DIR
 # Number of capital letters
 # Is hashtag in the beginning or the end
 
+# Resources a TreeFeature can declare in needs.
+TREE_FEATURE_RESOURCES = ['glove', 'pos', 'sentiment']
+# Per-hashtag file caching computed feature values, next to the feature bucket.
+TREE_FEATURE_CACHE_SUFFIX = '_feature_cache.cpkl'
+# possible_tags = ['CC', 'CD', 'DT', 'EX', 'FW', 'IN', 'JJ', 'JJR', 'JJS', 'LS', 'MD', 'NN', 'NNS', 'NNP', 'NNPS',
+#                  'PDT', 'POS', 'PRP', 'PRP$', 'RB', 'RBR', 'RBS', 'RP', 'SYM', 'TO', 'UH', 'VB', 'VBD', 'VBG',
+#                  'VBN', 'VBP', 'VBZ', 'WDT', 'WP', 'WP$', 'WRB', '.']
+POS_TAGS = ['NN', 'NNS', 'JJ', 'IN', 'DT', 'VBP', 'NNP', 'VB', 'VBD', 'RB']  # top10 tags on training data
+# Number of tweets tagged per worker task.
+POS_TAG_CHUNK_SIZE = 1000
+
 
 def main():
     if not os.path.exists(BOOST_TREE_TWEET_PAIR_TRAIN_DIR):
@@ -45,109 +64,291 @@ def main():
 
     print 'Starting program'
 
-    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_TRAIN_DIR, BOOST_TREE_TWEET_PAIR_TRAIN_DIR)
-    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_TRIAL_DIR, BOOST_TREE_TWEET_PAIR_TRIAL_DIR)
-    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_EVAL_DIR, BOOST_TREE_TWEET_PAIR_EVAL_DIR)
-
-
-def generate_tree_model_input_data_from_dir(directory, output_dir):
-    """Construct feature bucket for the decision tree model. Calculate sentiment for both
-    tweets in each tweet pair. Finally, save the feature bucket and labels."""
-
-    # load glove vectors
-    word_to_glove = pickle.load(open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'rb'))
-
+    # Use --workers N to process hashtags in N parallel processes.
+    workers = get_worker_count(sys.argv)
+    # Use --features name,name to build the feature bucket from a subset of TREE_FEATURES.
+    features = get_tree_features(sys.argv)
+    # Use --sentiment lexicon|http to choose the sentiment provider (see sentiment.py).
+    sentiment_provider = None
+    if '--sentiment' in sys.argv:
+        sentiment_provider = get_sentiment_provider(sys.argv[sys.argv.index('--sentiment') + 1])
+    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_TRAIN_DIR, BOOST_TREE_TWEET_PAIR_TRAIN_DIR, workers=workers,
+                                            features=features, sentiment_provider=sentiment_provider)
+    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_TRIAL_DIR, BOOST_TREE_TWEET_PAIR_TRIAL_DIR, workers=workers,
+                                            features=features, sentiment_provider=sentiment_provider)
+    generate_tree_model_input_data_from_dir(SEMEVAL_HUMOR_EVAL_DIR, BOOST_TREE_TWEET_PAIR_EVAL_DIR, workers=workers,
+                                            features=features, sentiment_provider=sentiment_provider)
+
+
+def get_tree_features(argv):
+    """Returns the features named in '--features name,name' if it appears in command line arguments argv,
+    otherwise all TREE_FEATURES. Features keep their TREE_FEATURES order."""
+    if '--features' not in argv:
+        return list(TREE_FEATURES)
+    feature_names = argv[argv.index('--features') + 1].split(',')
+    unknown_names = set(feature_names) - set([feature.name for feature in TREE_FEATURES])
+    if len(unknown_names) > 0:
+        raise ValueError('Unknown tree features: %s' % ', '.join(sorted(unknown_names)))
+    return [feature for feature in TREE_FEATURES if feature.name in feature_names]
+
+
+def generate_tree_model_input_data_from_dir(directory, output_dir, workers=1, features=None, sentiment_provider=None):
+    """Construct feature bucket for the decision tree model from features (default TREE_FEATURES).
+    Sentiment features use sentiment_provider (default sentiment.get_sentiment_provider()).
+    Finally, save the feature bucket and labels. With workers > 1, hashtags are processed in parallel
+    (see tools.map_hashtags). Hashtags whose .tsv file and GloVe vectors are unchanged since the last run
+    are skipped (see tools.BuildManifest), and feature values computed by earlier runs are reused
+    (see calculate_tree_features)."""
+    if features is None:
+        features = TREE_FEATURES
+    needs = set([need for feature in features for need in feature.needs])
+
+    # load glove vectors and the sentiment provider, if a feature uses them
+    resources = {'word_to_glove': None, 'sentiment_provider': None, 'pos_tags': None}
+    word_tables = []
+    if 'glove' in needs:
+        resources['word_to_glove'] = pickle.load(open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'rb'))
+        word_tables = [resources['word_to_glove']]
+    if 'sentiment' in needs:
+        resources['sentiment_provider'] = sentiment_provider or get_sentiment_provider()
+    resource_keys = calculate_tree_feature_resource_keys(needs, resources)
+
+    manifest = BuildManifest(output_dir + BUILD_MANIFEST_FILE,
+                             {'TWEET_PAIR_LABEL_RANDOM_SEED': TWEET_PAIR_LABEL_RANDOM_SEED,
+                              'SENTIMENT_PROVIDER': resource_keys.get('sentiment'),
+                              'TREE_FEATURES': [feature.name for feature in features]})
     hashtag_names = get_hashtag_file_names(directory)
-    for hashtag_number, hashtag_name in enumerate(hashtag_names):
-        print 'Processing hashtag %s [%s/%s]' % (hashtag_name, hashtag_number + 1, len(hashtag_names))
-
-        formatted_hashtag = ' '.join(hashtag_name.split('_')).lower()
-        print 'Formatted hashtag: %s' % formatted_hashtag
-
-        tweets, tweet_labels, tweet_ids = load_tweets_from_hashtag(directory + hashtag_name + '.tsv')
-        tweets = remove_hashtag_from_tweets(tweets)
-        print 'Creating tweet pairs'
-        random.seed(TWEET_PAIR_LABEL_RANDOM_SEED)
-
-        if len(tweet_labels) > 0:
-            tweet_pairs = extract_tweet_pairs_by_rank(tweets, tweet_labels, tweet_ids)
-        else:
-            tweet_pairs = extract_tweet_pairs_by_combination(tweets, tweet_ids)
-
+    input_hashes = {}
+    for hashtag_name in hashtag_names:
+        input_hashes[hashtag_name] = hash_build_inputs([directory + hashtag_name + '.tsv'],
+                                                       words=find_words_in_hashtag(directory, hashtag_name),
+                                                       word_tables=word_tables)
+    stale_hashtag_names = [hashtag_name for hashtag_name in hashtag_names
+                           if not manifest.is_fresh(hashtag_name, input_hashes[hashtag_name])]
+    print 'Processing %s of %s hashtags' % (len(stale_hashtag_names), len(hashtag_names))
+    if 'pos' in needs:
+        token_sequences = set()
+        for hashtag_name in stale_hashtag_names:
+            tweets, tweet_labels, tweet_ids = load_tweets_from_hashtag(directory + hashtag_name + '.tsv')
+            token_sequences.update([tuple(tweet.split(' ')) for tweet in remove_hashtag_from_tweets(tweets)])
+        resources['pos_tags'] = tag_token_sequences_with_cache(token_sequences, resource_keys['pos'], workers=workers)
+    for hashtag_number, hashtag_name in enumerate(map_hashtags(generate_tree_model_input_data_for_hashtag,
+                                                               stale_hashtag_names,
+                                                               shared_args=(directory, output_dir, resources,
+                                                                            features, resource_keys),
+                                                               workers=workers)):
+        print 'Processed hashtag %s [%s/%s]' % (hashtag_name, hashtag_number + 1, len(stale_hashtag_names))
+        manifest.record(hashtag_name, input_hashes[hashtag_name], [output_dir + hashtag_name + '_labels.npy',
+                                                                   output_dir + hashtag_name + '_data.npy'])
+        manifest.save()
+    manifest.retain(hashtag_names)
+    manifest.save()
+
+
+def find_words_in_hashtag(directory, hashtag_name):
+    """Returns the set of words in the tweets and name of a hashtag, as tokenized for the feature bucket."""
+    formatted_hashtag = ' '.join(hashtag_name.split('_')).lower()
+    tweets, tweet_labels, tweet_ids = load_tweets_from_hashtag(directory + hashtag_name + '.tsv')
+    words = set(formatted_hashtag.split(' '))
+    for tweet in remove_hashtag_from_tweets(tweets):
+        words.update(tweet.split(' '))
+    return words
+
+
+def generate_tree_model_input_data_for_hashtag(hashtag_name, directory, output_dir, resources, features,
+                                               resource_keys):
+    """Construct and save the feature bucket and labels for the tweet pairs of one hashtag.
+    resources holds the word_to_glove and sentiment_provider the features need. Returns the hashtag name."""
+    print 'Processing hashtag %s' % hashtag_name
+
+    formatted_hashtag = ' '.join(hashtag_name.split('_')).lower()
+    print 'Formatted hashtag: %s' % formatted_hashtag
+
+    tweets, tweet_labels, tweet_ids = load_tweets_from_hashtag(directory + hashtag_name + '.tsv')
+    tweets = remove_hashtag_from_tweets(tweets)
+    print 'Creating tweet pairs'
+    random.seed(TWEET_PAIR_LABEL_RANDOM_SEED)
+
+    if len(tweet_labels) > 0:
+        tweet_pairs = extract_tweet_pairs_by_rank(tweets, tweet_labels, tweet_ids)
         tweet1 = [tweet_pair[0] for tweet_pair in tweet_pairs]
-        tweet1_id = [tweet_pair[1] for tweet_pair in tweet_pairs]
         tweet2 = [tweet_pair[2] for tweet_pair in tweet_pairs]
-        tweet2_id = [tweet_pair[3] for tweet_pair in tweet_pairs]
-
-        if len(tweet_labels) > 0:
-            labels = [tweet_pair[4] for tweet_pair in tweet_pairs]
+        labels = [tweet_pair[4] for tweet_pair in tweet_pairs]
+        unique_tweets, np_first_index, np_second_index = index_unique_tweets(tweets, tweet1, tweet2)
+        pair_index_chunks = [(np_first_index, np_second_index)]
+        number_of_pairs = len(tweet_pairs)
+    else:
+        # Every combination of tweets is a pair. Pairs are generated and saved in chunks,
+        # so the pairs of large hashtags are never all held in memory.
+        labels = []
+        unique_tweets, np_tweet_rows = index_unique_tweets(tweets, tweets, [])[:2]
+        pair_index_chunks = ((np_tweet_rows[np_first_position], np_tweet_rows[np_second_position])
+                             for np_first_position, np_second_position in generate_tweet_pair_index_chunks(len(tweets)))
+        number_of_pairs = len(tweets) * (len(tweets) - 1) // 2
+    context = dict(resources, hashtag_name=hashtag_name, formatted_hashtag=formatted_hashtag, tweets=unique_tweets)
+    feature_values = calculate_tree_features(features, context, resource_keys,
+                                             output_dir + hashtag_name + TREE_FEATURE_CACHE_SUFFIX)
+
+    print 'Features:'
+    for feature, np_values in zip(features, feature_values):
+        print feature.name, np_values.shape
+
+    np_labels = np.array(labels)
+    labels_filename = output_dir + hashtag_name + '_labels.npy'
+    np.save(open(labels_filename, 'wb'), np_labels)
+    print 'Labels saved', labels_filename
+
+    # Write the feature bucket chunk by chunk into the memory-mapped output file.
+    data_filename = output_dir + hashtag_name + '_data.npy'
+    width = sum([feature.width if feature.per_hashtag else 2 * feature.width for feature in features])
+    np_data = np.lib.format.open_memmap(data_filename, mode='w+', dtype=np.result_type(*feature_values),
+                                        shape=(number_of_pairs, width))
+    pair_start = 0
+    for np_first_index, np_second_index in pair_index_chunks:
+        np_data[pair_start:pair_start + len(np_first_index)] = \
+            assemble_tree_feature_pairs(features, feature_values, np_first_index, np_second_index)
+        pair_start += len(np_first_index)
+    print 'Data:', np_data.shape, 'Labels:', np_labels.shape
+    np_data.flush()
+    del np_data
+    print 'Data saved', data_filename
+    return hashtag_name
+
+
+class TreeFeature(object):
+    """A feature of the feature bucket, registered in TREE_FEATURES. Per-tweet features are computed
+    for a batch of unique tweets as calculate(tweets, context) -> [tweets, width] array, and fill width
+    columns for the first tweet and width columns for the second tweet of each pair. Hashtag features
+    (per_hashtag=True) are computed as calculate(context) -> [width] array and repeated in every pair.
+    context holds hashtag_name, formatted_hashtag, tweets (all unique tweets of the hashtag), word_to_glove,
+    sentiment_provider and pos_tags (None unless an enabled feature needs 'glove', 'sentiment' or 'pos').
+
+    name - name used to select the feature (--features) and to cache its values
+    width - number of values per tweet, or per hashtag
+    calculate - function computing the feature
+    per_hashtag - if True, the feature has one value per hashtag instead of one per tweet
+    uses_all_tweets - if True, the value of a tweet also depends on the other tweets of its hashtag
+    needs - resources the feature uses: 'glove', 'pos' and/or 'sentiment'"""
+    def __init__(self, name, width, calculate, per_hashtag=False, uses_all_tweets=False, needs=()):
+        assert set(needs) <= set(TREE_FEATURE_RESOURCES)
+        self.name = name
+        self.width = width
+        self.calculate = calculate
+        self.per_hashtag = per_hashtag
+        self.uses_all_tweets = uses_all_tweets
+        self.needs = tuple(sorted(needs))
+
+    def get_cache_key(self, resource_keys, tweets_key):
+        """Cached values of the feature are reused while this key stays the same."""
+        cache_key = tuple([(need, resource_keys[need]) for need in self.needs])
+        if self.uses_all_tweets:
+            cache_key += (('tweets', tweets_key),)
+        return cache_key
+
+
+def calculate_tree_feature_resource_keys(needs, resources):
+    """Returns a key for each resource in needs that changes when the resource does, so that cached
+    feature values computed with an older resource are recomputed."""
+    resource_keys = {}
+    if 'glove' in needs:
+        word_to_glove = resources['word_to_glove']
+        resource_keys['glove'] = hash_build_inputs([], words=word_to_glove.keys(), word_tables=[word_to_glove])
+    if 'pos' in needs:
+        resource_keys['pos'] = 'nltk %s' % nltk.__version__
+    if 'sentiment' in needs:
+        resource_keys['sentiment'] = resources['sentiment_provider'].key
+    return resource_keys
+
+
+def calculate_tree_features(features, context, resource_keys, cache_path):
+    """Compute features for the unique tweets of a hashtag. Each feature runs once on the batch of tweets
+    it has no cached value for. Values are cached per tweet hash in cache_path, together with those of
+    features that are currently disabled, so features can be added or toggled without recomputing the
+    others. Returns one array per feature: [tweets, width] for per-tweet features, [width] for hashtag
+    features."""
+    cache = {}
+    if os.path.exists(cache_path):
+        cache = pickle.load(open(cache_path, 'rb'))
+    tweet_keys = [hashlib.sha1(tweet).hexdigest() for tweet in context['tweets']]
+    current_keys = set(tweet_keys + ['hashtag'])
+    tweets_key = hashlib.sha1(''.join(sorted(tweet_keys))).hexdigest()
+
+    feature_values = []
+    for feature in features:
+        cache_key = feature.get_cache_key(resource_keys, tweets_key)
+        if feature.name not in cache or cache[feature.name]['key'] != cache_key:
+            cache[feature.name] = {'key': cache_key, 'values': {}}
+        cached_values = cache[feature.name]['values']
+        if feature.per_hashtag:
+            if 'hashtag' not in cached_values:
+                print 'Calculating %s' % feature.name
+                cached_values['hashtag'] = np.reshape(feature.calculate(context), [feature.width])
+            feature_values.append(cached_values['hashtag'])
         else:
-            labels = []
-
-        # Numpy arrays of features can be added to this list to be automatically inserted into model input.
-        list_of_features = []
-
-        print 'Calculating tweet pair sentiment'
-        list_of_features.append(calculate_tweet_pair_sentiment(tweets, tweet1, tweet2))
-
-        print 'Calculating hashtag sentiment'
-        list_of_features.append(calculate_hashtag_sentiment(len(tweet1), formatted_hashtag))
-
-        print 'Calculating tweet pair lengths'
-        list_of_features.append(calculate_tweet_lengths_per_pair(tweet1, tweet2))
-
-        print 'Calculating distance to centroid'
-        list_of_features.append(
-            calculate_tweet_pair_distance_to_centroid_word_embeddings(tweets, tweet1, tweet2, word_to_glove))
-
-        print 'Calculating number of OOV tokens'
-        list_of_features.append(calculate_tweet_pair_oov(tweets, tweet1, tweet2, word_to_glove))
-
-        print 'Calculating average, max and min distance to the hashtag'
-        list_of_features.append(
-            calculate_tweet_pair_hashtag_distance(tweets, tweet1, tweet2, formatted_hashtag, word_to_glove))
-
-        print 'Calculating POS features'
-        list_of_features.append(calculate_tweet_pair_pos(tweets, tweet1, tweet2))
-
-        print 'Features:'
-        for i, feature in enumerate(list_of_features):
-            print i, feature.shape
-
-        np_data = np.concatenate(list_of_features, axis=1)
-        np_labels = np.array(labels)
-        print 'Data:', np_data.shape, 'Labels:', np_labels.shape
-
-        labels_filename = output_dir + hashtag_name + '_labels.npy'
-        np.save(open(labels_filename, 'wb'), np_labels)
-        print 'Labels saved', labels_filename
-
-        data_filename = output_dir + hashtag_name + '_data.npy'
-        np.save(open(data_filename, 'wb'), np_data)
-        print 'Data saved', data_filename
-
-
-def calculate_hashtag_sentiment(number_of_examples, hashtag):
-    hashtag_sentiment = calculate_sentiment_value_of_lines([hashtag])[0]
-
-    np_hashtag_sentiment = np.tile(hashtag_sentiment, (number_of_examples, 1))
-    return np_hashtag_sentiment
-
-
-def calculate_tweet_lengths_per_pair(tweet1, tweet2):
-    assert len(tweet1) == len(tweet2)
-
-    tweet_pair_lengths = []
-    for i in range(len(tweet1)):
-        tweet1_token_len = len(tweet1[i].split(' '))
-        tweet1_char_len = len(tweet1[i])
-        tweet2_token_len = len(tweet2[i].split(' '))
-        tweet2_char_len = len(tweet2[i])
-
-        tweet_pair_lengths.append([tweet1_token_len, tweet1_char_len, tweet2_token_len, tweet2_char_len])
-
-    np_data = np.array(tweet_pair_lengths)
-    return np_data
+            missing_tweets = [index for index, tweet_key in enumerate(tweet_keys) if tweet_key not in cached_values]
+            if len(missing_tweets) > 0:
+                print 'Calculating %s for %s tweets' % (feature.name, len(missing_tweets))
+                np_values = np.reshape(feature.calculate([context['tweets'][index] for index in missing_tweets],
+                                                         context), [len(missing_tweets), feature.width])
+                for index, np_tweet_values in zip(missing_tweets, np_values):
+                    cached_values[tweet_keys[index]] = np_tweet_values
+            feature_values.append(np.reshape([cached_values[tweet_key] for tweet_key in tweet_keys],
+                                             [len(tweet_keys), feature.width]))
+        # Forget tweets that were removed from the hashtag.
+        cache[feature.name]['values'] = {key: value for key, value in cached_values.iteritems()
+                                         if key in current_keys}
+    dump_pickle_atomically(cache, cache_path)
+    return feature_values
+
+
+def assemble_tree_feature_pairs(features, feature_values, np_first_index, np_second_index):
+    """Build the feature bucket, one row per tweet pair. Per-tweet features are concatenated and gathered
+    for both tweets of all pairs at once, then columns are ordered feature by feature: first tweet values,
+    second tweet values, or the hashtag values of hashtag features.
+
+    feature_values - arrays returned by calculate_tree_features for features
+    np_first_index, np_second_index - position of the first and second tweet of each pair among the tweets"""
+    tweet_values = [np_values for feature, np_values in zip(features, feature_values) if not feature.per_hashtag]
+    hashtag_values = [np_values for feature, np_values in zip(features, feature_values) if feature.per_hashtag]
+    tweet_width = sum([np_values.shape[1] for np_values in tweet_values])
+    number_of_pairs = len(np_first_index)
+
+    np_pair_rows = np.zeros([number_of_pairs, 0])
+    if len(tweet_values) > 0:
+        np_tweet_features = np.concatenate(tweet_values, axis=1)
+        np_pair_index = np.stack([np_first_index, np_second_index], axis=1)
+        np_pair_rows = np.reshape(np_tweet_features[np_pair_index], [number_of_pairs, 2 * tweet_width])
+    if len(hashtag_values) > 0:
+        np_pair_rows = np.concatenate([np_pair_rows, np.tile(np.concatenate(hashtag_values), (number_of_pairs, 1))],
+                                      axis=1)
+
+    columns = []
+    tweet_offset = 0
+    hashtag_offset = 2 * tweet_width
+    for feature in features:
+        if feature.per_hashtag:
+            columns.extend(range(hashtag_offset, hashtag_offset + feature.width))
+            hashtag_offset += feature.width
+        else:
+            columns.extend(range(tweet_offset, tweet_offset + feature.width))
+            columns.extend(range(tweet_width + tweet_offset, tweet_width + tweet_offset + feature.width))
+            tweet_offset += feature.width
+    return np_pair_rows[:, columns]
+
+
+def index_unique_tweets(tweets, tweet1, tweet2):
+    """Returns the unique tweets in order of first appearance, and the positions of the first and second
+    tweet of each pair among them. Per-tweet features are computed once for each unique tweet, then
+    gathered into pair rows (see assemble_tree_feature_pairs)."""
+    unique_tweets = []
+    tweet_to_index = {}
+    for tweet in tweets:
+        if tweet not in tweet_to_index:
+            tweet_to_index[tweet] = len(unique_tweets)
+            unique_tweets.append(tweet)
+    np_first_index = np.array([tweet_to_index[tweet] for tweet in tweet1], dtype=np.int64)
+    np_second_index = np.array([tweet_to_index[tweet] for tweet in tweet2], dtype=np.int64)
+    return unique_tweets, np_first_index, np_second_index
 
 
 def give_model_the_label(labels):
@@ -155,149 +356,157 @@ def give_model_the_label(labels):
     return np.reshape(labels, [len(labels), 1])
 
 
-def calculate_sentiment_value_of_lines(tweets):
-    th = TwitterHawk(TWITTERHAWK_ADDRESS)
-    tweet_sentiment_input = [{'id': 1234, 'text': tweet} for tweet in tweets]
-    tweet_sentiments = th.analyze(tweet_sentiment_input)
+def calculate_sentiment_value_of_lines(tweets, sentiment_provider=None):
+    """Returns (negative, positive, neutral) sentiment for each tweet, scored by sentiment_provider
+    (default sentiment.get_sentiment_provider())."""
+    if sentiment_provider is None:
+        sentiment_provider = get_sentiment_provider()
+    return [tuple(sentiment) for sentiment in sentiment_provider.score(tweets)]
+
 
-    result = [
-        (ts['negative'], ts['positive'], ts['neutral'])
-        for ts in tweet_sentiments
-        ]
-    return result
+def calculate_tweet_sentiment(tweets, context):
+    """Negative, positive and neutral sentiment per tweet, scored together for all tweets."""
+    return context['sentiment_provider'].score(tweets)
 
 
-def calculate_tweet_pair_sentiment(tweets, tweet1, tweet2):
-    """Use TwitterHawk URL to generate sentiment per tweet, for each tweet in a tweet pair. First generates
-    a tweet to sentiment mapping, then generates tweet pairs using a function in tools.py. Looks up a sentiment
-    for each tweet in tweet pair and produces a numpy array of two sentiments per tweet pair for all pairs."""
-    tweet_sentiments = calculate_sentiment_value_of_lines(tweets)
-    tweet_to_sentiment = {}
-    for i in range(len(tweets)):
-        tweet_to_sentiment[tweets[i]] = tweet_sentiments[i]
+def calculate_hashtag_sentiment(context):
+    return context['sentiment_provider'].score([context['formatted_hashtag']])[0]
 
-    tweet_pair_sentiments = []
-    for i in range(len(tweet1)):
-        tweet1_sentiment = tweet_to_sentiment[tweet1[i]]
-        tweet2_sentiment = tweet_to_sentiment[tweet2[i]]
-        tweet_pair_sentiments.append(tweet1_sentiment + tweet2_sentiment)
-    np_data = np.array(tweet_pair_sentiments)
-    return np_data
 
+def calculate_tweet_lengths(tweets, context):
+    """Length of each tweet in tokens and in characters."""
+    return np.array([[len(tweet.split(' ')), len(tweet)] for tweet in tweets])
 
-def calculate_tweet_pair_distance_to_centroid_word_embeddings(tweets, tweet1, tweet2, word_to_glove):
-    tweet_centroids = {}
-    for i, tw in enumerate(tweets):
-        centroid = np.mean([word_to_glove[token] for token in tw.split(' ') if token in word_to_glove], axis=0)
-        tweet_centroids[tw] = centroid
 
-    all_tweets_centroid = np.mean([c for c in tweet_centroids.values()], axis=0)
+def stack_tweet_token_embeddings(tweets, word_to_glove):
+    """Stack the GloVe vectors of the in-vocabulary tokens of all tweets into one [tokens, glove size]
+    array, tweet after tweet. Returns that array and the number of rows belonging to each tweet."""
+    glove_size = len(word_to_glove[next(iter(word_to_glove))])
+    token_embeddings = []
+    tweet_lengths = []
+    for tweet in tweets:
+        embeddings = [word_to_glove[token] for token in tweet.split(' ') if token in word_to_glove]
+        token_embeddings.extend(embeddings)
+        tweet_lengths.append(len(embeddings))
+    np_token_embeddings = np.array(token_embeddings, dtype=np.float64).reshape([-1, glove_size])
+    return np_token_embeddings, tweet_lengths
 
-    tweet_pair_distances = []
-    for i in range(len(tweet1)):
-        tweet1_centroid = tweet_centroids[tweet1[i]]
-        tweet2_centroid = tweet_centroids[tweet2[i]]
 
-        tweet1_cosine = scipy.spatial.distance.cosine(tweet1_centroid, all_tweets_centroid)
-        tweet1_euclidean = scipy.spatial.distance.euclidean(tweet1_centroid, all_tweets_centroid)
-        tweet2_cosine = scipy.spatial.distance.cosine(tweet2_centroid, all_tweets_centroid)
-        tweet2_euclidean = scipy.spatial.distance.euclidean(tweet2_centroid, all_tweets_centroid)
+def calculate_cosine_and_euclidean_distances(np_vectors, np_target):
+    """Returns [vectors, 2] cosine and euclidean distances from each row of np_vectors to np_target,
+    as computed by scipy.spatial.distance.cosine and euclidean."""
+    np_target = np.asarray(np_target, dtype=np.float64)
+    np_norms = np.linalg.norm(np_vectors, axis=1)
+    np_cosine = 1.0 - np.dot(np_vectors, np_target) / (np_norms * np.linalg.norm(np_target))
+    np_euclidean = np.linalg.norm(np_vectors - np_target, axis=1)
+    return np.stack([np_cosine, np_euclidean], axis=1)
 
-        tweet_pair_distances.append([tweet1_cosine, tweet1_euclidean, tweet2_cosine, tweet2_euclidean, ])
 
-    np_data = np.array(tweet_pair_distances)
-    return np_data
+def calculate_tweet_centroids(tweets, word_to_glove):
+    """Returns the mean GloVe vector of the tokens of each tweet, and whether the tweet has any GloVe tokens."""
+    np_token_embeddings, tweet_lengths = stack_tweet_token_embeddings(tweets, word_to_glove)
+    return segment_reduce(np_token_embeddings, tweet_lengths)[2], np.array(tweet_lengths) > 0
 
 
-def calculate_tweet_pair_oov(tweets, tweet1, tweet2, word_to_glove):
-    tweet_oov = {}
-    for i, tw in enumerate(tweets):
-        oov = np.sum([1 if token not in word_to_glove else 0 for token in tw.split(' ')], axis=0)
-        tweet_oov[tw] = oov
+def calculate_tweet_distance_to_centroid_word_embeddings(tweets, context):
+    """Cosine and euclidean distance from the GloVe centroid of each tweet to the centroid of all tweet
+    centroids of the hashtag. Tweets without any GloVe tokens get nan distances and are left out of the
+    hashtag centroid."""
+    np_all_centroids, np_has_embeddings = calculate_tweet_centroids(context['tweets'], context['word_to_glove'])
+    all_tweets_centroid = np.mean(np_all_centroids[np_has_embeddings], axis=0)
 
-    tweet_pair_oovs = []
-    for i in range(len(tweet1)):
-        tweet1_oov = tweet_oov[tweet1[i]]
-        tweet2_oov = tweet_oov[tweet2[i]]
+    np_centroids = calculate_tweet_centroids(tweets, context['word_to_glove'])[0]
+    return calculate_cosine_and_euclidean_distances(np_centroids, all_tweets_centroid)
 
-        tweet_pair_oovs.append([tweet1_oov, tweet2_oov])
 
-    np_data = np.array(tweet_pair_oovs)
-    return np_data
+def calculate_tweet_oov(tweets, context):
+    """Number of out-of-vocabulary words for GloVe embedding per tweet."""
+    word_to_glove = context['word_to_glove']
+    return np.array([sum([1 if token not in word_to_glove else 0 for token in tweet.split(' ')])
+                     for tweet in tweets])
 
 
-def calculate_tweet_pair_hashtag_distance(tweets, tweet1, tweet2, formatted_hashtag, word_to_glove):
-    hashtag_embeddings = [word_to_glove[t] for t in formatted_hashtag.split(' ') if t in word_to_glove]
+def calculate_tweet_hashtag_distance(tweets, context):
+    """Max, min and mean cosine and euclidean distance from the GloVe vector of each token of each tweet to
+    the mean GloVe vector of the hashtag words. Distances of all tokens are computed at once and reduced over
+    the tokens of each tweet with tools.segment_reduce. Tweets without any GloVe tokens get nan distances."""
+    word_to_glove = context['word_to_glove']
+    hashtag_embeddings = [word_to_glove[t] for t in context['formatted_hashtag'].split(' ') if t in word_to_glove]
     if len(hashtag_embeddings) != 0:
         hashtag_embedding = np.mean(hashtag_embeddings, axis=0)
     else:
         hashtag_embedding = np.zeros_like(word_to_glove[list(word_to_glove.keys())[0]]) + 0.0001
 
-    tweet_embeddings = {}
-    for i, tw in enumerate(tweets):
-        embeddings = [word_to_glove[token] for token in tw.split(' ') if token in word_to_glove]
-        tweet_embeddings[tw] = embeddings
-
-    tweet_pair_distances = []
-    for i in range(len(tweet1)):
-        tweet1_distances_cosine = [
-            scipy.spatial.distance.cosine(te, hashtag_embedding)
-            for te in tweet_embeddings[tweet1[i]]
-            ]
-        tweet1_distances_euclidean = [
-            scipy.spatial.distance.euclidean(te, hashtag_embedding)
-            for te in tweet_embeddings[tweet1[i]]
-            ]
-        tweet2_distances_cosine = [
-            scipy.spatial.distance.cosine(te, hashtag_embedding)
-            for te in tweet_embeddings[tweet2[i]]
-            ]
-        tweet2_distances_euclidean = [
-            scipy.spatial.distance.euclidean(te, hashtag_embedding)
-            for te in tweet_embeddings[tweet2[i]]
-            ]
-
-        tweet_pair_distances.append([
-            max(tweet1_distances_cosine), min(tweet1_distances_cosine), np.mean(tweet1_distances_cosine),
-            max(tweet1_distances_euclidean), min(tweet1_distances_euclidean), np.mean(tweet1_distances_euclidean),
-            max(tweet2_distances_cosine), min(tweet2_distances_cosine), np.mean(tweet2_distances_cosine),
-            max(tweet2_distances_euclidean), min(tweet2_distances_euclidean), np.mean(tweet2_distances_euclidean),
-        ])
-
-    np_data = np.array(tweet_pair_distances)
-    return np_data
-
-
-def calculate_tweet_pair_pos(tweets, tweet1, tweet2):
-    # possible_tags = ['CC', 'CD', 'DT', 'EX', 'FW', 'IN', 'JJ', 'JJR', 'JJS', 'LS', 'MD', 'NN', 'NNS', 'NNP', 'NNPS',
-    #                  'PDT', 'POS', 'PRP', 'PRP$', 'RB', 'RBR', 'RBS', 'RP', 'SYM', 'TO', 'UH', 'VB', 'VBD', 'VBG',
-    #                  'VBN', 'VBP', 'VBZ', 'WDT', 'WP', 'WP$', 'WRB', '.']
-    possible_tags = ['NN', 'NNS', 'JJ', 'IN', 'DT', 'VBP', 'NNP', 'VB', 'VBD', 'RB'] # top10 tags on training data
-    tag2id = {t: i for i, t in enumerate(possible_tags)}
-
-
-    tweet_pos = {}
-    for i, tw in enumerate(tweets):
-        tags = [tt[1] for tt in pos_tag(tw.split(' '))]  # pos_tag returns a list of (token, tag) pairs
-
-        tags_counts = Counter(tags)
-
-        np_tags = np.zeros(len(possible_tags))
-        for tag, counts in tags_counts.most_common():
+    np_token_embeddings, tweet_lengths = stack_tweet_token_embeddings(tweets, word_to_glove)
+    np_token_distances = calculate_cosine_and_euclidean_distances(np_token_embeddings, hashtag_embedding)
+    np_max, np_min, np_mean = segment_reduce(np_token_distances, tweet_lengths)
+
+    # Per tweet: max, min and mean cosine distance, then max, min and mean euclidean distance.
+    return np.stack([np_max[:, 0], np_min[:, 0], np_mean[:, 0],
+                     np_max[:, 1], np_min[:, 1], np_mean[:, 1]], axis=1)
+
+
+def tag_token_sequences_with_cache(token_sequences, cache_key, workers=1, cache_path=BOOST_TREE_POS_TAG_CACHE_FILE_PATH):
+    """Returns a dictionary from each of token_sequences (tuples of tokens) to its POS tags. Tags are kept in a
+    cache at cache_path, which is discarded if cache_key (the tagger version) changes. Sequences missing from
+    the cache are tagged with nltk.pos_tag_sents in chunks of POS_TAG_CHUNK_SIZE, in workers parallel processes."""
+    cache = {'key': cache_key, 'tags': {}}
+    if os.path.exists(cache_path):
+        saved_cache = pickle.load(open(cache_path, 'rb'))
+        if saved_cache['key'] == cache_key:
+            cache = saved_cache
+    sequence_to_tags = cache['tags']
+    missing_sequences = sorted(set(token_sequences) - set(sequence_to_tags.keys()))
+    if len(missing_sequences) > 0:
+        print 'POS tagging %s tweets' % len(missing_sequences)
+        chunks = [missing_sequences[start:start + POS_TAG_CHUNK_SIZE]
+                  for start in range(0, len(missing_sequences), POS_TAG_CHUNK_SIZE)]
+        for chunk, chunk_tags in zip(chunks, map_hashtags(tag_token_sequences, chunks, workers=workers)):
+            sequence_to_tags.update(zip(chunk, chunk_tags))
+        dump_pickle_atomically(cache, cache_path)
+    return {token_sequence: sequence_to_tags[token_sequence] for token_sequence in set(token_sequences)}
+
+
+def tag_token_sequences(token_sequences):
+    """Tag a batch of token sequences with one nltk.pos_tag_sents call. Returns a tuple of tags per sequence."""
+    tagged_sequences = nltk.pos_tag_sents([list(token_sequence) for token_sequence in token_sequences])
+    return [tuple([tag for token, tag in tagged_sequence]) for tagged_sequence in tagged_sequences]
+
+
+def calculate_tweet_pos(tweets, context):
+    """Number of tokens of each tweet tagged with each of POS_TAGS, as a uint8 matrix. Tags come from
+    context['pos_tags'] (see tag_token_sequences_with_cache), tweets missing from it are tagged in one batch."""
+    token_sequences = [tuple(tweet.split(' ')) for tweet in tweets]
+    sequence_to_tags = dict(context.get('pos_tags') or {})
+    missing_sequences = list(set(token_sequences) - set(sequence_to_tags.keys()))
+    if len(missing_sequences) > 0:
+        sequence_to_tags.update(zip(missing_sequences, tag_token_sequences(missing_sequences)))
+
+    tag2id = {t: i for i, t in enumerate(POS_TAGS)}
+    tweet_positions = []
+    tag_ids = []
+    for i, token_sequence in enumerate(token_sequences):
+        for tag in sequence_to_tags[token_sequence]:
             if tag in tag2id:
-                np_tags[tag2id[tag]] = counts
-
-        tweet_pos[tw] = np_tags
-
-    tweet_pair_tags = []
-    for i in range(len(tweet1)):
-        tweet1_pos = tweet_pos[tweet1[i]]
-        tweet2_pos = tweet_pos[tweet2[i]]
-
-        tweet_pair_tags.append(np.hstack([tweet1_pos, tweet2_pos]))
-
-    np_data = np.array(tweet_pair_tags)
-    return np_data
+                tweet_positions.append(i)
+                tag_ids.append(tag2id[tag])
+    np_counts = np.bincount(np.array(tweet_positions, dtype=np.int64) * len(POS_TAGS) +
+                            np.array(tag_ids, dtype=np.int64), minlength=len(tweets) * len(POS_TAGS))
+    return np.minimum(np_counts, 255).astype(np.uint8).reshape([len(tweets), len(POS_TAGS)])
+
+
+# Features of the feature bucket, in column order. To add a feature, write a function computing it for
+# a batch of tweets (or for the hashtag) and register it here.
+TREE_FEATURES = [
+    TreeFeature('sentiment', 3, calculate_tweet_sentiment, needs=['sentiment']),
+    TreeFeature('hashtag_sentiment', 3, calculate_hashtag_sentiment, per_hashtag=True, needs=['sentiment']),
+    TreeFeature('length', 2, calculate_tweet_lengths),
+    TreeFeature('centroid_distance', 2, calculate_tweet_distance_to_centroid_word_embeddings,
+                uses_all_tweets=True, needs=['glove']),
+    TreeFeature('oov', 1, calculate_tweet_oov, needs=['glove']),
+    TreeFeature('hashtag_distance', 6, calculate_tweet_hashtag_distance, needs=['glove']),
+    TreeFeature('pos', len(POS_TAGS), calculate_tweet_pos, needs=['pos']),
+]
 
 
 if __name__ == '__main__':
@@ -5,11 +5,16 @@ import requests
 
 
 TWITTERHAWK_ADDRESS = 'http://twitterhawk.deephawk.org'
+# Seconds to wait for the service to connect or send data before a request fails.
+TWITTERHAWK_TIMEOUT = 60
 
 
 class TwitterHawk(object):
-    def __init__(self, address, separate=True):
+    def __init__(self, address, separate=True, timeout=TWITTERHAWK_TIMEOUT):
         self.address = address
+        self.timeout = timeout
+        # Reuse one connection for all requests.
+        self.session = requests.Session()
 
         self.address_analyze = os.path.join(self.address, 'analyze')
         if separate:
@@ -22,7 +27,7 @@ class TwitterHawk(object):
         """
 
         try:
-            r = requests.post(self.address_analyze, json=tweets)
+            r = self.session.post(self.address_analyze, json=tweets, timeout=self.timeout)
             if r.status_code == 200:
                 results = r.json()
 
@@ -33,6 +38,7 @@ class TwitterHawk(object):
         except ValueError as ex:
             logging.error('TiwtterHawk error: %s', ex)
             return None
-        except requests.exceptions.ConnectionError as ex:
-            logging.error('TiwtterHawk connection error: %s', ex)
+        except requests.exceptions.RequestException as ex:
+            # Connection errors, timeouts and broken responses; callers may retry.
+            logging.error('TiwtterHawk request error: %s', ex)
             return None
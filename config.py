@@ -12,6 +12,9 @@ TWEET_PAIR_LABEL_RANDOM_SEED = 'hello world'
 
 # GloVe embedding dataset path
 WORD_VECTORS_FILE_PATH = os.path.join(DATA_DIR, 'glove.twitter.27B/glove.twitter.27B.200d.txt')
+# Binary cache of the GloVe dataset (float32 matrix and word to row index)
+WORD_VECTORS_MATRIX_FILE_PATH = os.path.join(DATA_DIR, 'glove.twitter.27B/glove.twitter.27B.200d.bin')
+WORD_VECTORS_INDEX_FILE_PATH = os.path.join(DATA_DIR, 'glove.twitter.27B/glove.twitter.27B.200d_index.cpkl')
 
 # Main #HashtagWars dataset paths
 SEMEVAL_HUMOR_TRAIN_DIR = os.path.join(DATA_DIR, 'train_dir/train_data/')
@@ -40,6 +43,8 @@ CHAR_HUMOR_MODEL_DIR = os.path.join(DATA_DIR, 'char-only_humor_models/')
 HUMOR_TRAIN_TWEET_PAIR_PREDICTIONS = os.path.join(DATA_DIR, 'train_tweet_pair_predictions.cpkl')
 HUMOR_TRAIN_PREDICTION_HASHTAGS = os.path.join(DATA_DIR, 'train_prediction_hashtags')
 HUMOR_TRAIN_PREDICTION_LABELS = os.path.join(DATA_DIR, 'train_prediction_labels')
+# Out-of-fold predictions of each finished (model, fold), kept so an interrupted run can resume
+HUMOR_TRAIN_FOLD_PREDICTIONS_DIR = os.path.join(DATA_DIR, 'train_fold_predictions/')
 
 # Prediction input for ensemble model (trial)
 HUMOR_TRIAL_TWEET_PAIR_PREDICTIONS = os.path.join(DATA_DIR, 'trial_tweet_pair_predictions.cpkl')
@@ -59,8 +64,12 @@ HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR = os.path.join(DATA_DIR, 'train_numpy_tweet_pair
 HUMOR_TRIAL_TWEET_PAIR_CHAR_DIR = os.path.join(DATA_DIR, 'trial_numpy_tweet_pairs/')
 HUMOR_CHAR_TO_INDEX_FILE_PATH = os.path.join(DATA_DIR, 'humor_char_to_index.cpkl')
 HUMOR_INDEX_TO_WORD_FILE_PATH = os.path.join(DATA_DIR, 'humor_index_to_word.cpkl')
+HUMOR_VOCABULARY_FILE_PATH = os.path.join(DATA_DIR, 'humor_vocabulary.cpkl')
+HUMOR_VOCABULARY_MANIFEST_FILE_PATH = os.path.join(DATA_DIR, 'humor_vocabulary_manifest.cpkl')
 HUMOR_WORD_TO_GLOVE_FILE_PATH = os.path.join(DATA_DIR, 'humor_word_to_glove.cpkl')
 HUMOR_WORD_TO_PHONETIC_FILE_PATH = os.path.join(DATA_DIR, 'humor_word_to_phonetic.cpkl')
+# Tokenized tweets of each hashtag file, so files are formatted and tokenized only once (see load_tweets_from_hashtag)
+TOKENIZED_TWEET_CACHE_DIR = os.path.join(DATA_DIR, 'tokenized_tweet_cache/')
 
 HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR = os.path.join(DATA_DIR, 'training_tweet_pair_embeddings/')
 HUMOR_TRIAL_TWEET_PAIR_EMBEDDING_DIR = os.path.join(DATA_DIR, 'trial_tweet_pair_embeddings/')
@@ -75,11 +84,20 @@ BOOST_TREE_TWEET_PAIR_TRIAL_DIR = os.path.join(DATA_DIR, 'tree_trial/')
 BOOST_TREE_TWEET_PAIR_EVAL_DIR = os.path.join(DATA_DIR, 'tree_eval_data/')
 
 BOOST_TREE_TRAIN_TWEET_PAIR_PREDICTIONS = os.path.join(DATA_DIR, 'boost_tree_train_tweet_pair_predictions.cpkl')
+BOOST_TREE_TRAIN_FOLD_PREDICTIONS_DIR = os.path.join(DATA_DIR, 'boost_tree_train_fold_predictions/')
 BOOST_TREE_TRIAL_TWEET_PAIR_PREDICTIONS = os.path.join(DATA_DIR, 'boost_tree_trial_tweet_pair_predictions.cpkl')
 BOOST_TREE_EVAL_TWEET_PAIR_PREDICTIONS = os.path.join(DATA_DIR, 'boost_tree_eval_tweet_pair_predictions.cpkl')
 
 BOOST_TREE_MODEL_FILE_PATH = os.path.join(DATA_DIR, 'boost_tree_model.bin')
 
+# Sentiment of the feature bucket: 'lexicon' scores offline from a word valence lexicon (i.e. VADER),
+# 'http' asks the TwitterHawk service and caches its scores
+BOOST_TREE_SENTIMENT_PROVIDER = 'lexicon'
+SENTIMENT_LEXICON_FILE_PATH = os.path.join(DATA_DIR, 'vader_lexicon.txt')
+SENTIMENT_HTTP_CACHE_FILE_PATH = os.path.join(DATA_DIR, 'sentiment_http_cache.cpkl')
+# POS tags of tweet tokens for the feature bucket, shared by all datasets
+BOOST_TREE_POS_TAG_CACHE_FILE_PATH = os.path.join(DATA_DIR, 'pos_tag_cache.cpkl')
+
 
 # PARAMETERS
 HUMOR_MAX_WORDS_IN_TWEET = 20  # All winning tweets are under 30 words long
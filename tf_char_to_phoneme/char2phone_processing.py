@@ -16,6 +16,7 @@ from config import CMU_DICTIONARY_FILE_PATH
 from config import CMU_NP_PRONUNCIATIONS_FILE_PATH
 from tf_tools import MAX_WORD_SIZE
 from tf_tools import MAX_PRONUNCIATION_SIZE
+from tools import Vocabulary
 
 
 def main():
@@ -68,19 +69,13 @@ def build_character_vocabulary_from_cmu():
     all characters present in the dataset. Maps each character
     to a unique index. All lines that start with a ; are ignored; they are comments."""
     print 'Building character vocabulary'
-    characters = ['']
+    characters = Vocabulary([''])
     with open(CMU_DICTIONARY_FILE_PATH) as f:
         for line in f:
             if line[0] != ';':  # All lines with ; are comments, ignore them
                 word, pronunciation = extract_word_and_pronunciation_from_line(line)
-                for char in word:
-                    if char != '\n':
-                        if char not in characters:
-                            characters.append(char)
-    char_to_index = {}
-    for i in range(len(characters)):
-        char_to_index[characters[i]] = i
-    return char_to_index
+                characters.add_all([char for char in word if char != '\n'])
+    return characters.to_dictionary()
 
 
 def get_number_of_word_pronunciation_pairs():
@@ -1,20 +1,31 @@
-"""David Donahue 2017. Trying out training and predicting using the humor model."""
+"""David Donahue 2017. Trying out training and predicting using the humor model.
+Add '--workers N' to train cross-validation folds in N parallel processes. Predictions of each finished fold
+are saved as soon as it ends, and a rerun after an interruption only trains the folds that are missing."""
 from keras import backend as K
 import tensorflow as tf
+import multiprocessing
+import os
 import random
+import sys
 import numpy as np
 import humor_predictor
 import cPickle as pickle
 from humor_model import load_build_train_and_predict
+from humor_model import load_humor_training_data
 from config import EMB_CHAR_HUMOR_MODEL_DIR, CHAR_HUMOR_MODEL_DIR, EMB_HUMOR_MODEL_DIR
 from config import HUMOR_TRIAL_TWEET_PAIR_CHAR_DIR, HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR
 from config import HUMOR_CHAR_TO_INDEX_FILE_PATH, SEMEVAL_HUMOR_TRAIN_DIR
 from config import HUMOR_TRAIN_TWEET_PAIR_PREDICTIONS, HUMOR_TRAIN_PREDICTION_HASHTAGS
 from config import HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, HUMOR_TRAIN_PREDICTION_LABELS
 from config import SEMEVAL_HUMOR_TRIAL_DIR
+from config import HUMOR_TRAIN_FOLD_PREDICTIONS_DIR
+from config import HUMOR_WORD_TO_GLOVE_FILE_PATH, HUMOR_WORD_TO_PHONETIC_FILE_PATH
 from tf_tools import GPU_OPTIONS
+from tf_tools import limit_session_threads
 from tools import load_hashtag_data_and_vocabulary, get_hashtag_file_names
-from tools import load_hashtag_data
+from tools import load_hashtag_tweet_store
+from tools import map_hashtags, get_worker_count
+from tools import BuildManifest, BUILD_MANIFEST_FILE, hash_build_inputs, dump_pickle_atomically
 
 
 learning_rate = .00005
@@ -22,6 +33,10 @@ num_epochs = 1
 dropout = 1
 hidden_dim_size = 800
 num_groups = 5
+# Model variants trained for the ensemble: (model_save_dir, use_emb_model, use_char_model).
+model_variants = [(EMB_CHAR_HUMOR_MODEL_DIR, True, True),
+                  (EMB_HUMOR_MODEL_DIR, True, False),
+                  (CHAR_HUMOR_MODEL_DIR, False, True)]
 
 
 def main():
@@ -29,41 +44,25 @@ def main():
     hashtags in the training directory. These predictions will be used as features to the
     ensemble model."""
     sync_seed = 'hello world'
-    emb_char_predictions, hashtag_names, emb_char_accuracies = \
-        train_and_make_predictions_on_all_hashtags(num_groups,
-                                                   model_save_dir=EMB_CHAR_HUMOR_MODEL_DIR,
-                                                   use_emb_model=True,
-                                                   use_char_model=True,
-                                                   seed=sync_seed)
-
-    emb_predictions, hashtag_names2, emb_accuracies = \
-        train_and_make_predictions_on_all_hashtags(num_groups,
-                                                   model_save_dir=EMB_HUMOR_MODEL_DIR,
-                                                   use_emb_model=True,
-                                                   use_char_model=False,
-                                                   seed=sync_seed)
-
-    char_predictions, hashtag_names3, char_accuracies = \
-        train_and_make_predictions_on_all_hashtags(num_groups,
-                                                   model_save_dir=CHAR_HUMOR_MODEL_DIR,
-                                                   use_emb_model=False,
-                                                   use_char_model=True,
-                                                   seed=sync_seed)
+    # All variants and folds are scheduled together, so that parallel workers stay busy.
+    [emb_char_predictions, emb_predictions, char_predictions], hashtag_names, \
+        [emb_char_accuracies, emb_accuracies, char_accuracies] = \
+        train_and_make_predictions_for_variants(num_groups, model_variants, seed=sync_seed,
+                                                workers=get_worker_count(sys.argv),
+                                                fold_predictions_dir=HUMOR_TRAIN_FOLD_PREDICTIONS_DIR)
 
     assert len(emb_char_predictions) == len(emb_predictions)
     assert len(emb_predictions) == len(char_predictions)
     assert len(char_predictions) == len(hashtag_names)
     print str(char_predictions[0].shape)
-    assert hashtag_names == hashtag_names2
-    assert hashtag_names2 == hashtag_names3
     random.seed(sync_seed)
     hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRAIN_DIR)
     # Get labels
     hashtag_labels = []
     for hashtag_name in hashtag_names:
         print 'Loading label for hashtag %s' % hashtag_name
-        np_first_tweets, np_second_tweets, np_labels, first_tweet_ids, second_tweet_ids, np_hashtag = \
-            load_hashtag_data(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, hashtag_name)
+        np_tweet_gloves, np_first_index, np_second_index, np_labels, tweet_ids, np_hashtag = \
+            load_hashtag_tweet_store(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, hashtag_name)
         hashtag_labels.append(np_labels)
 
     all_predictions = []
@@ -78,79 +77,199 @@ def main():
     pickle.dump(hashtag_labels, open(HUMOR_TRAIN_PREDICTION_LABELS, 'wb'))
 
 
-def train_and_make_predictions_on_all_hashtags(num_groups, model_save_dir=EMB_CHAR_HUMOR_MODEL_DIR, use_emb_model=True, use_char_model=True, seed=None):
-    print 'use_emb_model: %s' % use_emb_model
-    print 'use_char_model: %s' % use_char_model
+def train_and_make_predictions_on_all_hashtags(num_groups, model_save_dir=EMB_CHAR_HUMOR_MODEL_DIR, use_emb_model=True,
+                                               use_char_model=True, seed=None, workers=1, fold_predictions_dir=None):
     """Makes predictions on all hashtags in training directory, by dividing them into num_groups groups. For each group, trains on all
-    hashtags not in the group and predicts on group. Saves trained model in model_save_dir.
+    hashtags not in the group and predicts on group. Saves the model trained for each group in its own directory
+    inside model_save_dir (see get_fold_model_dir).
 
     use_emb_model - flag indicating whether to train using word embeddings as features
-    use_char_model - flag indicating whether to train using character indices as features"""
+    use_char_model - flag indicating whether to train using character indices as features
+    workers - number of processes training groups in parallel
+    fold_predictions_dir - directory to save the predictions of each group in, so an interrupted run can resume"""
+    print 'use_emb_model: %s' % use_emb_model
+    print 'use_char_model: %s' % use_char_model
+    variant_predictions, hashtag_names, variant_accuracies = \
+        train_and_make_predictions_for_variants(num_groups, [(model_save_dir, use_emb_model, use_char_model)],
+                                                seed=seed, workers=workers,
+                                                fold_predictions_dir=fold_predictions_dir)
+    return variant_predictions[0], hashtag_names, variant_accuracies[0]
+
+
+def train_and_make_predictions_for_variants(num_groups, variants, seed=None, workers=1, fold_predictions_dir=None):
+    """Makes out-of-fold predictions on all hashtags in training directory for several model variants. Hashtags
+    are divided into num_groups groups, and every (variant, group) fold trains on all hashtags not in the group
+    and predicts on the group. With workers > 1, folds run in parallel worker processes, each limited to an
+    equal share of the CPU threads. Training data and lookup tables are loaded once, before workers start, and
+    shared with them read-only. Returns, for each variant, the predictions and accuracies of all hashtags in
+    hashtag order, along with the hashtag names; results do not depend on the number of workers.
+
+    variants - list of (model_save_dir, use_emb_model, use_char_model)
+    seed - seed for the order of hashtags, and so for the groups
+    fold_predictions_dir - if given, the predictions of each fold are saved in this directory as soon as the
+        fold ends, and recorded in a build manifest. Folds recorded by an earlier run with the same hashtag
+        groups and training parameters are loaded instead of trained again"""
     if seed is not None:
         random.seed(seed)
     hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRAIN_DIR)
     print len(hashtag_names)
-    hashtag_predictions = []
-    hashtag_accuracies = []
-
-    # for i in range(len(hashtag_names)):
-    #     hashtag_name = hashtag_names[i]
-    #     num_lines = sum(1 for line in open(SEMEVAL_HUMOR_TRAIN_DIR + hashtag_name + '.tsv'))
-    for hashtag_group_index in range(num_groups):
-
-        num_hashtags = len(hashtag_names)
-        num_hashtags_in_group = num_hashtags / num_groups + 1
-        starting_hashtag_index = num_hashtags_in_group * hashtag_group_index
-        hashtags_in_group = hashtag_names[starting_hashtag_index:starting_hashtag_index + num_hashtags_in_group]
-
-        print hashtag_group_index, starting_hashtag_index, starting_hashtag_index + num_hashtags_in_group, num_hashtags_in_group
-        print hashtags_in_group
-        #
-        # Train on all hashtags not in group
-        K.clear_session()
-        K.set_session(tf.get_default_session())
-        trainable_vars = train_on_hashtags_in_group(hashtag_names, hashtags_in_group,
-                                                                       model_save_dir, use_emb_model,
-                                                                       use_char_model)
-
-        # Predict on hashtags in group
-        K.clear_session()
-        K.set_session(tf.get_default_session())
-        hp = humor_predictor.HumorPredictor(model_save_dir, use_char_model=use_char_model, use_emb_model=use_emb_model)
-        accuracies = []
-        counter = 0
-        for hashtag_name in hashtags_in_group:
-            assert hashtag_names[hashtag_group_index * num_hashtags_in_group + counter] == hashtag_name
-            print hashtag_name
-            np_predictions, np_output_prob, np_labels, first_tweet_ids, second_tweet_ids = hp(SEMEVAL_HUMOR_TRAIN_DIR, hashtag_name)
-            # np_first_tweets2, np_second_tweets2, np_labels2, first_tweet_ids2, second_tweet_ids2, np_hashtag2 = \
-            #     load_hashtag_data(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, hashtag_name)
-            # assert np_labels == np_labels2
-            accuracy = np.mean(np_predictions == np_labels)
-            print 'Hashtag accuracy: %s' % accuracy
-            accuracies.append(accuracy)
-            hashtag_predictions.append(np_output_prob)
-            hashtag_accuracies.append(accuracy)
-
-            print hashtag_name
-            print np_predictions.shape
-            counter += 1
-        print 'Trial accuracy: %s' % np.mean(accuracies)
-    return hashtag_predictions, hashtag_names, hashtag_accuracies
+    hashtag_groups = divide_hashtags_into_groups(hashtag_names, num_groups)
+    folds = [(variant_index, group_index) for variant_index in range(len(variants))
+             for group_index in range(num_groups)]
+
+    manifest = None
+    fold_predictions = {}
+    if fold_predictions_dir is not None:
+        training_data_hash = hash_training_data()
+        manifest = BuildManifest(os.path.join(fold_predictions_dir, BUILD_MANIFEST_FILE),
+                                 {'hashtag_names': hashtag_names, 'num_groups': num_groups,
+                                  'learning_rate': learning_rate, 'num_epochs': num_epochs, 'dropout': dropout,
+                                  'hidden_dim_size': hidden_dim_size})
+        for fold in folds:
+            fold_name, fold_hash = describe_fold(fold, variants, hashtag_groups, training_data_hash)
+            if manifest.is_fresh(fold_name, fold_hash):
+                print 'Fold %s already done' % fold_name
+                fold_predictions_path = get_fold_predictions_path(fold_predictions_dir, fold_name)
+                fold_predictions[fold] = pickle.load(open(fold_predictions_path, 'rb'))
+    remaining_folds = [fold for fold in folds if fold not in fold_predictions]
+
+    if len(remaining_folds) > 0:
+        data_cache = load_humor_training_data()
+        predictor_data = humor_predictor.HumorPredictorData()
+        num_threads = None
+        if workers > 1:
+            num_threads = max(1, multiprocessing.cpu_count() / min(workers, len(remaining_folds)))
+        fold_results = map_hashtags(train_and_predict_on_fold, remaining_folds,
+                                    shared_args=(variants, hashtag_groups, data_cache, predictor_data, num_threads,
+                                                 fold_predictions_dir),
+                                    workers=workers, ordered=False)
+        # Record each fold as soon as it ends, even if folds scheduled before it are still training.
+        for fold, hashtag_results in fold_results:
+            fold_predictions[fold] = hashtag_results
+            if manifest is not None:
+                fold_name, fold_hash = describe_fold(fold, variants, hashtag_groups, training_data_hash)
+                manifest.record(fold_name, fold_hash, [get_fold_predictions_path(fold_predictions_dir, fold_name)])
+                manifest.save()
+
+    hashtag_results_per_variant = [{} for _ in variants]
+    for (variant_index, group_index) in folds:
+        hashtag_results_per_variant[variant_index].update(fold_predictions[(variant_index, group_index)])
+
+    # Merge out-of-fold predictions in hashtag order.
+    variant_predictions = []
+    variant_accuracies = []
+    for hashtag_results in hashtag_results_per_variant:
+        variant_predictions.append([hashtag_results[hashtag_name][0] for hashtag_name in hashtag_names])
+        variant_accuracies.append([hashtag_results[hashtag_name][1] for hashtag_name in hashtag_names])
+    return variant_predictions, hashtag_names, variant_accuracies
+
+
+def divide_hashtags_into_groups(hashtag_names, num_groups):
+    """Divide hashtag names into num_groups consecutive groups of equal size (the last group may be smaller)."""
+    num_hashtags = len(hashtag_names)
+    num_hashtags_in_group = num_hashtags / num_groups + 1
+    return [hashtag_names[num_hashtags_in_group * hashtag_group_index:
+                          num_hashtags_in_group * (hashtag_group_index + 1)]
+            for hashtag_group_index in range(num_groups)]
+
+
+def describe_fold(fold, variants, hashtag_groups, training_data_hash=''):
+    """Returns the name of a (variant index, hashtag group index) fold, and a hash of the model variant, the
+    hashtags it leaves out and training_data_hash (see hash_training_data), under which the fold is recorded
+    in a build manifest."""
+    variant_index, hashtag_group_index = fold
+    model_save_dir, use_emb_model, use_char_model = variants[variant_index]
+    fold_name = '%s_fold_%s' % (os.path.basename(os.path.normpath(model_save_dir)), hashtag_group_index)
+    fold_hash = hash_build_inputs([], words=[str(use_emb_model), str(use_char_model), training_data_hash] +
+                                  hashtag_groups[hashtag_group_index])
+    return fold_name, fold_hash
+
+
+def hash_training_data():
+    """Returns a hash of the data every fold is trained and predicts on: the train tweet store and character
+    tweet pairs, the character vocabulary, the train hashtag files and the word tables of the predictor, so
+    that folds are trained again after humor_processing.py rebuilds any of them."""
+    file_paths = []
+    for directory in [HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR, SEMEVAL_HUMOR_TRAIN_DIR]:
+        file_paths.extend([os.path.join(directory, file_name) for file_name in sorted(os.listdir(directory))
+                           if file_name != BUILD_MANIFEST_FILE and not file_name.endswith('.tmp') and
+                           os.path.isfile(os.path.join(directory, file_name))])
+    file_paths.extend([HUMOR_CHAR_TO_INDEX_FILE_PATH, HUMOR_WORD_TO_GLOVE_FILE_PATH, HUMOR_WORD_TO_PHONETIC_FILE_PATH])
+    return hash_build_inputs(file_paths)
+
+
+def get_fold_predictions_path(fold_predictions_dir, fold_name):
+    """File holding the predictions of a fold (see describe_fold)."""
+    return os.path.join(fold_predictions_dir, fold_name + '.cpkl')
+
+
+def get_fold_model_dir(model_save_dir, hashtag_group_index):
+    """Directory in which the model trained without hashtag group hashtag_group_index is saved."""
+    return os.path.join(model_save_dir, 'fold_%s/' % hashtag_group_index)
+
+
+def train_and_predict_on_fold(fold, variants, hashtag_groups, data_cache, predictor_data, num_threads=None,
+                              fold_predictions_dir=None):
+    """Trains a model variant on all hashtags outside a hashtag group, and predicts on the hashtags of the group.
+    Returns a dictionary mapping each hashtag of the group to its predicted probabilities and accuracy.
+
+    fold - (variant index, hashtag group index)
+    variants - list of (model_save_dir, use_emb_model, use_char_model)
+    hashtag_groups - list of hashtag name groups (see divide_hashtags_into_groups)
+    data_cache - training data from humor_model.load_humor_training_data
+    predictor_data - humor_predictor.HumorPredictorData used for predictions
+    num_threads - maximum number of CPU threads of TF sessions, None for no limit
+    fold_predictions_dir - if given, the returned dictionary is also saved in this directory (see describe_fold)"""
+    variant_index, hashtag_group_index = fold
+    model_save_dir, use_emb_model, use_char_model = variants[variant_index]
+    if num_threads is not None:
+        limit_session_threads(num_threads)
+    hashtags_in_group = hashtag_groups[hashtag_group_index]
+    fold_model_dir = get_fold_model_dir(model_save_dir, hashtag_group_index)
+    print 'use_emb_model: %s, use_char_model: %s, group: %s' % (use_emb_model, use_char_model, hashtag_group_index)
+    print hashtags_in_group
+
+    # Train on all hashtags not in group
+    K.clear_session()
+    K.set_session(tf.get_default_session())
+    train_on_hashtags_in_group(None, hashtags_in_group, fold_model_dir, use_emb_model, use_char_model,
+                               data_cache=data_cache)
+
+    # Predict on hashtags in group
+    K.clear_session()
+    K.set_session(tf.get_default_session())
+    hp = humor_predictor.HumorPredictor(fold_model_dir, use_char_model=use_char_model, use_emb_model=use_emb_model,
+                                        data=predictor_data)
+    hashtag_results = {}
+    accuracies = []
+    for hashtag_name in hashtags_in_group:
+        print hashtag_name
+        np_predictions, np_output_prob, np_labels, first_tweet_ids, second_tweet_ids = hp(SEMEVAL_HUMOR_TRAIN_DIR, hashtag_name)
+        accuracy = np.mean(np_predictions == np_labels)
+        print 'Hashtag accuracy: %s' % accuracy
+        accuracies.append(accuracy)
+        hashtag_results[hashtag_name] = (np_output_prob, accuracy)
+        print np_predictions.shape
+    print 'Trial accuracy: %s' % np.mean(accuracies)
+    if fold_predictions_dir is not None:
+        fold_name, _ = describe_fold(fold, variants, hashtag_groups)
+        dump_pickle_atomically(hashtag_results, get_fold_predictions_path(fold_predictions_dir, fold_name))
+    return hashtag_results
 
 
 def train_on_hashtags_in_group(hashtag_names, hashtags_in_group,
-                               model_save_dir, use_emb_model, use_char_model):
+                               model_save_dir, use_emb_model, use_char_model, data_cache=None):
     """Given a list of hashtag names, divide into num_groups and train on all hashtags
     but those in that group. Save trained model in model_save_dir.
 
     use_emb_model - flag indicating whether to train using word embeddings as features
     use_char_model - flag indicating whether to train using character indices as features
-    model_save_dir - location to save model, should correspond with model configuration"""
+    model_save_dir - location to save model, should correspond with model configuration
+    data_cache - training data from humor_model.load_humor_training_data; loaded from disk if None"""
 
     load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_model,
                                  use_char_model, model_save_dir, hidden_dim_size,
-                                 leave_out_hashtags=hashtags_in_group)
+                                 leave_out_hashtags=hashtags_in_group, data_cache=data_cache)
     trainable_vars = tf.trainable_variables()
     return trainable_vars
 
@@ -32,14 +32,21 @@ from config import SEMEVAL_HUMOR_TRAIN_DIR
 from config import SEMEVAL_HUMOR_TRIAL_DIR
 from config import TWEET_SIZE
 from tf_tools import GPU_OPTIONS
+from tf_tools import create_session_config
 from tf_tools import HUMOR_DROPOUT
 from tf_tools import create_dense_layer
 from tf_tools import create_tensorboard_visualization
 from tf_tools import predict_on_hashtag
 from tf_tools import build_humor_model
+from tf_tools import save_humor_model_options
 from tools import extract_tweet_pair_from_hashtag_datas
 from tools import get_hashtag_file_names
-from tools import load_hashtag_data
+from tools import gather_tweet_embeddings
+from tools import load_hashtag_tweet_store
+from tools import convert_hashtag_to_word_ids
+from tools import load_word_embedding_matrix
+from tools import prefetch_batches
+from tools import sample_pair_batches
 from tools import load_hashtag_data_and_vocabulary
 
 ex = Experiment('humor_model')
@@ -64,6 +71,17 @@ def my_config():
     elif '-char-only' in sys.argv:
         use_emb_model = False
         model_save_dir = CHAR_HUMOR_MODEL_DIR
+    # Feed word ids and look up embeddings inside the model graph.
+    use_word_ids = '-word-ids' in sys.argv
+    # Stop tweet encoders at the last word of each tweet, and use the fused LSTM kernel.
+    dynamic_length = '-dynamic-length' in sys.argv
+    use_fused_lstm = '-fused-lstm' in sys.argv
+    # Train on shuffled fixed-size batches that mix pairs of all training hashtags.
+    batch_sampling = 'hashtag'
+    if '-pooled-batches' in sys.argv:
+        batch_sampling = 'pooled'
+    elif '-stratified-batches' in sys.argv:
+        batch_sampling = 'stratified'
 
 
 def build_embedding_humor_model_trainer(model_vars):
@@ -86,11 +104,25 @@ def build_embedding_humor_model_trainer(model_vars):
 
 def train_on_all_other_hashtags(model_vars, trainer_vars, hashtag_names, hashtag_datas, n_epochs=1,
                                 batch_size=50, learning_rate=EMBEDDING_HUMOR_MODEL_LEARNING_RATE,
-                                dropout=HUMOR_DROPOUT, model_save_dir=EMB_CHAR_HUMOR_MODEL_DIR, leave_out_hashtags=None):
+                                dropout=HUMOR_DROPOUT, model_save_dir=EMB_CHAR_HUMOR_MODEL_DIR, leave_out_hashtags=None,
+                                word_to_id=None, num_loader_threads=2, max_prefetched_batches=8,
+                                batch_sampling='hashtag', batch_tail='pad'):
     """Trains on all hashtags in the SEMEVAL_HUMOR_TRAIN_DIR directory. Extracts inputs and labels from
     each hashtag, and trains in batches. Inserts input into model and evaluates output using model_vars.
     Minimizes loss defined in trainer_vars. Repeats for n_epoch epochs. For zero epochs, the model is not trained
-    and an accuracy of -1 is returned."""
+    and an accuracy of -1 is returned. If word_to_id is given, the model must take word ids (see build_humor_model);
+    the word ids of each hashtag are computed once and reused in later epochs. Hashtags are visited in a new
+    random order each epoch. num_loader_threads threads load hashtags and assemble batches in the background,
+    keeping up to max_prefetched_batches batches ready (see tools.prefetch_batches).
+
+    batch_sampling - 'hashtag' trains on the pairs of one hashtag at a time. 'pooled' pools the pairs of all
+        training hashtags and trains on shuffled batches that mix hashtags, and 'stratified' does the same
+        with every batch holding hashtags in proportion to their size (see tools.sample_pair_batches).
+        Pooled modes report a single accuracy per epoch instead of one per hashtag
+    batch_tail - for pooled modes, 'pad' fills the last batch with random pairs so all batches have
+        batch_size pairs, 'drop' leaves out leftover pairs, 'keep' trains on a smaller last batch"""
+    if batch_sampling not in ['hashtag', 'pooled', 'stratified']:
+        raise ValueError('Unknown batch sampling: %s' % batch_sampling)
     if leave_out_hashtags is None:
         leave_out_hashtags = []
     if isinstance(leave_out_hashtags, str):
@@ -102,86 +134,84 @@ def train_on_all_other_hashtags(model_vars, trainer_vars, hashtag_names, hashtag
      tf_tweet1, tf_tweet2] = model_vars
     [tf_loss, tf_labels] = trainer_vars
 
-    sess = tf.InteractiveSession(config=tf.ConfigProto(gpu_options=GPU_OPTIONS))
+    sess = tf.InteractiveSession(config=create_session_config())
     train_op = tf.train.AdamOptimizer(learning_rate).minimize(tf_loss)
     init = tf.initialize_all_variables()
     with tf.name_scope("SAVER"):
         saver = tf.train.Saver(max_to_keep=10)
     sess.run(init)
+    sess.run(tf.local_variables_initializer())
+
+    hashtag_word_ids = {}
+
+    def generate_batches(trainer_hashtag_name):
+        return generate_hashtag_training_batches(trainer_hashtag_name, hashtag_datas, batch_size,
+                                                 word_to_id=word_to_id, hashtag_word_ids=hashtag_word_ids)
+
+    trainer_hashtag_names = []
+    for trainer_hashtag_name in hashtag_names:
+        if trainer_hashtag_name not in leave_out_hashtags:
+            trainer_hashtag_names.append(trainer_hashtag_name)
+        else:
+            print 'Do not train on current hashtag: %s' % trainer_hashtag_name
+
+    hashtag_pool = None
+    if batch_sampling != 'hashtag':
+        hashtag_pool = [load_training_hashtag(trainer_hashtag_name, hashtag_datas, word_to_id=word_to_id,
+                                              hashtag_word_ids=hashtag_word_ids)
+                        for trainer_hashtag_name in trainer_hashtag_names]
+
+    def assemble_batches(np_batch_pairs):
+        return [assemble_pooled_training_batch(hashtag_pool, np_batch_pairs)]
 
     accuracies = []
     for epoch in range(n_epochs):
         if n_epochs > 1:
             print 'Epoch %s' % epoch
         print hashtag_names
-        for trainer_hashtag_name in hashtag_names:
-            print trainer_hashtag_name
-            if trainer_hashtag_name not in leave_out_hashtags:
-                # Train on this hashtag.
-                np_first_tweets, np_second_tweets, np_labels, first_tweet_ids, second_tweet_ids, np_hashtag = \
-                    load_hashtag_data(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, trainer_hashtag_name)
-
-                np_first_tweets_char, np_second_tweets_char = \
-                    extract_tweet_pair_from_hashtag_datas(hashtag_datas, trainer_hashtag_name)
-                current_batch_size = batch_size
-                # Use these parameters to keep track of batch size and start location.
-                starting_training_example = 0
-                num_batches = np_first_tweets.shape[0] / batch_size
-                remaining_batch_size = np_first_tweets.shape[0] % batch_size
-                batch_accuracies = []
-                batch_losses = []
-                # print 'Training on hashtag %s' % trainer_hashtag_name
-                for i in range(num_batches + 1):
-                    # If we are on the last batch, we are running leftover examples.
-                    # Otherwise, we stick to global batch_size.
-                    if i == num_batches:
-                        current_batch_size = remaining_batch_size
-                    else:
-                        current_batch_size = batch_size
-                    if current_batch_size > 0:
-                        np_batch_first_tweets = np_first_tweets[
-                                                starting_training_example:starting_training_example + current_batch_size,
-                                                :]
-                        np_batch_second_tweets = np_second_tweets[
-                                                 starting_training_example:starting_training_example + current_batch_size,
-                                                 :]
-                        np_batch_labels = np_labels[
-                                          starting_training_example:starting_training_example + current_batch_size]
-                        np_batch_hashtag = np_hashtag[
-                                           starting_training_example:starting_training_example + current_batch_size, :]
-                        np_batch_first_tweets_char = np_first_tweets_char[
-                                                     starting_training_example:starting_training_example + current_batch_size,
-                                                     :]
-                        np_batch_second_tweets_char = np_second_tweets_char[
-                                                      starting_training_example:starting_training_example + current_batch_size,
-                                                      :]
-                        # Run train step here.
-                        [np_batch_predictions, batch_loss, _] = sess.run([tf_predictions, tf_loss, train_op],
-                                                                         feed_dict={
-                                                                             tf_first_input_tweets: np_batch_first_tweets,
-                                                                             tf_second_input_tweets: np_batch_second_tweets,
-                                                                             tf_labels: np_batch_labels,
-                                                                             tf_batch_size: current_batch_size,
-                                                                             tf_hashtag: np_batch_hashtag,
-                                                                             tf_dropout_rate: dropout,
-                                                                             tf_tweet1: np_batch_first_tweets_char,
-                                                                             tf_tweet2: np_batch_second_tweets_char})
-
-                        batch_accuracy = sklearn.metrics.accuracy_score(np_batch_labels, np_batch_predictions)
-
-                        batch_accuracies.append(batch_accuracy)
-                        batch_losses.append(batch_loss)
-
-                    starting_training_example += current_batch_size
-
-                hashtag_accuracy = np.mean(batch_accuracies)
-                hashtag_loss = np.mean(batch_losses)
-                print 'Hashtag %s accuracy: %s' % (trainer_hashtag_name, hashtag_accuracy)
-                print 'Hashtag loss: %s' % hashtag_loss
-                accuracies.append(hashtag_accuracy)
-
+        if hashtag_pool is None:
+            random.shuffle(trainer_hashtag_names)
+            epoch_batches = prefetch_batches(trainer_hashtag_names, generate_batches, num_threads=num_loader_threads,
+                                             max_prefetched_batches=max_prefetched_batches)
+            report_names = trainer_hashtag_names
+        else:
+            random_state = np.random.RandomState(random.randint(0, 2 ** 31 - 1))
+            batch_pairs = sample_pair_batches([hashtag_data['first_index'].shape[0] for hashtag_data in hashtag_pool],
+                                              batch_size, random_state, stratified=batch_sampling == 'stratified',
+                                              tail=batch_tail)
+            epoch_batches = prefetch_batches(batch_pairs, assemble_batches, num_threads=num_loader_threads,
+                                             max_prefetched_batches=max_prefetched_batches)
+            report_names = [None]
+        hashtag_batch_accuracies = {report_name: [] for report_name in report_names}
+        hashtag_batch_losses = {report_name: [] for report_name in report_names}
+        for batch in epoch_batches:
+            # Run train step here.
+            [np_batch_predictions, batch_loss, _] = sess.run([tf_predictions, tf_loss, train_op],
+                                                             feed_dict={
+                                                                 tf_first_input_tweets: batch['first_tweets'],
+                                                                 tf_second_input_tweets: batch['second_tweets'],
+                                                                 tf_labels: batch['labels'],
+                                                                 tf_batch_size: batch['labels'].shape[0],
+                                                                 tf_hashtag: batch['hashtag'],
+                                                                 tf_dropout_rate: dropout,
+                                                                 tf_tweet1: batch['first_tweets_char'],
+                                                                 tf_tweet2: batch['second_tweets_char']})
+
+            batch_accuracy = sklearn.metrics.accuracy_score(batch['labels'], np_batch_predictions)
+
+            hashtag_batch_accuracies[batch['hashtag_name']].append(batch_accuracy)
+            hashtag_batch_losses[batch['hashtag_name']].append(batch_loss)
+
+        for report_name in report_names:
+            hashtag_accuracy = np.mean(hashtag_batch_accuracies[report_name])
+            hashtag_loss = np.mean(hashtag_batch_losses[report_name])
+            if report_name is None:
+                print 'Epoch accuracy: %s' % hashtag_accuracy
+                print 'Epoch loss: %s' % hashtag_loss
             else:
-                print 'Do not train on current hashtag: %s' % trainer_hashtag_name
+                print 'Hashtag %s accuracy: %s' % (report_name, hashtag_accuracy)
+                print 'Hashtag loss: %s' % hashtag_loss
+            accuracies.append(hashtag_accuracy)
         print 'Saving..'
         saver.save(sess, os.path.join(model_save_dir, 'emb_humor_model'),
                    global_step=epoch)  # Save model after every epoch
@@ -195,6 +225,84 @@ def train_on_all_other_hashtags(model_vars, trainer_vars, hashtag_names, hashtag
     return sess, training_accuracy
 
 
+def load_training_hashtag(trainer_hashtag_name, hashtag_datas, word_to_id=None, hashtag_word_ids=None):
+    """Load the tweet pairs of a training hashtag from its tweet store. Returns a dictionary with the hashtag
+    tweets (tweet_inputs: embeddings, or word ids if word_to_id is given), the store indices of the first
+    and second tweet of each pair, labels, hashtag input, and the character inputs of each pair. Word ids
+    are cached per hashtag in hashtag_word_ids if it is given."""
+    np_tweet_inputs, np_first_index, np_second_index, np_labels, tweet_ids, np_hashtag = \
+        load_hashtag_tweet_store(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, trainer_hashtag_name)
+    if word_to_id is not None:
+        if hashtag_word_ids is None:
+            hashtag_word_ids = {}
+        if trainer_hashtag_name not in hashtag_word_ids:
+            hashtag_word_ids[trainer_hashtag_name] = \
+                convert_hashtag_to_word_ids(SEMEVAL_HUMOR_TRAIN_DIR, trainer_hashtag_name, word_to_id)[:2]
+        np_tweet_inputs, np_hashtag = hashtag_word_ids[trainer_hashtag_name]
+
+    np_first_tweets_char, np_second_tweets_char = \
+        extract_tweet_pair_from_hashtag_datas(hashtag_datas, trainer_hashtag_name)
+    return {'hashtag_name': trainer_hashtag_name,
+            'tweet_inputs': np_tweet_inputs,
+            'first_index': np_first_index,
+            'second_index': np_second_index,
+            'labels': np_labels,
+            'hashtag': np_hashtag,
+            'first_tweets_char': np_first_tweets_char,
+            'second_tweets_char': np_second_tweets_char,
+            'use_word_ids': word_to_id is not None}
+
+
+def select_training_pairs(hashtag_data, np_pair_index):
+    """Build a batch of model inputs from the tweet pairs at np_pair_index of a hashtag loaded
+    with load_training_hashtag."""
+    np_batch_first_index = hashtag_data['first_index'][np_pair_index]
+    np_batch_second_index = hashtag_data['second_index'][np_pair_index]
+    if hashtag_data['use_word_ids']:
+        np_batch_first_tweets = hashtag_data['tweet_inputs'][np_batch_first_index]
+        np_batch_second_tweets = hashtag_data['tweet_inputs'][np_batch_second_index]
+    else:
+        # Gather embeddings of the tweets in this batch from the hashtag tweet store.
+        np_batch_first_tweets = gather_tweet_embeddings(hashtag_data['tweet_inputs'], np_batch_first_index)
+        np_batch_second_tweets = gather_tweet_embeddings(hashtag_data['tweet_inputs'], np_batch_second_index)
+    return {'hashtag_name': hashtag_data['hashtag_name'],
+            'first_tweets': np_batch_first_tweets,
+            'second_tweets': np_batch_second_tweets,
+            'labels': hashtag_data['labels'][np_pair_index],
+            'hashtag': np.repeat(hashtag_data['hashtag'], np_batch_first_index.shape[0], axis=0),
+            'first_tweets_char': hashtag_data['first_tweets_char'][np_pair_index, :],
+            'second_tweets_char': hashtag_data['second_tweets_char'][np_pair_index, :]}
+
+
+def generate_hashtag_training_batches(trainer_hashtag_name, hashtag_datas, batch_size, word_to_id=None,
+                                      hashtag_word_ids=None):
+    """Load a training hashtag from its tweet store and yield its tweet pairs in batches of batch_size, the
+    last batch holding the remainder. Each batch is a dictionary of model inputs: first_tweets, second_tweets
+    (embeddings, or word ids if word_to_id is given), labels, hashtag, first_tweets_char, second_tweets_char,
+    along with hashtag_name. Word ids are cached per hashtag in hashtag_word_ids if it is given."""
+    hashtag_data = load_training_hashtag(trainer_hashtag_name, hashtag_datas, word_to_id=word_to_id,
+                                         hashtag_word_ids=hashtag_word_ids)
+    num_pairs = hashtag_data['first_index'].shape[0]
+    for starting_training_example in range(0, num_pairs, batch_size):
+        np_pair_index = np.arange(starting_training_example, min(starting_training_example + batch_size, num_pairs))
+        yield select_training_pairs(hashtag_data, np_pair_index)
+
+
+def assemble_pooled_training_batch(hashtag_pool, np_batch_pairs):
+    """Build one batch of model inputs from pairs of several hashtags. hashtag_pool is a list of hashtags
+    loaded with load_training_hashtag, and each row of np_batch_pairs holds (position in hashtag_pool, pair
+    index), as produced by tools.sample_pair_batches. Pairs are grouped by hashtag, so the batch order
+    differs from np_batch_pairs. hashtag_name of the batch is None."""
+    hashtag_batches = []
+    for hashtag_position in np.unique(np_batch_pairs[:, 0]):
+        np_pair_index = np_batch_pairs[np_batch_pairs[:, 0] == hashtag_position, 1]
+        hashtag_batches.append(select_training_pairs(hashtag_pool[hashtag_position], np_pair_index))
+    batch = {key: np.concatenate([hashtag_batch[key] for hashtag_batch in hashtag_batches], axis=0)
+             for key in hashtag_batches[0] if key != 'hashtag_name'}
+    batch['hashtag_name'] = None
+    return batch
+
+
 def calculate_accuracy_on_batches(batch_predictions, np_labels):
     """batch_predictions is a list of numpy arrays. Each numpy
     array represents the predictions for a single batch. Evaluates
@@ -212,7 +320,9 @@ def calculate_accuracy_on_batches(batch_predictions, np_labels):
 
 
 def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_model,
-                                 use_char_model, model_save_dir, hidden_dim_size, leave_out_hashtags=[]):
+                                 use_char_model, model_save_dir, hidden_dim_size, leave_out_hashtags=[],
+                                 use_word_ids=False, dynamic_length=False, use_fused_lstm=False,
+                                 batch_sampling='hashtag', data_cache=None):
     """Builds and trains a humor model on the semeval task training set. Evaluates on the semeval task trial set,
     prints accuracy. Saves model after each epoch of training.
 
@@ -223,7 +333,14 @@ def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_mod
     use_char_model - use characters of tweet as features in model prediction
     model_save_dir - where to save model parameters after each epoch
     hidden_dim_size - size of lstm embedding encoder
-    leave_out_hashtags - hashtag names to omit from training step (could use for ensemble model training)"""
+    leave_out_hashtags - hashtag names to omit from training step (could use for ensemble model training)
+    use_word_ids - feed word ids to the model and look up embeddings inside the model graph
+    dynamic_length - tweet encoders stop at the last word of each tweet instead of running over padding
+    use_fused_lstm - use the fused LSTMBlockCell kernel in tweet encoders
+    batch_sampling - how training pairs are batched: 'hashtag', 'pooled' or 'stratified'
+        (see train_on_all_other_hashtags)
+    data_cache - character tweet pair data from load_humor_training_data, to reuse across several calls;
+        loaded from disk if None"""
     print 'Learning rate: %s' % learning_rate
     print 'Number of epochs: %s' % num_epochs
     print 'Dropout keep rate: %s' % dropout
@@ -231,18 +348,33 @@ def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_mod
     print 'Use character model: %s' % use_char_model
     print 'Model save directory: %s' % model_save_dir
     print 'Tweet encoder state size: %s' % hidden_dim_size
+    print 'Use word ids: %s' % use_word_ids
+    print 'Dynamic tweet length: %s' % dynamic_length
+    print 'Use fused LSTM: %s' % use_fused_lstm
+    print 'Batch sampling: %s' % batch_sampling
 
     random.seed('hello world')
-    hashtag_datas, char_to_index, vocab_size = load_hashtag_data_and_vocabulary(HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR,
-                                                                                HUMOR_CHAR_TO_INDEX_FILE_PATH)
-    trial_hashtag_datas, _, trial_vocab_size = \
-        load_hashtag_data_and_vocabulary(HUMOR_TRIAL_TWEET_PAIR_CHAR_DIR, None)
+    if data_cache is None:
+        data_cache = load_humor_training_data()
+    hashtag_datas = data_cache['hashtag_datas']
+    vocab_size = data_cache['vocab_size']
+    trial_hashtag_datas = data_cache['trial_hashtag_datas']
+
+    sess = tf.InteractiveSession(config=create_session_config())
 
-    sess = tf.InteractiveSession(config=tf.ConfigProto(gpu_options=GPU_OPTIONS))
+    word_to_id = None
+    np_word_embeddings = None
+    if use_word_ids:
+        word_to_id, np_word_embeddings = load_word_embedding_matrix()
 
     model_vars = build_humor_model(vocab_size, use_embedding_model=use_emb_model,
                                    use_character_model=use_char_model,
-                                   hidden_dim_size=hidden_dim_size)
+                                   hidden_dim_size=hidden_dim_size,
+                                   np_word_embeddings=np_word_embeddings,
+                                   dynamic_length=dynamic_length,
+                                   use_fused_lstm=use_fused_lstm)
+    # Predictors rebuild the model with these options to restore it (see humor_predictor.HumorPredictor).
+    save_humor_model_options(model_save_dir, dynamic_length=dynamic_length, use_fused_lstm=use_fused_lstm)
     trainer_vars = build_embedding_humor_model_trainer(model_vars)
     create_tensorboard_visualization('emb_humor_model')
     training_hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRAIN_DIR)
@@ -254,7 +386,9 @@ def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_mod
                                                           learning_rate=learning_rate,
                                                           dropout=dropout,
                                                           model_save_dir=model_save_dir,
-                                                          leave_out_hashtags=leave_out_hashtags)
+                                                          leave_out_hashtags=leave_out_hashtags,
+                                                          word_to_id=word_to_id,
+                                                          batch_sampling=batch_sampling)
     print 'Mean training accuracy: %s' % training_accuracy
     print
     for hashtag_name in testing_hashtag_names:
@@ -262,7 +396,9 @@ def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_mod
                                          model_vars,
                                          hashtag_name,
                                          HUMOR_TRIAL_TWEET_PAIR_EMBEDDING_DIR,
-                                         trial_hashtag_datas)
+                                         trial_hashtag_datas,
+                                         word_to_id=word_to_id,
+                                         tweet_input_dir=SEMEVAL_HUMOR_TRIAL_DIR)
         print 'Hashtag %s accuracy: %s' % (hashtag_name, accuracy)
         accuracies.append(accuracy)
 
@@ -273,11 +409,28 @@ def load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_mod
             'test_accuracy': test_accuracy}
 
 
+def load_humor_training_data():
+    """Load the character tweet pair data of the train and trial datasets used by
+    load_build_train_and_predict. Returns a dictionary with hashtag_datas, char_to_index,
+    vocab_size and trial_hashtag_datas, which is only read afterwards."""
+    hashtag_datas, char_to_index, vocab_size = load_hashtag_data_and_vocabulary(HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR,
+                                                                                HUMOR_CHAR_TO_INDEX_FILE_PATH)
+    trial_hashtag_datas, _, trial_vocab_size = \
+        load_hashtag_data_and_vocabulary(HUMOR_TRIAL_TWEET_PAIR_CHAR_DIR, None)
+    return {'hashtag_datas': hashtag_datas,
+            'char_to_index': char_to_index,
+            'vocab_size': vocab_size,
+            'trial_hashtag_datas': trial_hashtag_datas}
+
+
 @ex.main
 def main(learning_rate, num_epochs, dropout, use_emb_model,
-         use_char_model, model_save_dir, hidden_dim_size, leave_out_hashtags=[]):
+         use_char_model, model_save_dir, hidden_dim_size, use_word_ids, dynamic_length, use_fused_lstm,
+         batch_sampling, leave_out_hashtags=[]):
     load_build_train_and_predict(learning_rate, num_epochs, dropout, use_emb_model,
-                                 use_char_model, model_save_dir, hidden_dim_size, leave_out_hashtags=[])
+                                 use_char_model, model_save_dir, hidden_dim_size, leave_out_hashtags=[],
+                                 use_word_ids=use_word_ids, dynamic_length=dynamic_length,
+                                 use_fused_lstm=use_fused_lstm, batch_sampling=batch_sampling)
 
 
 if __name__ == '__main__':
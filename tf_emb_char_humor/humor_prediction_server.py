@@ -0,0 +1,184 @@
+"""Long-running HTTP server for humor predictions. Loads a HumorPredictor once and keeps it warm,
+so requests pay for a model run instead of loading tables, building the graph and restoring the checkpoint.
+Concurrent /pairs requests are coalesced into micro-batches (see tools.MicroBatcher), and all model runs
+happen in a single thread that owns the TF session. /hashtag requests encode each tweet of the hashtag once
+and score its pairs chunk by chunk in that thread, so pair batches of other requests run between chunks.
+
+Usage: python humor_prediction_server.py [model_var_dir] [--port N] [--max-batch-size N] [--max-wait-ms N]
+        [-emb-only | -char-only] [-dynamic-length] [-fused-lstm]
+
+All requests are JSON POSTs. Responses hold the probability that the first tweet of each pair is funnier.
+    /pairs    {"hashtag": "Dog_Jobs", "pairs": [["first tweet", "second tweet"], ...]}
+              -> {"probabilities": [...], "predictions": [...]}
+    /hashtag  {"dataset": "trial", "hashtag": "Dog_Jobs"}   (dataset is one of HUMOR_SERVER_DATASET_DIRS)
+              -> {"probabilities": [...], "predictions": [...], "first_tweet_ids": [...],
+                  "second_tweet_ids": [...], "labels": [...] or null}"""
+import json
+import os
+import sys
+import traceback
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+import numpy as np
+
+from config import EMB_CHAR_HUMOR_MODEL_DIR
+from config import EMB_HUMOR_MODEL_DIR, CHAR_HUMOR_MODEL_DIR
+from config import SEMEVAL_HUMOR_TRAIN_DIR, SEMEVAL_HUMOR_TRIAL_DIR, SEMEVAL_HUMOR_EVAL_DIR
+from humor_predictor import HumorPredictor
+from tools import MicroBatcher, TWEET_PAIR_CHUNK_SIZE
+
+HUMOR_SERVER_PORT = 8765
+HUMOR_SERVER_MAX_BATCH_SIZE = 256
+HUMOR_SERVER_MAX_WAIT_MS = 5
+# Hashtag file directories /hashtag requests can read from, by dataset name. Clients name a dataset
+# instead of giving a path, so they can only read the hashtag files of these datasets.
+HUMOR_SERVER_DATASET_DIRS = {'train': SEMEVAL_HUMOR_TRAIN_DIR,
+                             'trial': SEMEVAL_HUMOR_TRIAL_DIR,
+                             'eval': SEMEVAL_HUMOR_EVAL_DIR}
+
+
+class HumorPredictionServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in its own thread. Requests convert their tweets to model inputs
+    in parallel, then run the model through the batcher."""
+    daemon_threads = True
+
+    def __init__(self, server_address, predictor, max_batch_size=HUMOR_SERVER_MAX_BATCH_SIZE,
+                 max_wait=HUMOR_SERVER_MAX_WAIT_MS / 1000.0):
+        HTTPServer.__init__(self, server_address, HumorPredictionRequestHandler)
+        self.predictor = predictor
+        self.batcher = MicroBatcher(self.run_batch, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def run_batch(self, inputs):
+        return self.predictor.predict_on_model_inputs(inputs)
+
+    def predict_pairs(self, hashtag_name, tweet_pairs):
+        inputs = self.predictor.convert_pairs_to_model_inputs(hashtag_name, tweet_pairs)
+        np_predictions, np_output_prob = self.batcher.submit(inputs)
+        return {'probabilities': np_output_prob.tolist(),
+                'predictions': np_predictions.tolist()}
+
+    def predict_hashtag(self, tweet_input_dir, hashtag_name):
+        features, np_first_index, np_second_index, np_labels, first_tweet_ids, second_tweet_ids = \
+            self.predictor.data.load_hashtag(tweet_input_dir, hashtag_name)
+        batch_predictions = [np.zeros([0], dtype=np.int32)]
+        batch_output_probs = [np.zeros([0], dtype=np.float32)]
+        if len(np_first_index) > 0:
+            encoded_tweets = self.batcher.call(self.predictor.encode_tweets, features)
+            for chunk_start in range(0, len(np_first_index), TWEET_PAIR_CHUNK_SIZE):
+                chunk_end = chunk_start + TWEET_PAIR_CHUNK_SIZE
+                np_chunk_predictions, np_chunk_output_prob = \
+                    self.batcher.call(self.predictor.predict_on_encoded_pairs, encoded_tweets,
+                                      np_first_index[chunk_start:chunk_end], np_second_index[chunk_start:chunk_end])
+                batch_predictions.append(np_chunk_predictions)
+                batch_output_probs.append(np_chunk_output_prob)
+        np_predictions = np.concatenate(batch_predictions)
+        np_output_prob = np.concatenate(batch_output_probs)
+        return {'probabilities': np_output_prob.tolist(),
+                'predictions': np_predictions.tolist(),
+                'first_tweet_ids': first_tweet_ids.tolist(),
+                'second_tweet_ids': second_tweet_ids.tolist(),
+                'labels': np_labels.tolist() if np_labels is not None else None}
+
+
+class HumorPredictionRequestHandler(BaseHTTPRequestHandler):
+    """Answers /pairs and /hashtag JSON requests (see module docstring)."""
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.getheader('content-length', 0))))
+            if self.path == '/pairs':
+                tweet_pairs = [(encode_tweet(first_tweet), encode_tweet(second_tweet))
+                               for first_tweet, second_tweet in request['pairs']]
+                if len(tweet_pairs) == 0:
+                    raise ValueError('No tweet pairs given')
+                response = self.server.predict_pairs(str(request['hashtag']), tweet_pairs)
+            elif self.path == '/hashtag':
+                tweet_input_dir, hashtag_name = find_hashtag_file(request['dataset'], request['hashtag'])
+                response = self.server.predict_hashtag(tweet_input_dir, hashtag_name)
+            else:
+                self.send_json(404, {'error': 'Unknown path: %s' % self.path})
+                return
+        except (ValueError, KeyError, TypeError, IOError, OSError) as error:
+            self.send_json(400, {'error': '%s: %s' % (type(error).__name__, error)})
+            return
+        except Exception:
+            traceback.print_exc()
+            self.send_json(500, {'error': 'Prediction failed'})
+            return
+        self.send_json(200, response)
+
+    def send_json(self, status, body):
+        response = json.dumps(body)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(response)))
+        self.end_headers()
+        self.wfile.write(response)
+
+    def log_message(self, format, *args):
+        # Logging every request to stderr costs more than a small prediction.
+        pass
+
+
+def find_hashtag_file(dataset, hashtag_name):
+    """Returns the directory of dataset (see HUMOR_SERVER_DATASET_DIRS) and the name of one of its hashtag
+    files. Raises ValueError for unknown datasets and for hashtag names that are not a file of the dataset."""
+    if dataset not in HUMOR_SERVER_DATASET_DIRS:
+        raise ValueError('Unknown dataset: %s' % dataset)
+    tweet_input_dir = HUMOR_SERVER_DATASET_DIRS[dataset]
+    hashtag_name = str(hashtag_name)
+    if hashtag_name in ['', '.', '..'] or os.path.basename(hashtag_name) != hashtag_name or \
+            not os.path.isfile(tweet_input_dir + hashtag_name + '.tsv'):
+        raise ValueError('Unknown hashtag in dataset %s: %s' % (dataset, hashtag_name))
+    return tweet_input_dir, hashtag_name
+
+
+def encode_tweet(tweet):
+    """Tweets arrive from JSON as unicode. Hashtag files hold UTF-8 bytes, so convert to the same form."""
+    if isinstance(tweet, unicode):
+        return tweet.encode('utf-8')
+    return str(tweet)
+
+
+def get_option(argv, option, default, convert=int):
+    """Returns the value following option in argv, or default if option is not given."""
+    if option in argv:
+        return convert(argv[argv.index(option) + 1])
+    return default
+
+
+def main():
+    use_emb_model = '-char-only' not in sys.argv
+    use_char_model = '-emb-only' not in sys.argv
+    model_var_dir = EMB_CHAR_HUMOR_MODEL_DIR
+    if not use_char_model:
+        model_var_dir = EMB_HUMOR_MODEL_DIR
+    elif not use_emb_model:
+        model_var_dir = CHAR_HUMOR_MODEL_DIR
+    if len(sys.argv) > 1 and not sys.argv[1].startswith('-'):
+        model_var_dir = sys.argv[1]
+    port = get_option(sys.argv, '--port', HUMOR_SERVER_PORT)
+    max_batch_size = get_option(sys.argv, '--max-batch-size', HUMOR_SERVER_MAX_BATCH_SIZE)
+    max_wait_ms = get_option(sys.argv, '--max-wait-ms', HUMOR_SERVER_MAX_WAIT_MS, convert=float)
+
+    # Model options are read from model_var_dir; the flags are for models saved before options were recorded.
+    dynamic_length = True if '-dynamic-length' in sys.argv else None
+    use_fused_lstm = True if '-fused-lstm' in sys.argv else None
+    predictor = HumorPredictor(model_var_dir, use_emb_model=use_emb_model, use_char_model=use_char_model,
+                               dynamic_length=dynamic_length, use_fused_lstm=use_fused_lstm)
+    # The first session run allocates memory and picks kernels; do it before the first request does.
+    predictor.predict_on_model_inputs(predictor.convert_pairs_to_model_inputs('warm_up', [('warm up', 'warm up')]))
+    server = HumorPredictionServer(('127.0.0.1', port), predictor, max_batch_size=max_batch_size,
+                                   max_wait=max_wait_ms / 1000.0)
+    print 'Serving humor predictions on port %s' % port
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.batcher.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,13 @@
-"""David Donahue 2016. Class to make predictions on a hashtag from file. Can make predictions
-with embedding model, character model, or both."""
+"""David Donahue 2016. Class to make predictions on a hashtag from file, or on tweets held in memory
+(predict_pairs, rank_tweets). Can make predictions with embedding model, character model, or both."""
+import collections
 import cPickle as pickle
+import os
 import random
+import threading
 import tensorflow as tf
 import numpy as np
+from keras import backend as K
 from config import HUMOR_INDEX_TO_WORD_FILE_PATH
 from config import HUMOR_WORD_TO_GLOVE_FILE_PATH
 from config import HUMOR_WORD_TO_PHONETIC_FILE_PATH
@@ -12,11 +16,129 @@ from config import EMB_HUMOR_MODEL_DIR, CHAR_HUMOR_MODEL_DIR
 from config import TWEET_PAIR_LABEL_RANDOM_SEED
 from config import HUMOR_CHAR_TO_INDEX_FILE_PATH
 from config import SEMEVAL_HUMOR_TRIAL_DIR, SEMEVAL_HUMOR_EVAL_DIR
-from tools import convert_hashtag_to_embedding_tweet_pairs
-from tools import extract_tweet_pairs_from_file
-from tools import format_tweet_pairs, save_hashtag_data, get_hashtag_file_names
+from config import GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE, HUMOR_MAX_WORDS_IN_TWEET
+from tools import extract_tweet_pair_indices
+from tools import generate_tweet_pair_index_chunks
+from tools import read_hashtag_file
+from tools import load_tweets_from_hashtag
+from tools import save_hashtag_data, get_hashtag_file_names
+from tools import build_character_lookup_table
+from tools import convert_tweet_to_embeddings
+from tools import convert_tweets_to_character_indices
+from tools import tokenize_tweet_for_embedding_model
 
 from tf_tools import build_humor_model, predict_on_hashtag, GPU_OPTIONS
+from tf_tools import get_humor_model_tweet_features
+from tf_tools import create_session_config
+from tf_tools import load_humor_model_options
+
+# Number of tweets run through the tweet encoders at once, and of tweet pairs run through the dense layers at once.
+HUMOR_PREDICTOR_ENCODER_BATCH_SIZE = 1000
+HUMOR_PREDICTOR_PAIR_BATCH_SIZE = 10000
+# Number of converted hashtags HumorPredictorData keeps, least recently used first out.
+HUMOR_PREDICTOR_CACHED_HASHTAGS = 2
+
+
+class HumorPredictorData:
+    """Lookup tables and converted hashtags used by humor predictors. Conversion of tweets to model
+    input does not depend on the model, so predictors of several models can share one instance
+    and convert each hashtag only once (see HumorMultiPredictor). Only the max_cached_hashtags most
+    recently used hashtags are kept converted, so predicting on a whole dataset holds a few hashtags
+    in memory instead of all of them."""
+    def __init__(self, v=True, max_cached_hashtags=HUMOR_PREDICTOR_CACHED_HASHTAGS):
+        self.vocabulary = pickle.load(open(HUMOR_INDEX_TO_WORD_FILE_PATH, 'rb'))
+        if v:
+            print 'len vocabulary: %s' % len(self.vocabulary)
+        self.word_to_glove = pickle.load(open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'rb'))
+        if v:
+            print 'len word_to_glove: %s' % len(self.word_to_glove)
+        self.word_to_phonetic = pickle.load(open(HUMOR_WORD_TO_PHONETIC_FILE_PATH, 'rb'))
+        if v:
+            print 'len word_to_phonetic: %s' % len(self.word_to_phonetic)
+        self.char_to_index = pickle.load(open(HUMOR_CHAR_TO_INDEX_FILE_PATH, 'rb'))
+        if v:
+            print 'len char_to_index: %s' % len(self.char_to_index)
+        self.np_char_table = build_character_lookup_table(self.char_to_index)
+        # Tweet features and pairs of hashtag files, by file path, least recently used first (see load_hashtag).
+        self.hashtag_inputs = collections.OrderedDict()
+        self.max_cached_hashtags = max_cached_hashtags
+        # hashtag_inputs_lock guards the cache and the per-file locks. Each hashtag file is converted under its
+        # own lock, so request threads of the prediction server convert different hashtags in parallel and the
+        # same hashtag only once.
+        self.hashtag_inputs_lock = threading.Lock()
+        self.hashtag_file_locks = {}
+
+    def load_hashtag(self, tweet_input_dir, hashtag_name):
+        """Converts the tweets of a hashtag file to model features (see convert_tweets_to_model_features) and
+        creates its tweet pairs. Returns the features, the feature rows of the first and second tweet of each
+        pair, pair labels (None if the hashtag has no labels) and first and second tweet ids of each pair.
+        The file is read and tokenized once, and results are cached by file, so a hashtag file is only read
+        again after it is modified, unless it is evicted by more recently used hashtags. Can be called from
+        several threads."""
+        hashtag_file_path = tweet_input_dir + hashtag_name + '.tsv'
+        with self.hashtag_inputs_lock:
+            hashtag_file_lock = self.hashtag_file_locks.setdefault(hashtag_file_path, threading.Lock())
+        with hashtag_file_lock:
+            modification_time = os.path.getmtime(hashtag_file_path)
+            with self.hashtag_inputs_lock:
+                cached_hashtag = self.hashtag_inputs.pop(hashtag_file_path, None)
+                if cached_hashtag is not None and cached_hashtag[0] == modification_time:
+                    self.hashtag_inputs[hashtag_file_path] = cached_hashtag
+                    return cached_hashtag[1]
+            tweets, labels, tweet_ids = read_hashtag_file(hashtag_file_path)
+            formatted_hashtag_name = ' '.join(hashtag_name.split('_')).lower()
+            tokenized_tweets = load_tweets_from_hashtag(hashtag_file_path,
+                                                        explicit_hashtag=formatted_hashtag_name)[0]
+            # Same pair order as the offline pipeline, without touching the random module shared by other threads.
+            np_first_index, np_second_index, np_labels = extract_tweet_pair_indices(
+                tweet_ids, labels, random_generator=random.Random(TWEET_PAIR_LABEL_RANDOM_SEED + hashtag_name))
+            features = self.convert_tweets_to_model_features(hashtag_name, tweets,
+                                                             tokenized_tweets=tokenized_tweets)
+            # Unlabeled hashtags pair every combination of tweets; keep pair tweet ids in compact arrays.
+            np_tweet_ids = np.array(tweet_ids, dtype=np.int64)
+            first_tweet_ids = np_tweet_ids[np_first_index]
+            second_tweet_ids = np_tweet_ids[np_second_index]
+            hashtag = (features, np_first_index, np_second_index, np_labels, first_tweet_ids, second_tweet_ids)
+            with self.hashtag_inputs_lock:
+                self.hashtag_inputs[hashtag_file_path] = (modification_time, hashtag)
+                while len(self.hashtag_inputs) > self.max_cached_hashtags:
+                    self.hashtag_inputs.popitem(last=False)
+            return hashtag
+
+    def convert_pairs_to_tweet_features(self, hashtag_name, tweet_pairs):
+        """Converts each unique tweet of raw tweet pairs to model features (see convert_tweets_to_model_features).
+        Returns the features and the feature rows of the first and second tweet of each pair."""
+        tweet_to_row = {}
+        np_first_rows = np.array([tweet_to_row.setdefault(tweet_pair[0], len(tweet_to_row))
+                                  for tweet_pair in tweet_pairs], dtype=int)
+        np_second_rows = np.array([tweet_to_row.setdefault(tweet_pair[1], len(tweet_to_row))
+                                   for tweet_pair in tweet_pairs], dtype=int)
+        tweets = [None] * len(tweet_to_row)
+        for tweet, row in tweet_to_row.iteritems():
+            tweets[row] = tweet
+        return self.convert_tweets_to_model_features(hashtag_name, tweets), np_first_rows, np_second_rows
+
+    def convert_tweets_to_model_features(self, hashtag_name, tweets, tokenized_tweets=None):
+        """Converts raw tweets into the per-tweet inputs of both model branches. Each tweet is tokenized
+        once for the embedding branch (unless tokenized_tweets are given, i.e. from load_tweets_from_hashtag),
+        and its raw text is converted to character indices for the character branch. Returns a dictionary
+        with word embeddings (tweets) and character indices (tweets_char), one row per tweet."""
+        if tokenized_tweets is None:
+            formatted_hashtag_name = ' '.join(hashtag_name.split('_')).lower()
+            tokenized_tweets = [tokenize_tweet_for_embedding_model(tweet, explicit_hashtag=formatted_hashtag_name)
+                                for tweet in tweets]
+        np_tweet_embs = convert_tweet_to_embeddings(tokenized_tweets, self.word_to_glove, self.word_to_phonetic,
+                                                    HUMOR_MAX_WORDS_IN_TWEET, GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
+        np_tweet_chars = convert_tweets_to_character_indices(tweets, self.np_char_table)
+        return {'tweets': np_tweet_embs, 'tweets_char': np_tweet_chars}
+
+    def gather_model_inputs(self, features, np_first_index, np_second_index):
+        """Builds model inputs for tweet pairs from per-tweet features (see convert_tweets_to_model_features),
+        given the feature row of the first and second tweet of each pair."""
+        return {'first_tweets': features['tweets'][np_first_index],
+                'second_tweets': features['tweets'][np_second_index],
+                'first_tweets_char': features['tweets_char'][np_first_index],
+                'second_tweets_char': features['tweets_char'][np_second_index]}
 
 
 class HumorPredictor:
@@ -25,8 +147,13 @@ class HumorPredictor:
 
     model_var_dir - location of model variables corresponding to current model build
     use_emb_model - true if model will use embeddings to make predictions
-    use_char_model - true if model will use individual chars to make predictions"""
-    def __init__(self, model_var_dir, use_emb_model=True, use_char_model=True, scope=None, v=True, sess=None):
+    use_char_model - true if model will use individual chars to make predictions
+    data - HumorPredictorData holding lookup tables and converted hashtags, to share between predictors;
+        loaded from data files if None
+    dynamic_length, use_fused_lstm - build_humor_model options the model was trained with; if None, they
+        are read from model_var_dir (see tf_tools.load_humor_model_options)"""
+    def __init__(self, model_var_dir, use_emb_model=True, use_char_model=True, scope=None, v=True, sess=None,
+                 data=None, dynamic_length=None, use_fused_lstm=None):
         print use_emb_model
         print use_char_model
         self.model_var_dir = model_var_dir
@@ -38,23 +165,28 @@ class HumorPredictor:
         self.use_char_model = use_char_model
         if v:
             print 'self.use_char_model: %s' % self.use_char_model
-        self.vocabulary = pickle.load(open(HUMOR_INDEX_TO_WORD_FILE_PATH, 'rb'))
-        if v:
-            print 'len vocabulary: %s' % len(self.vocabulary)
-        self.word_to_glove = pickle.load(open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'rb'))
-        if v:
-            print 'len word_to_glove: %s' % len(self.word_to_glove)
-        self.word_to_phonetic = pickle.load(open(HUMOR_WORD_TO_PHONETIC_FILE_PATH, 'rb'))
-        if v:
-            print 'len word_to_phonetic: %s' % len(self.word_to_phonetic)
-        self.char_to_index = pickle.load(open(HUMOR_CHAR_TO_INDEX_FILE_PATH, 'rb'))
+        if data is None:
+            data = HumorPredictorData(v=v)
+        self.data = data
+        self.vocabulary = data.vocabulary
+        self.word_to_glove = data.word_to_glove
+        self.word_to_phonetic = data.word_to_phonetic
+        self.char_to_index = data.char_to_index
+        self.np_char_table = data.np_char_table
+        model_options = load_humor_model_options(model_var_dir)
+        if dynamic_length is None:
+            dynamic_length = model_options['dynamic_length']
+        if use_fused_lstm is None:
+            use_fused_lstm = model_options['use_fused_lstm']
         if v:
-            print 'len char_to_index: %s' % len(self.char_to_index)
+            print 'dynamic_length: %s, use_fused_lstm: %s' % (dynamic_length, use_fused_lstm)
 
         [self.tf_first_input_tweets, self.tf_second_input_tweets, self.tf_output, tf_tweet_humor_rating,
          self.tf_batch_size, tf_hashtag, self.tf_output_prob, self.tf_dropout_rate, self.tf_tweet1, self.tf_tweet2] \
             = build_humor_model(len(self.char_to_index), use_embedding_model=self.use_emb_model,
-                                use_character_model=self.use_char_model, hidden_dim_size=None)
+                                use_character_model=self.use_char_model, hidden_dim_size=None,
+                                dynamic_length=dynamic_length, use_fused_lstm=use_fused_lstm)
+        self.tf_tweet_encoder_output, self.tf_tweet_conv_emb, self.tf_tweet_pair_emb = get_humor_model_tweet_features()
         self.sess = restore_model_from_save(model_var_dir, sess=sess)
 
     def __call__(self, tweet_input_dir, hashtag_name):
@@ -62,29 +194,160 @@ class HumorPredictor:
 
         tweet_input_dir - location of hashtag .tsv file
         hashtag_name - name of hashtag file without .tsv extension"""
-        np_first_tweets, np_second_tweets, first_tweet_ids, second_tweet_ids, np_labels, np_hashtag_gloves = \
-            convert_hashtag_to_embedding_tweet_pairs(tweet_input_dir, hashtag_name,
-                                                     self.word_to_glove, self.word_to_phonetic)
-        random.seed(TWEET_PAIR_LABEL_RANDOM_SEED + hashtag_name)
-        data = extract_tweet_pairs_from_file(tweet_input_dir + hashtag_name + '.tsv')
-        np_tweet_pairs, np_tweet_pair_labels = format_tweet_pairs(data, self.char_to_index)
-        np_first_tweets_char = np_tweet_pairs[:, :TWEET_SIZE]
-        np_second_tweets_char = np_tweet_pairs[:, TWEET_SIZE:]
-        hashtag_datas = [[hashtag_name, np_tweet_pairs]]
-        np_predictions, np_output_prob = self.sess.run([self.tf_output, self.tf_output_prob],
-                                                  feed_dict={self.tf_first_input_tweets: np_first_tweets,
-                                                             self.tf_second_input_tweets: np_second_tweets,
-                                                             self.tf_batch_size: np_first_tweets.shape[0],
-                                                             self.tf_dropout_rate: 1.0,
-                                                             self.tf_tweet1: np_first_tweets_char,
-                                                             self.tf_tweet2: np_second_tweets_char})
+        features, np_first_index, np_second_index, np_labels, first_tweet_ids, second_tweet_ids = \
+            self.data.load_hashtag(tweet_input_dir, hashtag_name)
+        np_predictions, np_output_prob = self.predict_on_tweet_features(features, np_first_index, np_second_index)
         return np_predictions, np_output_prob, np_labels, first_tweet_ids, second_tweet_ids
 
+    def predict_pairs(self, hashtag_name, tweet_pairs):
+        """Makes predictions on tweet pairs held in memory. Returns predictions (1 if the first tweet is
+        funnier) and the probability that the first tweet of each pair is funnier.
+
+        hashtag_name - hashtag the tweets answer, with words separated by underscores (as in hashtag file names)
+        tweet_pairs - list of (first tweet text, second tweet text) pairs"""
+        features, np_first_rows, np_second_rows = self.data.convert_pairs_to_tweet_features(hashtag_name, tweet_pairs)
+        return self.predict_on_tweet_features(features, np_first_rows, np_second_rows)
+
+    def rank_tweets(self, hashtag_name, tweets):
+        """Ranks tweets held in memory from funniest to least funny. Every tweet is compared with every other
+        tweet, and scored by the sum of its probabilities of being the funnier tweet of a pair. Returns the
+        indices of tweets in ranked order and the score of each tweet (in the order of tweets). Pairs are
+        generated and scored in chunks (see tools.generate_tweet_pair_index_chunks), so only the scores of
+        tweets are kept, not those of every pair."""
+        np_scores = np.zeros([len(tweets)])
+        if len(tweets) > 1:
+            features = self.data.convert_tweets_to_model_features(hashtag_name, tweets)
+            encoded_tweets = self.encode_tweets(features)
+            for np_first_index, np_second_index in generate_tweet_pair_index_chunks(len(tweets)):
+                np_predictions, np_output_prob = self.predict_on_encoded_pairs(encoded_tweets, np_first_index,
+                                                                               np_second_index)
+                np_scores += np.bincount(np_first_index, weights=np_output_prob, minlength=len(tweets)) + \
+                    np.bincount(np_second_index, weights=1 - np_output_prob, minlength=len(tweets))
+        return np.argsort(-np_scores, kind='mergesort'), np_scores
+
+    def convert_hashtag_to_model_inputs(self, tweet_input_dir, hashtag_name):
+        """Converts the tweet pairs of a hashtag file into model inputs (see predict_on_model_inputs). Returns
+        the inputs, pair labels (None if the hashtag has no labels) and first and second tweet ids of each pair."""
+        features, np_first_index, np_second_index, np_labels, first_tweet_ids, second_tweet_ids = \
+            self.data.load_hashtag(tweet_input_dir, hashtag_name)
+        inputs = self.data.gather_model_inputs(features, np_first_index, np_second_index)
+        return inputs, np_labels, first_tweet_ids, second_tweet_ids
+
+    def convert_pairs_to_model_inputs(self, hashtag_name, tweet_pairs):
+        """Converts raw tweet pairs into model inputs (see predict_on_model_inputs). Each unique tweet is
+        tokenized and converted once.
+
+        hashtag_name - hashtag the tweets answer, with words separated by underscores (as in hashtag file names)
+        tweet_pairs - list of (first tweet text, second tweet text) pairs"""
+        features, np_first_rows, np_second_rows = self.data.convert_pairs_to_tweet_features(hashtag_name, tweet_pairs)
+        return self.data.gather_model_inputs(features, np_first_rows, np_second_rows)
+
+    def predict_on_model_inputs(self, inputs):
+        """Runs the model on a dictionary of model inputs (first_tweets, second_tweets, first_tweets_char,
+        second_tweets_char), one row per tweet pair. Returns predictions (1 if the first tweet is funnier)
+        and the probability that the first tweet is funnier."""
+        np_predictions, np_output_prob = self.sess.run([self.tf_output, self.tf_output_prob],
+                                                       feed_dict={self.tf_first_input_tweets: inputs['first_tweets'],
+                                                                  self.tf_second_input_tweets: inputs['second_tweets'],
+                                                                  self.tf_batch_size: inputs['first_tweets'].shape[0],
+                                                                  self.tf_dropout_rate: 1.0,
+                                                                  self.tf_tweet1: inputs['first_tweets_char'],
+                                                                  self.tf_tweet2: inputs['second_tweets_char']})
+        return np_predictions, np_output_prob
+
+
+    def predict_on_tweet_features(self, features, np_first_index, np_second_index):
+        """Makes predictions on tweet pairs given as rows of per-tweet features (see
+        convert_tweets_to_model_features). Each tweet runs through the tweet encoders once, no matter how
+        many pairs it is part of, and only the dense layers run for each pair. Returns predictions and the
+        probability that the first tweet of each pair is funnier."""
+        if len(np_first_index) == 0:
+            return np.zeros([0], dtype=np.int32), np.zeros([0], dtype=np.float32)
+        encoded_tweets = self.encode_tweets(features)
+        return self.predict_on_encoded_pairs(encoded_tweets, np_first_index, np_second_index)
+
+    def encode_tweets(self, features):
+        """Runs per-tweet features through the tweet encoders of the models in use (embedding LSTM encoder,
+        character model). Returns a list with the output of each model in use, one row per tweet."""
+        tf_encoders = []
+        if self.use_emb_model:
+            tf_encoders.append(self.tf_tweet_encoder_output)
+        if self.use_char_model:
+            tf_encoders.append(self.tf_tweet_conv_emb)
+        num_tweets = features['tweets'].shape[0]
+        batch_outputs = []
+        for batch_start in range(0, num_tweets, HUMOR_PREDICTOR_ENCODER_BATCH_SIZE):
+            batch_end = min(batch_start + HUMOR_PREDICTOR_ENCODER_BATCH_SIZE, num_tweets)
+            np_batch_tweets = features['tweets'][batch_start:batch_end]
+            np_batch_tweets_char = features['tweets_char'][batch_start:batch_end]
+            batch_outputs.append(self.sess.run(tf_encoders, feed_dict={self.tf_first_input_tweets: np_batch_tweets,
+                                                                       self.tf_tweet1: np_batch_tweets_char,
+                                                                       self.tf_batch_size: batch_end - batch_start,
+                                                                       self.tf_dropout_rate: 1.0}))
+        return [np.concatenate([outputs[index] for outputs in batch_outputs], axis=0)
+                for index in range(len(tf_encoders))]
+
+    def predict_on_encoded_pairs(self, encoded_tweets, np_first_index, np_second_index):
+        """Runs the dense layers of the model on tweet pairs, given encoded tweets (see encode_tweets) and
+        the rows of the first and second tweet of each pair. Returns predictions and the probability that
+        the first tweet of each pair is funnier."""
+        batch_predictions = [np.zeros([0], dtype=np.int32)]
+        batch_output_probs = [np.zeros([0], dtype=np.float32)]
+        for batch_start in range(0, len(np_first_index), HUMOR_PREDICTOR_PAIR_BATCH_SIZE):
+            np_batch_first_index = np_first_index[batch_start:batch_start + HUMOR_PREDICTOR_PAIR_BATCH_SIZE]
+            np_batch_second_index = np_second_index[batch_start:batch_start + HUMOR_PREDICTOR_PAIR_BATCH_SIZE]
+            # Dense layer input holds the features of each model for the first and then the second tweet.
+            np_pair_features = np.concatenate([np_encoded[np_index] for np_encoded in encoded_tweets
+                                               for np_index in [np_batch_first_index, np_batch_second_index]], axis=1)
+            np_predictions, np_output_prob = self.sess.run([self.tf_output, self.tf_output_prob],
+                                                           feed_dict={self.tf_tweet_pair_emb: np_pair_features,
+                                                                      self.tf_dropout_rate: 1.0})
+            batch_predictions.append(np_predictions)
+            batch_output_probs.append(np_output_prob)
+        return np.concatenate(batch_predictions), np.concatenate(batch_output_probs)
+
+
+class HumorMultiPredictor:
+    """Makes predictions on individual hashtags with several pre-trained models at once. Lookup tables
+    are loaded once, and each hashtag is read and converted to model input once for all models. Each
+    model is built in its own graph with its own session.
+
+    model_specs - list of (model_var_dir, use_emb_model, use_char_model), one per model. A fourth item can
+        give build_humor_model options as a dictionary (i.e. {'use_fused_lstm': True}); options not given are
+        read from model_var_dir (see HumorPredictor)"""
+    def __init__(self, model_specs, v=True):
+        self.data = HumorPredictorData(v=v)
+        self.predictors = []
+        for model_spec in model_specs:
+            model_var_dir, use_emb_model, use_char_model = model_spec[:3]
+            model_options = model_spec[3] if len(model_spec) > 3 else {}
+            graph = tf.Graph()
+            with graph.as_default():
+                sess = tf.Session(graph=graph, config=create_session_config())
+                # Character model layers are built by Keras, which must use the session of this graph.
+                K.set_session(sess)
+                self.predictors.append(HumorPredictor(model_var_dir, use_emb_model=use_emb_model,
+                                                      use_char_model=use_char_model, v=v, sess=sess,
+                                                      data=self.data, **model_options))
+
+    def __call__(self, tweet_input_dir, hashtag_name):
+        """Makes predictions on a single hashtag with all models. Returns the probability that the first
+        tweet of each pair is funnier according to each model (one column per model, in the order of
+        model_specs), pair labels (None if the hashtag has no labels), and first and second tweet ids."""
+        features, np_first_index, np_second_index, np_labels, first_tweet_ids, second_tweet_ids = \
+            self.data.load_hashtag(tweet_input_dir, hashtag_name)
+        output_probs = []
+        for predictor in self.predictors:
+            np_predictions, np_output_prob = predictor.predict_on_tweet_features(features, np_first_index,
+                                                                                 np_second_index)
+            output_probs.append(np.reshape(np_output_prob, [-1, 1]))
+        return np.concatenate(output_probs, axis=1), np_labels, first_tweet_ids, second_tweet_ids
+
 
 def restore_model_from_save(model_var_dir, sess=None):
     """Restores all model variables from the specified directory."""
     if sess is None:
-        sess = tf.InteractiveSession(config=tf.ConfigProto(gpu_options=GPU_OPTIONS))
+        sess = tf.InteractiveSession(config=create_session_config())
 
     saver = tf.train.Saver(max_to_keep=10)
     # Restore model from previous save.
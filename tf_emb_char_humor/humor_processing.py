@@ -6,12 +6,28 @@ For each hashtag, it will generate and save a numpy array for each tweet. The nu
 be shaped m x n x e where m is the number of tweet pairs in the hashtag, n is the max tweet size and
 e is the concatenated size of both the phonetic and glove embeddings."""
 from tools import get_hashtag_file_names
-from tools import convert_hashtag_to_embedding_tweet_pairs
+from tools import convert_hashtag_to_embedding_tweet_store
+from tools import save_tweet_store
+from tools import convert_glove_text_to_binary
+from tools import look_up_glove_matrix
+from tools import Vocabulary
+from tools import map_hashtags
+from tools import get_worker_count
+from tools import BuildManifest
+from tools import BUILD_MANIFEST_FILE
+from tools import TWEET_STORE_INDEX_FILE
+from tools import hash_build_inputs
+from tools import load_hashtag_tweet_store
 from config import SEMEVAL_HUMOR_TRAIN_DIR, HUMOR_MAX_WORDS_IN_TWEET, HUMOR_MAX_WORDS_IN_HASHTAG, GLOVE_EMB_SIZE, \
     PHONETIC_EMB_SIZE
 from config import SEMEVAL_HUMOR_TRIAL_DIR
-from config import WORD_VECTORS_FILE_PATH
+from config import TWEET_PAIR_LABEL_RANDOM_SEED
+from config import WORD_VECTORS_INDEX_FILE_PATH
 from config import HUMOR_INDEX_TO_WORD_FILE_PATH
+from config import HUMOR_VOCABULARY_FILE_PATH
+from config import HUMOR_VOCABULARY_MANIFEST_FILE_PATH
+from config import WORD_VECTORS_FILE_PATH
+from config import CHAR_2_PHONE_MODEL_DIR
 from config import HUMOR_WORD_TO_GLOVE_FILE_PATH
 from config import HUMOR_WORD_TO_PHONETIC_FILE_PATH
 from tools import extract_tweet_pairs_by_rank
@@ -35,9 +51,11 @@ import random
 def main():
     print 'Starting program'
     if not len(sys.argv) > 1:
-        print 'Please specify argument: vocabulary|tweet_pairs'
+        print 'Please specify argument: glove_cache|vocabulary|tweet_pairs [-float16] [--workers N]'
 
     else:
+        if sys.argv[1] == 'glove_cache':
+            convert_glove_text_to_binary()
         if sys.argv[1] == 'vocabulary' or sys.argv[1] == 'all':
             create_vocabulary_and_glove_phonetic_mappings()
         if sys.argv[1] == 'tweet_pairs' or sys.argv[1] == 'all':
@@ -54,46 +72,92 @@ def convert_all_tweets_to_tweet_pairs_represented_by_glove_and_phonetic_embeddin
     vocabulary = pickle.load(open(HUMOR_INDEX_TO_WORD_FILE_PATH, 'rb'))
     word_to_glove = pickle.load(open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'rb'))
     word_to_phonetic = pickle.load(open(HUMOR_WORD_TO_PHONETIC_FILE_PATH, 'rb'))
+    dtype = np.float32
+    if '-float16' in sys.argv:
+        dtype = np.float16
+    workers = get_worker_count(sys.argv)
     convert_tweets_to_embedding_tweet_pairs(word_to_glove,
                                             word_to_phonetic,
                                             SEMEVAL_HUMOR_TRAIN_DIR,
-                                            HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR)
+                                            HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR,
+                                            dtype=dtype,
+                                            workers=workers)
     convert_tweets_to_embedding_tweet_pairs(word_to_glove,
                                             word_to_phonetic,
                                             SEMEVAL_HUMOR_TRIAL_DIR,
-                                            HUMOR_TRIAL_TWEET_PAIR_EMBEDDING_DIR)
+                                            HUMOR_TRIAL_TWEET_PAIR_EMBEDDING_DIR,
+                                            dtype=dtype,
+                                            workers=workers)
 
 
 def create_vocabulary_and_glove_phonetic_mappings():
     """For all hashtags, for the first and second tweet in all tweet pairs separately,
     for all words in the tweet, look up a glove embedding and generate a phonetic embedding.
-    Save everything."""
+    Save everything. Nothing is rebuilt if no .tsv file, GloVe file or phonetic model changed
+    since the last run, and phonetic embeddings are only generated for words that are new."""
     print 'Creating vocabulary, phonetic embeddings and GloVe mappings (may take a while)'
     train_hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRAIN_DIR)
-    vocabulary = []
+    test_hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRIAL_DIR)
+    manifest = BuildManifest(HUMOR_VOCABULARY_MANIFEST_FILE_PATH, build_vocabulary_config())
+    tsv_paths = [SEMEVAL_HUMOR_TRAIN_DIR + hashtag_name + '.tsv' for hashtag_name in train_hashtag_names] + \
+                [SEMEVAL_HUMOR_TRIAL_DIR + hashtag_name + '.tsv' for hashtag_name in test_hashtag_names]
+    input_hash = hash_build_inputs(sorted(tsv_paths))
+    if manifest.is_fresh('vocabulary', input_hash):
+        print 'Vocabulary is up to date'
+        return
+    previous_word_to_phonetic = {}
+    if 'vocabulary' in manifest.entries and os.path.exists(HUMOR_WORD_TO_PHONETIC_FILE_PATH):
+        previous_word_to_phonetic = pickle.load(open(HUMOR_WORD_TO_PHONETIC_FILE_PATH, 'rb'))
+
+    vocabulary = Vocabulary()
     for hashtag_name in train_hashtag_names:
         tweets, labels, tweet_ids = load_tweets_from_hashtag(SEMEVAL_HUMOR_TRAIN_DIR + hashtag_name + '.tsv')
         vocabulary = build_vocabulary(tweets, vocabulary=vocabulary)
 
-    test_hashtag_names = get_hashtag_file_names(SEMEVAL_HUMOR_TRIAL_DIR)
     for hashtag_name in test_hashtag_names:
         tweets, labels, tweet_ids = load_tweets_from_hashtag(SEMEVAL_HUMOR_TRIAL_DIR + hashtag_name + '.tsv')
         vocabulary = build_vocabulary(tweets, vocabulary=vocabulary)
 
-    word_to_glove = look_up_glove_embeddings(vocabulary)
-    index_to_phonetic = generate_phonetic_embs_from_words(vocabulary, CMU_CHAR_TO_INDEX_FILE_PATH,
-                                                          CMU_PHONE_TO_INDEX_FILE_PATH)
-    word_to_phonetic = create_dictionary_mapping(vocabulary, index_to_phonetic)
+    index_to_word = vocabulary.index_to_token
+    word_to_glove = look_up_glove_embeddings(index_to_word)
+    new_words = [word for word in index_to_word if word not in previous_word_to_phonetic]
+    print 'Generating phonetic embeddings for %s new words' % len(new_words)
+    new_word_to_phonetic = {}
+    if len(new_words) > 0:
+        index_to_phonetic = generate_phonetic_embs_from_words(new_words, CMU_CHAR_TO_INDEX_FILE_PATH,
+                                                              CMU_PHONE_TO_INDEX_FILE_PATH)
+        new_word_to_phonetic = create_dictionary_mapping(new_words, index_to_phonetic)
+    word_to_phonetic = {}
+    for word in index_to_word:
+        word_to_phonetic[word] = previous_word_to_phonetic.get(word, new_word_to_phonetic.get(word))
     print 'Size of vocabulary: %s' % len(vocabulary)
     print 'Number of GloVe vectors found: %s' % len(word_to_glove)
     print 'Size of a GloVe vector: %s' % len(word_to_glove['the'])
     print 'Size of a phonetic embedding: %s' % len(word_to_phonetic['the'])
     print 'Saving %s' % HUMOR_INDEX_TO_WORD_FILE_PATH
-    pickle.dump(vocabulary, open(HUMOR_INDEX_TO_WORD_FILE_PATH, 'wb'))
+    pickle.dump(index_to_word, open(HUMOR_INDEX_TO_WORD_FILE_PATH, 'wb'))
+    print 'Saving %s' % HUMOR_VOCABULARY_FILE_PATH
+    vocabulary.save(HUMOR_VOCABULARY_FILE_PATH)
     print 'Saving %s' % HUMOR_WORD_TO_GLOVE_FILE_PATH
     pickle.dump(word_to_glove, open(HUMOR_WORD_TO_GLOVE_FILE_PATH, 'wb'))
     print 'Saving %s' % HUMOR_WORD_TO_PHONETIC_FILE_PATH
     pickle.dump(word_to_phonetic, open(HUMOR_WORD_TO_PHONETIC_FILE_PATH, 'wb'))
+    manifest.record('vocabulary', input_hash, [HUMOR_INDEX_TO_WORD_FILE_PATH, HUMOR_VOCABULARY_FILE_PATH,
+                                               HUMOR_WORD_TO_GLOVE_FILE_PATH, HUMOR_WORD_TO_PHONETIC_FILE_PATH])
+    manifest.save()
+
+
+def build_vocabulary_config():
+    """Returns the configuration the vocabulary stage depends on besides its .tsv files:
+    the GloVe file (by size and modification time, as it is too large to hash on every run)
+    and the files of the char2phone model used to generate phonetic embeddings."""
+    glove_file_signature = None
+    if os.path.exists(WORD_VECTORS_FILE_PATH):
+        glove_file_signature = (os.path.getsize(WORD_VECTORS_FILE_PATH), os.path.getmtime(WORD_VECTORS_FILE_PATH))
+    phonetic_model_paths = [CMU_CHAR_TO_INDEX_FILE_PATH, CMU_PHONE_TO_INDEX_FILE_PATH,
+                            os.path.join(CHAR_2_PHONE_MODEL_DIR, 'checkpoint')]
+    return {'glove_file': glove_file_signature,
+            'phonetic_model': hash_build_inputs([path for path in phonetic_model_paths if os.path.exists(path)])}
 
 
 def create_dictionary_mapping(first_list, second_list):
@@ -108,53 +172,107 @@ def create_dictionary_mapping(first_list, second_list):
     return mapping_dict
 
 
-def convert_tweets_to_embedding_tweet_pairs(word_to_glove, word_to_phonetic, tweet_input_dir, tweet_pair_output_dir, hashtag_names=None):
+def convert_tweets_to_embedding_tweet_pairs(word_to_glove, word_to_phonetic, tweet_input_dir, tweet_pair_output_dir,
+                                            hashtag_names=None, dtype=np.float32, workers=1):
     """Create output directory if it doesn't exist. For all hashtags, generate tweet pairs from all tweets by comparing
-    winner with top-ten, top-ten with loser, and winner with loser tweets. Convert each word in each tweet of a tweet pair into
-    both a GloVe embedding and phonetic embedding. For each hashtag, produce a numpy array for the first tweet in each pair, produce
-    a numpy array for the second tweet in each pair, and produce a label array to tell which one is funnier (1 indicates first tweet is funnier).
-    For each row of each tweet vector, insert the GloVe and phonetic embeddings for each word, and insert padding up up to the max words in tweet.
-    Can specify hashtag names to convert to embedding tweet pairs instead of all hashtags in tweet_input_dir.
+    winner with top-ten, top-ten with loser, and winner with loser tweets. Convert each word in each tweet into
+    both a GloVe embedding and phonetic embedding. For each hashtag, produce a numpy array holding every tweet once,
+    index arrays pointing to the first and second tweet in each pair, and a label array to tell which one is funnier
+    (1 indicates first tweet is funnier). For each row of the tweet array, insert the GloVe and phonetic embeddings for
+    each word, and insert padding up up to the max words in tweet. All hashtags are saved into a single tweet store
+    in tweet_pair_output_dir (see tools.save_tweet_store). Can specify hashtag names to convert to embedding
+    tweet pairs instead of all hashtags in tweet_input_dir; the other hashtags already in the store are kept.
+    Hashtags whose .tsv file and word embeddings are unchanged since the last run are copied from the existing
+    store instead of being converted again.
 
     word_to_glove - a dictionary mapping from words to glove vectors
     word_to_phonetic - a dictionary mapping from words to phonetic embedding vectors
     tweet_input_dir - directory of hashtags to convert into embedding tweet pairs
     tweet_pair_output_dir - output directory, where to store hashtag tweet pair numpy arrays
-    hashtag_names - default None; can be used to set specific hashtags to convert"""
+    hashtag_names - default None; can be used to set specific hashtags to convert
+    dtype - numpy dtype of saved embeddings; np.float16 halves the size of the store
+    workers - number of processes converting hashtags in parallel (see tools.map_hashtags)"""
     if not os.path.exists(tweet_pair_output_dir):
         os.makedirs(tweet_pair_output_dir)
-    if hashtag_names is None:
+    convert_all_hashtags = hashtag_names is None
+    if convert_all_hashtags:
         hashtag_names = get_hashtag_file_names(tweet_input_dir)
 
     print hashtag_names
 
+    manifest = BuildManifest(tweet_pair_output_dir + BUILD_MANIFEST_FILE,
+                             {'HUMOR_MAX_WORDS_IN_TWEET': HUMOR_MAX_WORDS_IN_TWEET,
+                              'HUMOR_MAX_WORDS_IN_HASHTAG': HUMOR_MAX_WORDS_IN_HASHTAG,
+                              'GLOVE_EMB_SIZE': GLOVE_EMB_SIZE,
+                              'PHONETIC_EMB_SIZE': PHONETIC_EMB_SIZE,
+                              'TWEET_PAIR_LABEL_RANDOM_SEED': TWEET_PAIR_LABEL_RANDOM_SEED,
+                              'dtype': np.dtype(dtype).str})
+    input_hashes = {}
     for hashtag_name in hashtag_names:
-        print 'Loading hashtag: %s' % hashtag_name
-        np_tweet1_gloves, np_tweet2_gloves, tweet1_id, tweet2_id, np_label, np_hashtag_gloves = \
-            convert_hashtag_to_embedding_tweet_pairs(tweet_input_dir, hashtag_name, word_to_glove, word_to_phonetic)
-        # Save
-        print 'Saving embedding vector tweet pairs with labels'
-        np.save(open(tweet_pair_output_dir + hashtag_name + '_label.npy', 'wb'), np_label)
-        np.save(open(tweet_pair_output_dir + hashtag_name + '_hashtag.npy', 'wb'), np_hashtag_gloves)
-        np.save(open(tweet_pair_output_dir + hashtag_name + '_first_tweet_glove.npy', 'wb'), np_tweet1_gloves)
-        pickle.dump(tweet1_id, open(tweet_pair_output_dir + hashtag_name + '_first_tweet_ids.cpkl', 'wb'))
-        np.save(open(tweet_pair_output_dir + hashtag_name + '_second_tweet_glove.npy', 'wb'),
-                np_tweet2_gloves)
-        pickle.dump(tweet2_id, open(tweet_pair_output_dir + hashtag_name + '_second_tweet_ids.cpkl', 'wb'))
+        input_hashes[hashtag_name] = hash_build_inputs([tweet_input_dir + hashtag_name + '.tsv'],
+                                                       words=find_words_in_hashtag(tweet_input_dir, hashtag_name),
+                                                       word_tables=[word_to_glove, word_to_phonetic])
+    stale_hashtag_names = [hashtag_name for hashtag_name in hashtag_names
+                           if not manifest.is_fresh(hashtag_name, input_hashes[hashtag_name])]
+    # When converting a subset, the store is rewritten with the hashtags outside the subset as they are.
+    kept_hashtag_names = []
+    if not convert_all_hashtags and os.path.exists(tweet_pair_output_dir + TWEET_STORE_INDEX_FILE):
+        requested_hashtag_names = set(hashtag_names)
+        kept_hashtag_names = [hashtag_name for hashtag_name in sorted(manifest.entries)
+                              if hashtag_name not in requested_hashtag_names]
+    print 'Converting %s of %s hashtags' % (len(stale_hashtag_names), len(hashtag_names))
+    converted_stores = map_hashtags(convert_hashtag_to_named_tweet_store, stale_hashtag_names,
+                                    shared_args=(tweet_input_dir, word_to_glove, word_to_phonetic), workers=workers)
+
+    def merge_hashtag_stores():
+        """Yield stores in hashtag order, converting stale hashtags and reading the rest from the existing store."""
+        stale_hashtag_name_set = set(stale_hashtag_names)
+        for hashtag_name in hashtag_names + kept_hashtag_names:
+            if hashtag_name in stale_hashtag_name_set:
+                yield next(converted_stores)
+            else:
+                print 'Unchanged hashtag: %s' % hashtag_name
+                yield hashtag_name, load_hashtag_tweet_store(tweet_pair_output_dir, hashtag_name)
+
+    print 'Saving embedding vector tweet pairs with labels'
+    save_tweet_store(tweet_pair_output_dir, merge_hashtag_stores(), dtype=dtype)
+    manifest.retain(hashtag_names + kept_hashtag_names)
+    for hashtag_name in hashtag_names:
+        manifest.record(hashtag_name, input_hashes[hashtag_name], [tweet_pair_output_dir + TWEET_STORE_INDEX_FILE])
+    manifest.save()
+
+
+def convert_hashtag_to_named_tweet_store(hashtag_name, tweet_input_dir, word_to_glove, word_to_phonetic):
+    """Returns the hashtag name along with its tweet store, as expected by save_tweet_store."""
+    print 'Loading hashtag: %s' % hashtag_name
+    return hashtag_name, convert_hashtag_to_embedding_tweet_store(tweet_input_dir, hashtag_name,
+                                                                  word_to_glove, word_to_phonetic)
+
+
+def find_words_in_hashtag(tweet_input_dir, hashtag_name):
+    """Returns the set of words in the tweets and name of a hashtag, as tokenized for the embedding model."""
+    formatted_hashtag_name = ' '.join(hashtag_name.split('_')).lower()
+    tweets, labels, tweet_ids = load_tweets_from_hashtag(tweet_input_dir + hashtag_name + '.tsv',
+                                                         explicit_hashtag=formatted_hashtag_name)
+    words = set(formatted_hashtag_name.split())
+    for tweet in tweets:
+        words.update(tweet.split())
+    return words
 
 
 def look_up_glove_embeddings(index_to_word):
     """Find a GloVe embedding for each word in
     index_to_word, if it exists. Create a dictionary
-    mapping from words to GloVe vectors and return it."""
+    mapping from words to GloVe vectors and return it.
+    Uses the binary GloVe cache, which is created from
+    the GloVe text file the first time it is needed."""
+    if not os.path.exists(WORD_VECTORS_INDEX_FILE_PATH):
+        convert_glove_text_to_binary()
+    np_words_glove, np_found = look_up_glove_matrix(index_to_word)
     word_to_glove = {}
-    with open(WORD_VECTORS_FILE_PATH, 'rb') as f:
-        for line in f:
-            line_tokens = line.split()
-            glove_word = line_tokens[0].lower()
-            if glove_word in index_to_word:
-                glove_emb = [float(line_token) for line_token in line_tokens[1:]]
-                word_to_glove[glove_word] = glove_emb
+    for word, np_word_glove, found in zip(index_to_word, np_words_glove, np_found):
+        if found:
+            word_to_glove[word] = np_word_glove.tolist()
 
     return word_to_glove
 
@@ -167,13 +285,14 @@ def format_hashtag(hashtag_name):
 
 
 def build_vocabulary(lines, vocabulary=None, max_word_size=15):
+    """Add every word shorter than max_word_size in lines to vocabulary (a tools.Vocabulary,
+    created if None) and return it. Iterating over the vocabulary gives words in index order."""
     if vocabulary is None:
-        vocabulary = []
+        vocabulary = Vocabulary()
+    elif not isinstance(vocabulary, Vocabulary):
+        vocabulary = Vocabulary(vocabulary)
     for line in lines:
-        tokens = line.split()
-        for word in tokens:
-            if len(word) < max_word_size and word not in vocabulary:
-                vocabulary.append(word)
+        vocabulary.add_all([word for word in line.split() if len(word) < max_word_size])
     return vocabulary
 
 
@@ -21,6 +21,8 @@ from config import PHONETIC_EMB_SIZE
 from tools import format_text_for_embedding_model
 from tools import load_tweets_from_hashtag
 from tools import extract_tweet_pairs_by_rank
+from tools import gather_tweet_embeddings
+from tools import load_hashtag_tweet_store
 
 
 def main():
@@ -40,7 +42,7 @@ def main():
 def test_embedding_character_labels_match():
     print 'TEST: test_embedding_character_labels_match'
     example_hashtag = 'Cat_History'
-    np_emb_labels = np.load(open(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR + example_hashtag + '_label.npy'))
+    np_emb_labels = load_hashtag_tweet_store(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, example_hashtag)[3]
     np_char_labels = np.load(open(HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR + example_hashtag + '_labels.npy'))
     assert np.array_equal(np_emb_labels, np_char_labels)
 
@@ -117,24 +119,27 @@ def test_saved_files():
     index_to_word = pickle.load(open(DATA_DIR + 'humor_index_to_word.cpkl', 'rb'))
     word_to_glove = pickle.load(open(DATA_DIR + 'humor_word_to_glove.cpkl', 'rb'))
     word_to_phone = pickle.load(open(DATA_DIR + 'humor_word_to_phonetic.cpkl', 'rb'))
-    np_first_tweets = np.load(open(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR + example_hashtag + '_first_tweet_glove.npy'))
-    np_second_tweets = np.load(open(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR + example_hashtag + '_second_tweet_glove.npy'))
-    np_winner_labels = np.load(open(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR + example_hashtag + '_label.npy'))
-    np_hashtag = np.load(open(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR + example_hashtag + '_hashtag.npy'))
+    np_tweet_gloves, np_first_index, np_second_index, np_winner_labels, tweet_ids, np_hashtag = \
+        load_hashtag_tweet_store(HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR, example_hashtag)
+    np_first_tweets = gather_tweet_embeddings(np_tweet_gloves, np_first_index)
+    np_second_tweets = gather_tweet_embeddings(np_tweet_gloves, np_second_index)
 
     assert '420' in index_to_word
     assert 'celebs' in word_to_phone
 
     print np.sum(np_hashtag)
-    first_word_glove = list(np_hashtag[400:600])
-    first_word_phonetic = list(np_hashtag[600:800])
+    first_word_glove = list(np_hashtag[0, 400:600])
+    first_word_phonetic = list(np_hashtag[0, 600:800])
     print first_word_glove
     print len(first_word_glove)
     print len(first_word_phonetic)
     print first_word_phonetic
 
     print list(np_hashtag.shape)
-    assert list(np_hashtag.shape) == [np_first_tweets.shape[0], (GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE) * HUMOR_MAX_WORDS_IN_HASHTAG]
+    assert list(np_hashtag.shape) == [1, (GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE) * HUMOR_MAX_WORDS_IN_HASHTAG]
+    assert list(np_tweet_gloves.shape) == [len(tweet_ids), HUMOR_MAX_WORDS_IN_TWEET, GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE]
+    assert np_tweet_gloves.dtype == np.float32
+    assert np.max(np_first_index) < len(tweet_ids) and np.max(np_second_index) < len(tweet_ids)
     assert np_first_tweets.shape == np_second_tweets.shape
     assert np_winner_labels.shape[0] == np_first_tweets.shape[0]
     assert len(index_to_word) >= len(word_to_glove)
@@ -1,5 +1,6 @@
 """David Donahue 2016. This script deals primarily with tensorflow build operations. This script
 separates functions that do import tensorflow from those that don't."""
+import os
 import tensorflow as tf
 import numpy as np
 import random
@@ -9,8 +10,11 @@ from keras.layers import Convolution1D, MaxPooling1D
 from keras.layers import Input, Dense, Flatten, Embedding
 from tools import convert_words_to_indices
 from tools import invert_dictionary
-from tools import load_hashtag_data
+from tools import gather_tweet_embeddings
+from tools import load_hashtag_tweet_store
+from tools import convert_hashtag_to_word_ids
 from tools import extract_tweet_pair_from_hashtag_datas
+from tools import dump_pickle_atomically
 from config import CHAR_2_PHONE_MODEL_DIR
 from config import HUMOR_MAX_WORDS_IN_TWEET, HUMOR_MAX_WORDS_IN_HASHTAG
 from config import GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE, TWEET_SIZE
@@ -22,6 +26,44 @@ MAX_PRONUNCIATION_SIZE = 20
 PHONE_CHAR_EMB_DIM = 30
 PHONE_ENCODER_LSTM_EMB_DIM = 200
 HUMOR_DROPOUT = 1
+# Maximum number of CPU threads of TF sessions made with create_session_config, None for no limit.
+_session_thread_limit = None
+# Graph collection holding the per-tweet features and dense layer input of each humor model (see build_humor_model).
+HUMOR_MODEL_TWEET_FEATURES = 'humor_model_tweet_features'
+# File next to humor model checkpoints recording the build_humor_model options the model was trained with.
+HUMOR_MODEL_OPTIONS_FILE = 'humor_model_options.cpkl'
+
+
+def limit_session_threads(num_threads):
+    """Limit the CPU threads used by TF sessions created afterwards with create_session_config, i.e.
+    in worker processes sharing a machine. None removes the limit."""
+    global _session_thread_limit
+    _session_thread_limit = num_threads
+
+
+def save_humor_model_options(model_dir, dynamic_length=False, use_fused_lstm=False):
+    """Record the build_humor_model options of the model saved in model_dir, which a model must be
+    rebuilt with to be restored (see load_humor_model_options)."""
+    dump_pickle_atomically({'dynamic_length': dynamic_length, 'use_fused_lstm': use_fused_lstm},
+                           os.path.join(model_dir, HUMOR_MODEL_OPTIONS_FILE))
+
+
+def load_humor_model_options(model_dir):
+    """Returns the build_humor_model options recorded by save_humor_model_options for the model saved in
+    model_dir. Models saved without options were built with the defaults."""
+    options = {'dynamic_length': False, 'use_fused_lstm': False}
+    options_path = os.path.join(model_dir, HUMOR_MODEL_OPTIONS_FILE)
+    if os.path.exists(options_path):
+        options.update(pickle.load(open(options_path, 'rb')))
+    return options
+
+
+def create_session_config():
+    """Returns the configuration for TF sessions: GPU memory options and the thread limit, if any."""
+    if _session_thread_limit is None:
+        return tf.ConfigProto(gpu_options=GPU_OPTIONS)
+    return tf.ConfigProto(gpu_options=GPU_OPTIONS, intra_op_parallelism_threads=_session_thread_limit,
+                          inter_op_parallelism_threads=_session_thread_limit)
 
 
 def create_character_model(tweet_size, vocab_size):
@@ -65,11 +107,18 @@ def create_character_model(tweet_size, vocab_size):
     return tweet1_conv_emb, tweet2_conv_emb, tweet1, tweet2
 
 
-def build_humor_model(vocab_size, use_embedding_model=True, use_character_model=True, hidden_dim_size=None):
+def build_humor_model(vocab_size, use_embedding_model=True, use_character_model=True, hidden_dim_size=None,
+                      np_word_embeddings=None, dynamic_length=False, use_fused_lstm=False):
     """Takes in two tweets. For each word in each tweet, if use_embedding_model is true, the model is given a GloVe embedding and a
     phonetic embedding(generated by phoneme_model). If use_character_model is true, it
     will construct a convolutional character-based model. It groups the output of both these models by concatenation,
-    and then makes a prediction of which tweet is funnier using three fully-connected layers."""
+    and then makes a prediction of which tweet is funnier using three fully-connected layers. If np_word_embeddings
+    is given (see tools.load_word_embedding_matrix), tweets and hashtag are fed as int32 word ids instead of
+    embeddings, and embeddings are looked up inside the graph. Trained variables are the same either way, so
+    models can be saved with one input format and restored with the other. If dynamic_length is true, tweet
+    encoders stop at the last word of each tweet instead of running over padding. use_fused_lstm uses the
+    fused LSTMBlockCell kernel (see build_lstm). Tweet features and the dense layer input can be fetched with
+    get_humor_model_tweet_features."""
     print 'Building embedding humor model'
     dense_features = []
 
@@ -77,7 +126,9 @@ def build_humor_model(vocab_size, use_embedding_model=True, use_character_model=
     tf_dropout_rate = tf.placeholder(tf.float32, name='dropout_rate')
 
     tf_first_input_tweets, tf_first_tweet_encoder_output, tf_hashtag, tf_second_input_tweets, tf_second_tweet_encoder_output\
-        = create_embedding_model(tf_batch_size, tf_dropout_rate, lstm_hidden_dim=hidden_dim_size)
+        = create_embedding_model(tf_batch_size, tf_dropout_rate, lstm_hidden_dim=hidden_dim_size,
+                                 np_word_embeddings=np_word_embeddings, dynamic_length=dynamic_length,
+                                 use_fused_lstm=use_fused_lstm)
     if use_embedding_model:
         dense_features.append(tf_first_tweet_encoder_output)
         dense_features.append(tf_second_tweet_encoder_output)
@@ -89,6 +140,8 @@ def build_humor_model(vocab_size, use_embedding_model=True, use_character_model=
 
     tf_tweet_pair_emb = tf.concat(1, dense_features)
     tweet_pair_emb_size = int(tf_tweet_pair_emb.get_shape()[1])
+    for tf_features in [tf_first_tweet_encoder_output, tweet1_conv_emb, tf_tweet_pair_emb]:
+        tf.add_to_collection(HUMOR_MODEL_TWEET_FEATURES, tf_features)
     tf_tweet_pair_emb_dropout = tf.nn.dropout(tf_tweet_pair_emb, keep_prob=tf_dropout_rate)
 
     tf_tweet_dense_layer1, _, _ = create_dense_layer(tf_tweet_pair_emb_dropout, tweet_pair_emb_size,
@@ -112,41 +165,90 @@ def build_humor_model(vocab_size, use_embedding_model=True, use_character_model=
             output_prob, tf_dropout_rate, tf_tweet1, tf_tweet2]  # Model vars
 
 
-def create_embedding_model(tf_batch_size, tf_dropout_rate, lstm_hidden_dim=None):
-    """Applies dropout to and feeds two tweets in separate tweet encoders(shared weights)."""
+def get_humor_model_tweet_features(graph=None):
+    """Returns tensors of the humor model last built in graph (default graph if None) that let tweets be
+    encoded once and compared many times: the tweet encoder output and the character model output of the
+    first tweet, and the input of the pair-level dense layers. The dense layer input can be fed directly
+    with [first encoder, second encoder, first char, second char] features side by side, leaving out the
+    features of unused models."""
+    if graph is None:
+        graph = tf.get_default_graph()
+    tf_tweet_encoder_output, tf_tweet_conv_emb, tf_tweet_pair_emb = \
+        graph.get_collection(HUMOR_MODEL_TWEET_FEATURES)[-3:]
+    return tf_tweet_encoder_output, tf_tweet_conv_emb, tf_tweet_pair_emb
+
+
+def create_embedding_model(tf_batch_size, tf_dropout_rate, lstm_hidden_dim=None, np_word_embeddings=None,
+                           dynamic_length=False, use_fused_lstm=False):
+    """Applies dropout to and feeds two tweets in separate tweet encoders(shared weights). If np_word_embeddings
+    is given, the returned tweet and hashtag placeholders take int32 word ids, which are looked up in a frozen
+    copy of np_word_embeddings. If dynamic_length is true, each encoder stops at the last word of its tweet
+    that has an embedding."""
     # Create placeholders
     word_embedding_size = GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE
     if lstm_hidden_dim is None:
         lstm_hidden_dim = word_embedding_size * 2
-    tf_first_input_tweets = tf.placeholder(dtype=tf.float32,
-                                           shape=[None, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size],
-                                           name='first_tweets')
-    tf_second_input_tweets = tf.placeholder(dtype=tf.float32,
-                                            shape=[None, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size],
-                                            name='second_tweets')
-    tf_hashtag = tf.placeholder(dtype=tf.float32, shape=[None, HUMOR_MAX_WORDS_IN_HASHTAG * word_embedding_size],
-                                name='hashtag')
+    if np_word_embeddings is None:
+        tf_first_input_tweets = tf.placeholder(dtype=tf.float32,
+                                               shape=[None, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size],
+                                               name='first_tweets')
+        tf_second_input_tweets = tf.placeholder(dtype=tf.float32,
+                                                shape=[None, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size],
+                                                name='second_tweets')
+        tf_hashtag = tf.placeholder(dtype=tf.float32, shape=[None, HUMOR_MAX_WORDS_IN_HASHTAG * word_embedding_size],
+                                    name='hashtag')
+        tf_first_tweets = tf_first_input_tweets
+        tf_second_tweets = tf_second_input_tweets
+    else:
+        tf_first_input_tweets = tf.placeholder(dtype=tf.int32, shape=[None, HUMOR_MAX_WORDS_IN_TWEET],
+                                               name='first_tweet_word_ids')
+        tf_second_input_tweets = tf.placeholder(dtype=tf.int32, shape=[None, HUMOR_MAX_WORDS_IN_TWEET],
+                                                name='second_tweet_word_ids')
+        tf_hashtag = tf.placeholder(dtype=tf.int32, shape=[None, HUMOR_MAX_WORDS_IN_HASHTAG], name='hashtag_word_ids')
+        tf_word_embeddings = create_frozen_word_embeddings(np_word_embeddings)
+        tf_first_tweets = tf.reshape(tf.nn.embedding_lookup(tf_word_embeddings, tf_first_input_tweets),
+                                     [-1, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size])
+        tf_second_tweets = tf.reshape(tf.nn.embedding_lookup(tf_word_embeddings, tf_second_input_tweets),
+                                      [-1, HUMOR_MAX_WORDS_IN_TWEET * word_embedding_size])
+    tf_first_tweet_lengths = None
+    tf_second_tweet_lengths = None
+    if dynamic_length:
+        tf_first_tweet_lengths = compute_sequence_lengths(
+            tf.reshape(tf_first_tweets, [-1, HUMOR_MAX_WORDS_IN_TWEET, word_embedding_size]))
+        tf_second_tweet_lengths = compute_sequence_lengths(
+            tf.reshape(tf_second_tweets, [-1, HUMOR_MAX_WORDS_IN_TWEET, word_embedding_size]))
     # Create tweet LSTM encoders to feed into dense layers
-    tf_first_input_tweets_dropout = tf.nn.dropout(tf_first_input_tweets, tf_dropout_rate)
-    tf_second_input_tweets_dropout = tf.nn.dropout(tf_second_input_tweets, tf_dropout_rate)
+    tf_first_input_tweets_dropout = tf.nn.dropout(tf_first_tweets, tf_dropout_rate)
+    tf_second_input_tweets_dropout = tf.nn.dropout(tf_second_tweets, tf_dropout_rate)
 
     tf_first_tweet_encoder_output, tf_first_tweet_hidden_state = build_lstm(lstm_hidden_dim, tf_batch_size,
                                                                             [tf_first_input_tweets_dropout],
                                                                             word_embedding_size,
                                                                             HUMOR_MAX_WORDS_IN_TWEET,
                                                                             lstm_scope='TWEET_ENCODER',
-                                                                            time_step_inputs=[])
+                                                                            time_step_inputs=[],
+                                                                            sequence_length=tf_first_tweet_lengths,
+                                                                            use_fused_lstm=use_fused_lstm)
     tf_second_tweet_encoder_output, tf_second_tweet_hidden_state = build_lstm(lstm_hidden_dim, tf_batch_size,
                                                                               [tf_second_input_tweets_dropout],
                                                                               word_embedding_size,
                                                                               HUMOR_MAX_WORDS_IN_TWEET,
                                                                               lstm_scope='TWEET_ENCODER',
-                                                                              reuse=True, time_step_inputs=[])
+                                                                              reuse=True, time_step_inputs=[],
+                                                                              sequence_length=tf_second_tweet_lengths,
+                                                                              use_fused_lstm=use_fused_lstm)
     return tf_first_input_tweets, tf_first_tweet_encoder_output, tf_hashtag, tf_second_input_tweets, tf_second_tweet_encoder_output
 
 
+def create_frozen_word_embeddings(np_word_embeddings):
+    """Creates a non-trainable variable holding np_word_embeddings. It is a local variable, so savers
+    leave it out of model checkpoints; run tf.local_variables_initializer() to initialize it."""
+    return tf.Variable(np_word_embeddings, trainable=False, collections=[tf.GraphKeys.LOCAL_VARIABLES],
+                       name='word_embeddings')
+
+
 def build_lstm(lstm_hidden_dim, tf_batch_size, inputs, input_time_step_size, num_time_steps, lstm_scope=None,
-               reuse=False, time_step_inputs=None):
+               reuse=False, time_step_inputs=None, sequence_length=None, use_fused_lstm=False):
     """Runs an LSTM over input data and returns LSTM output and hidden state. Arguments:
     lstm_hidden_dim - Size of hidden state of LSTM
     tf_batch_size - Tensor value representing size of current batch. Required for LSTM package
@@ -154,30 +256,51 @@ def build_lstm(lstm_hidden_dim, tf_batch_size, inputs, input_time_step_size, num
     input_time_step_size - Size of input from tf_input that will go into LSTM in a single timestep
     num_time_steps - Number of time steps to run LSTM
     lstm_scope - Can be a string or a scope object. Used to disambiguate variable scopes of different LSTM objects
-    time_step_inputs - Inputs that are per time step. The same tensor is inserted into the model at each time step"""
+    time_step_inputs - Inputs that are per time step. The same tensor is inserted into the model at each time step
+    sequence_length - Optional int32 tensor with the number of time steps to run for each example (see
+    compute_sequence_lengths). The LSTM stops at each example's length instead of running over padding
+    use_fused_lstm - Use the fused LSTMBlockCell kernel. Its variables are named differently from LSTMCell,
+    so models must be trained and restored with the same setting"""
     if time_step_inputs is None:
         time_step_inputs = []
-    lstm = tf.nn.rnn_cell.LSTMCell(num_units=lstm_hidden_dim, state_is_tuple=True)
+    if use_fused_lstm:
+        lstm = tf.contrib.rnn.LSTMBlockCell(num_units=lstm_hidden_dim)
+    else:
+        lstm = tf.nn.rnn_cell.LSTMCell(num_units=lstm_hidden_dim, state_is_tuple=True)
     tf_hidden_state = lstm.zero_state(tf_batch_size, tf.float32)
-    for i in range(num_time_steps):
-        # Grab time step input for each input tensor
-        current_time_step_inputs = []
-        for tf_input in inputs:
-            current_time_step_inputs.append(
-                tf.slice(tf_input, [0, i * input_time_step_size], [-1, input_time_step_size]))
-
-        tf_input_time_step = tf.concat(1, current_time_step_inputs + time_step_inputs)
-
-        with tf.variable_scope(lstm_scope) as scope:
-            if i > 0 or reuse:
-                scope.reuse_variables()
-            tf_lstm_output, tf_hidden_state = lstm(tf_input_time_step, tf_hidden_state)
+    # Arrange inputs as [examples, time steps, time step input].
+    sequence_inputs = [tf.reshape(tf_input, [-1, num_time_steps, input_time_step_size]) for tf_input in inputs]
+    for tf_time_step_input in time_step_inputs:
+        sequence_inputs.append(tf.tile(tf.expand_dims(tf_time_step_input, 1), [1, num_time_steps, 1]))
+    tf_sequence_input = tf.concat(2, sequence_inputs)
+
+    with tf.variable_scope(lstm_scope or 'RNN', reuse=True if reuse else None) as scope:
+        _, tf_hidden_state = tf.nn.dynamic_rnn(lstm, tf_sequence_input, sequence_length=sequence_length,
+                                               initial_state=tf_hidden_state, scope=scope)
+    # The output of an LSTM is its hidden state h, which stays at the last step of each example.
+    tf_lstm_output = tf_hidden_state[1]
     return tf_lstm_output, tf_hidden_state
 
 
-def build_chars_to_phonemes_model(char_vocab_size, phone_vocab_size):
+def compute_sequence_lengths(tf_sequences):
+    """Returns an int32 tensor holding, for each sequence, the position of its last non-zero time
+    step plus one. Sequences are left-aligned and padded with zeros.
+
+    tf_sequences - tensor shaped [examples, time steps] of ids, or [examples, time steps, step size]"""
+    tf_used = tf.abs(tf.cast(tf_sequences, tf.float32))
+    if len(tf_sequences.get_shape()) == 3:
+        tf_used = tf.reduce_max(tf_used, 2)
+    tf_used = tf.sign(tf_used)
+    num_time_steps = int(tf_sequences.get_shape()[1])
+    tf_positions = tf.cast(tf.range(1, num_time_steps + 1), tf.float32)
+    return tf.cast(tf.reduce_max(tf_used * tf_positions, 1), tf.int32)
+
+
+def build_chars_to_phonemes_model(char_vocab_size, phone_vocab_size, dynamic_length=False, use_fused_lstm=False):
     """Here we build a model that takes in a series of characters and outputs a series of phonemes.
-    The model, once trained, can pronounce words."""
+    The model, once trained, can pronounce words. If dynamic_length is true, the encoder stops at the
+    last character of each word instead of running over padding. use_fused_lstm uses the fused LSTMBlockCell
+    kernel (see build_lstm)."""
     print 'Building model'
     with tf.name_scope('CHAR_TO_PHONE_MODEL'):
         # PLACEHOLDERS. Model takes in a sequence of characters contained in tf_words.
@@ -186,39 +309,37 @@ def build_chars_to_phonemes_model(char_vocab_size, phone_vocab_size):
         tf_words = tf.placeholder(tf.int32, [None, MAX_WORD_SIZE], 'words')
         # Lookup up embeddings for all characters in each word.
         tf_char_emb = tf.Variable(tf.random_normal([char_vocab_size, PHONE_CHAR_EMB_DIM]), name='character_emb')
+        tf_char_embeddings = tf.nn.embedding_lookup(tf_char_emb, tf_words)
         # Insert each character one by one into an LSTM.
-        lstm = tf.nn.rnn_cell.LSTMCell(num_units=PHONE_ENCODER_LSTM_EMB_DIM, state_is_tuple=True)
-        encoder_hidden_state = lstm.zero_state(tf_batch_size, tf.float32)
-        for i in range(MAX_WORD_SIZE):
-            tf_char_embedding = tf.nn.embedding_lookup(tf_char_emb, tf_words[:, i])
-
-            with tf.variable_scope('LSTM_ENCODER') as lstm_scope:
-                if i > 0:
-                    lstm_scope.reuse_variables()
-                encoder_output, encoder_hidden_state = lstm(tf_char_embedding, encoder_hidden_state)
+        tf_word_lengths = None
+        if dynamic_length:
+            tf_word_lengths = compute_sequence_lengths(tf_words)
+        encoder_output, encoder_hidden_state = build_lstm(PHONE_ENCODER_LSTM_EMB_DIM, tf_batch_size,
+                                                          [tf_char_embeddings], PHONE_CHAR_EMB_DIM, MAX_WORD_SIZE,
+                                                          lstm_scope='LSTM_ENCODER', sequence_length=tf_word_lengths,
+                                                          use_fused_lstm=use_fused_lstm)
         # Run encoder output through dense layer to process output
         tf_encoder_output_w = tf.Variable(tf.random_normal([PHONE_ENCODER_LSTM_EMB_DIM, PHONE_ENCODER_LSTM_EMB_DIM]), name='encoder_output_emb')
         tf_encoder_output_b = tf.Variable(tf.random_normal([PHONE_ENCODER_LSTM_EMB_DIM]), name='encoder_output_bias')
         encoder_output_emb = tf.matmul(encoder_output, tf_encoder_output_w) + tf_encoder_output_b
 
-        decoder_hidden_state = lstm.zero_state(tf_batch_size, tf.float32)
-
         # Use hidden state of character encoding stage (this is the phoneme embedding) to predict phonemes.
-        phonemes = []
-        tf_phone_pred_w = tf.Variable(tf.random_normal([lstm.output_size, phone_vocab_size]),
+        # The decoder receives the phoneme embedding at every time step.
+        tf_phone_pred_w = tf.Variable(tf.random_normal([PHONE_ENCODER_LSTM_EMB_DIM, phone_vocab_size]),
                                       name='phoneme_prediction_emb')
         tf_phone_pred_b = tf.Variable(tf.random_normal([phone_vocab_size]), name='phoneme_prediction_bias')
-        for j in range(MAX_PRONUNCIATION_SIZE):
-            with tf.variable_scope('LSTM_DECODER') as lstm_scope:
-                if j == 0:
-                    decoder_output, decoder_hidden_state = lstm(encoder_output_emb, decoder_hidden_state)
-                else:
-                    lstm_scope.reuse_variables()
-                    # decoder_output, decoder_hidden_state = lstm(tf.zeros([tf_batch_size, LSTM_EMB_DIM]), decoder_hidden_state)
-                    decoder_output, decoder_hidden_state = lstm(encoder_output_emb, decoder_hidden_state)
-                phoneme = tf.matmul(decoder_output, tf_phone_pred_w) + tf_phone_pred_b
-                phonemes.append(phoneme)
-        tf_phonemes = tf.pack(phonemes, axis=1)
+        if use_fused_lstm:
+            decoder_lstm = tf.contrib.rnn.LSTMBlockCell(num_units=PHONE_ENCODER_LSTM_EMB_DIM)
+        else:
+            decoder_lstm = tf.nn.rnn_cell.LSTMCell(num_units=PHONE_ENCODER_LSTM_EMB_DIM, state_is_tuple=True)
+        decoder_inputs = tf.tile(tf.expand_dims(encoder_output_emb, 1), [1, MAX_PRONUNCIATION_SIZE, 1])
+        with tf.variable_scope('LSTM_DECODER') as lstm_scope:
+            decoder_outputs, _ = tf.nn.dynamic_rnn(decoder_lstm, decoder_inputs,
+                                                   initial_state=decoder_lstm.zero_state(tf_batch_size, tf.float32),
+                                                   scope=lstm_scope)
+        phonemes = tf.matmul(tf.reshape(decoder_outputs, [-1, PHONE_ENCODER_LSTM_EMB_DIM]),
+                             tf_phone_pred_w) + tf_phone_pred_b
+        tf_phonemes = tf.reshape(phonemes, [-1, MAX_PRONUNCIATION_SIZE, phone_vocab_size])
     # Print model variables.
     model_variables = tf.trainable_variables()
     print 'Model variables:'
@@ -268,7 +389,7 @@ def generate_phonetic_embs_from_words(words, char_to_index_path, phone_to_index_
     # Prove words converted to indices correctly by reversing the process and printing.
     index_to_char = invert_dictionary(char_to_index)
     print 'Example GloVe words recreated from indices:'
-    for i in range(130, 140):
+    for i in range(min(130, len(words)), min(140, len(words))):
         np_word = np_word_indices[i, :]
         char_list = []
         for j in np_word:
@@ -307,12 +428,14 @@ def create_tensorboard_visualization(model_name, graph=None):
     tf.global_variables_initializer().run()
 
 
-def predict_on_hashtag(sess, model_vars, hashtag_name, hashtag_dir, hashtag_datas):
+def predict_on_hashtag(sess, model_vars, hashtag_name, hashtag_dir, hashtag_datas, word_to_id=None,
+                       tweet_input_dir=None):
     """Predicts on a hashtag. Returns the accuracy of predictions on all tweet pairs and returns
     a list. The list contains the predictions on all tweet pairs, and tweet ids for the first and second tweets in
     each pair. If error analysis stats are provided, the function will print the tweet pairs the model performed the worst
     on. error_analysis_stats should be a string and a number. The string is the location where Semeval hashtag .tsv files are kept(training or testing).
-    The number is the number of worst tweet pairs to print."""
+    The number is the number of worst tweet pairs to print. For models built to take word ids, word_to_id and
+    the tweet_input_dir holding the hashtag .tsv file must be given."""
     print 'Predicting on hashtag %s' % hashtag_name
     np_first_tweets_char, np_second_tweets_char = extract_tweet_pair_from_hashtag_datas(hashtag_datas, hashtag_name)
 
@@ -320,14 +443,24 @@ def predict_on_hashtag(sess, model_vars, hashtag_name, hashtag_dir, hashtag_data
      tf_tweet_humor_rating, tf_batch_size, tf_hashtag, tf_output_prob,
      tf_dropout_rate, tf_tweet1, tf_tweet2] = model_vars
 
-    np_first_tweets, np_second_tweets, np_labels, \
-    first_tweet_ids, second_tweet_ids, np_hashtag = load_hashtag_data(hashtag_dir, hashtag_name)
+    np_tweet_gloves, np_first_index, np_second_index, np_labels, \
+    tweet_ids, np_hashtag = load_hashtag_tweet_store(hashtag_dir, hashtag_name)
+    if word_to_id is None:
+        np_first_tweets = gather_tweet_embeddings(np_tweet_gloves, np_first_index)
+        np_second_tweets = gather_tweet_embeddings(np_tweet_gloves, np_second_index)
+    else:
+        np_tweet_word_ids, np_hashtag, _ = convert_hashtag_to_word_ids(tweet_input_dir, hashtag_name, word_to_id)
+        np_first_tweets = np_tweet_word_ids[np_first_index]
+        np_second_tweets = np_tweet_word_ids[np_second_index]
+    first_tweet_ids = [tweet_ids[index] for index in np_first_index]
+    second_tweet_ids = [tweet_ids[index] for index in np_second_index]
 
     np_predictions, np_output_prob = sess.run([tf_predictions, tf_output_prob],
                                               feed_dict={tf_first_input_tweets: np_first_tweets,
                                                          tf_second_input_tweets: np_second_tweets,
                                                          tf_batch_size: np_first_tweets.shape[0],
-                                                         tf_hashtag: np_hashtag,
+                                                         tf_hashtag: np.repeat(np_hashtag, np_first_tweets.shape[0],
+                                                                               axis=0),
                                                          tf_dropout_rate: 1.0,
                                                          tf_tweet1: np_first_tweets_char,
                                                          tf_tweet2: np_second_tweets_char})
@@ -3,9 +3,19 @@ This makes a function easily accessible and independent of the application. Func
 here are dependent on data stored in the data/ folder."""
 import cPickle as pickle
 import csv
+import hashlib
+import multiprocessing
 import os
 import random
+import re
+import string
+import sys
+import tempfile
+import threading
+import time
+import zipfile
 from os import walk
+from Queue import Queue, Empty
 
 import nltk
 import numpy as np
@@ -14,6 +24,43 @@ from config import TWEET_SIZE, TWEET_PAIR_LABEL_RANDOM_SEED
 from config import HUMOR_MAX_WORDS_IN_HASHTAG, HUMOR_MAX_WORDS_IN_TWEET
 from config import GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE
 from config import SEMEVAL_HUMOR_TRAIN_DIR, HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR
+from config import WORD_VECTORS_FILE_PATH, WORD_VECTORS_MATRIX_FILE_PATH, WORD_VECTORS_INDEX_FILE_PATH
+from config import HUMOR_WORD_TO_GLOVE_FILE_PATH, HUMOR_WORD_TO_PHONETIC_FILE_PATH
+from config import TOKENIZED_TWEET_CACHE_DIR
+
+# File names of the consolidated tweet store inside an embedding tweet pair directory.
+TWEET_STORE_INDEX_FILE = 'tweet_store_index.cpkl'
+TWEET_STORE_GLOVE_FILE = 'tweet_glove.bin'
+TWEET_STORE_PAIRS_FILE = 'tweet_pairs.npy'
+TWEET_STORE_TWEET_IDS_FILE = 'tweet_ids.npy'
+TWEET_STORE_HASHTAG_GLOVE_FILE = 'hashtag_glove.npy'
+# File name of the build manifest kept in each derived data directory (see BuildManifest).
+BUILD_MANIFEST_FILE = 'build_manifest.cpkl'
+# Number of tweet pairs held at once when pairing every combination of tweets (see generate_tweet_pair_index_chunks).
+TWEET_PAIR_CHUNK_SIZE = 100000
+# Version of the tweet tokenization of the embedding model, part of the tokenized tweet cache key (see
+# get_tokenized_tweet_cache_path). Increase it whenever format_text_for_embedding_model or
+# tokenize_tweet_for_embedding_model change their output, so that cached tokens are not served stale.
+TWEET_TOKENIZER_VERSION = 2
+
+# A hashtag runs from '#' up to and including the next space (see format_text_for_embedding_model).
+HASHTAG_PATTERN = re.compile(r'#[^ ]* ?')
+# Characters of a hashtag that start a new word: capitals, and non-letters that follow a letter.
+HASHTAG_WORD_START_PATTERN = re.compile(r'[A-Z]|(?<=[A-Za-z])[^A-Za-z#]')
+# Characters dropped from tweet text outside of hashtags: all but letters, spaces and '@'.
+NON_TWEET_TEXT_CHARACTERS = ''.join([chr(code) for code in range(256)
+                                     if chr(code) not in string.ascii_letters + ' @'])
+
+# Tweet stores memory-mapped by load_tweet_store(), by directory.
+_opened_tweet_stores = {}
+# GloVe binary caches opened by load_glove_binary(), by matrix file path.
+_opened_glove_binaries = {}
+# Permission bits masked out of new files, read once as os.umask can only be read by setting it.
+_file_creation_mask = os.umask(0)
+os.umask(_file_creation_mask)
+# Per-hashtag function and its shared arguments, set in each map_hashtags() worker process.
+_worker_function = None
+_worker_shared_args = ()
 
 
 def output_tweet_statistics(hashtags, directory=SEMEVAL_HUMOR_TRAIN_DIR):
@@ -76,24 +123,97 @@ def output_tweet_statistics(hashtags, directory=SEMEVAL_HUMOR_TRAIN_DIR):
     print 'Winning tweet length standard deviation: %s' % winning_tweet_std_dev
 
 
-def build_character_vocabulary(hashtags, directory=SEMEVAL_HUMOR_TRAIN_DIR):
+class Vocabulary(object):
+    """Assigns each token a stable integer id in order of insertion. Token lookups
+    use a dictionary, so adding a token or finding its id takes constant time.
+    Counts how often each token was added, so rare tokens can be pruned.
+
+    tokens - optional tokens to add on creation, i.e. [''] to reserve id 0 for padding"""
+    def __init__(self, tokens=None):
+        self.index_to_token = []
+        self.token_to_index = {}
+        self.counts = []
+        if tokens is not None:
+            self.add_all(tokens)
+
+    def __len__(self):
+        return len(self.index_to_token)
+
+    def __contains__(self, token):
+        return token in self.token_to_index
+
+    def __iter__(self):
+        return iter(self.index_to_token)
+
+    def add(self, token, count=1):
+        """Add token to the vocabulary if it is new, increase its count and return its id."""
+        index = self.token_to_index.get(token)
+        if index is None:
+            index = len(self.index_to_token)
+            self.token_to_index[token] = index
+            self.index_to_token.append(token)
+            self.counts.append(0)
+        self.counts[index] += count
+        return index
+
+    def add_all(self, tokens):
+        for token in tokens:
+            self.add(token)
+
+    def index(self, token, default=None):
+        """Returns the id of token, or default if token is not in the vocabulary."""
+        return self.token_to_index.get(token, default)
+
+    def prune(self, min_count=1, max_size=None, keep_tokens=()):
+        """Returns a new vocabulary without tokens added fewer than min_count times. If max_size
+        is given, only the max_size most frequent tokens are kept (ties go to earlier tokens).
+        Tokens in keep_tokens are always kept. Remaining tokens keep their relative order."""
+        kept_indices = [i for i in range(len(self.index_to_token))
+                        if self.counts[i] >= min_count or self.index_to_token[i] in keep_tokens]
+        if max_size is not None and len(kept_indices) > max_size:
+            kept_indices.sort(key=lambda i: (self.index_to_token[i] not in keep_tokens, -self.counts[i], i))
+            kept_indices = sorted(kept_indices[:max_size])
+        pruned_vocabulary = Vocabulary()
+        for i in kept_indices:
+            pruned_vocabulary.add(self.index_to_token[i], count=self.counts[i])
+        return pruned_vocabulary
+
+    def to_dictionary(self):
+        """Returns a dictionary mapping from tokens to their ids."""
+        return dict(self.token_to_index)
+
+    def save(self, filename):
+        """Save tokens in id order along with their counts."""
+        pickle.dump({'tokens': self.index_to_token, 'counts': np.array(self.counts, dtype=np.int64)},
+                    open(filename, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, filename):
+        """Load a vocabulary saved with save()."""
+        saved_vocabulary = pickle.load(open(filename, 'rb'))
+        vocabulary = cls()
+        for token, count in zip(saved_vocabulary['tokens'], saved_vocabulary['counts']):
+            vocabulary.add(token, count=int(count))
+        return vocabulary
+
+
+def build_character_vocabulary(hashtags, directory=SEMEVAL_HUMOR_TRAIN_DIR, char_to_index=None):
     """Find all characters special or alphabetical that appear in the dataset.
     Construct a vocabulary that assigns a unique index to each character and
-    return that vocabulary. Vocabulary does not include anything with a backslash."""
-    characters = ['']
+    return that vocabulary. Vocabulary does not include anything with a backslash.
+    If an existing char_to_index is given, its characters keep their indices and
+    new characters are added after them."""
+    if char_to_index is None:
+        vocabulary = Vocabulary([''])
+    else:
+        vocabulary = Vocabulary(sorted(char_to_index, key=char_to_index.get))
     #Create list of all characters that appear in dataset.
     for hashtag in hashtags:
         with open(directory + hashtag + '.tsv') as tsv:
             for line in csv.reader(tsv, dialect='excel-tab'):
-                for char in line[1]:
-                    # If character hasn't been seen before, add it to the vocabulary.
-                    if char not in characters:
-                        characters.append(char)
-    # Create dictionary from list to map from characters to their indices.
-    vocabulary = {}
-    for i in range(len(characters)):
-        vocabulary[characters[i]] = i
-    return vocabulary
+                vocabulary.add_all(line[1])
+    # Create dictionary to map from characters to their indices.
+    return vocabulary.to_dictionary()
 
 
 def save_hashtag_data(np_tweet_pairs, np_tweet_pair_labels, hashtag, directory=HUMOR_TRAIN_TWEET_PAIR_CHAR_DIR):
@@ -106,80 +226,545 @@ def save_hashtag_data(np_tweet_pairs, np_tweet_pair_labels, hashtag, directory=H
     np.save(directory + hashtag + '_labels.npy', np_tweet_pair_labels)
 
 
-def process_hashtag_data(hashtag_dir, char_to_index_path, tweet_pair_path):
+def process_hashtag_data(hashtag_dir, char_to_index_path, tweet_pair_path, workers=1):
+    """Build a character vocabulary, then extract and save character tweet pairs for each hashtag.
+    With workers > 1, hashtags are converted in parallel (see map_hashtags). Hashtags whose .tsv
+    file is unchanged since the last run are skipped (see BuildManifest). The character vocabulary
+    of the last run is extended rather than rebuilt, so tweet pairs already saved stay valid."""
+    manifest = BuildManifest(tweet_pair_path + BUILD_MANIFEST_FILE,
+                             {'TWEET_SIZE': TWEET_SIZE, 'TWEET_PAIR_LABEL_RANDOM_SEED': TWEET_PAIR_LABEL_RANDOM_SEED})
     hashtags = get_hashtag_file_names(hashtag_dir)
-    char_to_index = build_character_vocabulary(hashtags, directory=hashtag_dir)
+    char_to_index = build_character_vocabulary(hashtags, directory=hashtag_dir,
+                                               char_to_index=manifest.data.get('char_to_index'))
     print('Size of character vocabulary: %s' % len(char_to_index))
     output_tweet_statistics(hashtags, directory=hashtag_dir)
-    print 'Extracting tweet pairs...'
-    for i in range(len(hashtags)):
-        hashtag = hashtags[i]
-        random.seed(TWEET_PAIR_LABEL_RANDOM_SEED + hashtag)
-        data = extract_tweet_pairs_from_file(hashtag_dir + hashtag + '.tsv')
-        np_tweet_pairs, np_tweet_pair_labels = format_tweet_pairs(data, char_to_index)
-        save_hashtag_data(np_tweet_pairs, np_tweet_pair_labels, hashtag, directory=tweet_pair_path)
+    input_hashes = {hashtag: hash_build_inputs([hashtag_dir + hashtag + '.tsv']) for hashtag in hashtags}
+    stale_hashtags = [hashtag for hashtag in hashtags if not manifest.is_fresh(hashtag, input_hashes[hashtag])]
+    print 'Extracting tweet pairs for %s of %s hashtags...' % (len(stale_hashtags), len(hashtags))
+    np_char_table = build_character_lookup_table(char_to_index)
+    for hashtag in map_hashtags(convert_hashtag_to_tweet_pair_file, stale_hashtags,
+                                shared_args=(hashtag_dir, char_to_index, np_char_table, tweet_pair_path),
+                                workers=workers):
+        manifest.record(hashtag, input_hashes[hashtag], [tweet_pair_path + hashtag + '_pairs.npy',
+                                                         tweet_pair_path + hashtag + '_labels.npy'])
+    manifest.retain(hashtags)
+    manifest.data['char_to_index'] = char_to_index
+    manifest.save()
     print 'Saving char_to_index.cpkl containing character vocabulary'
     if char_to_index_path is not None:
         pickle.dump(char_to_index, open(char_to_index_path, 'wb'))
     print "Done!"
 
 
-def format_tweet_pairs(data, char_to_index, max_tweet_size=140):
+def convert_hashtag_to_tweet_pair_file(hashtag, hashtag_dir, char_to_index, np_char_table, tweet_pair_path):
+    """Extract tweet pairs from one hashtag, convert them to character indices and save them.
+    Returns the hashtag name."""
+    random.seed(TWEET_PAIR_LABEL_RANDOM_SEED + hashtag)
+    data = extract_tweet_pairs_from_file(hashtag_dir + hashtag + '.tsv')
+    np_tweet_pairs, np_tweet_pair_labels = format_tweet_pairs(data, char_to_index, np_char_table=np_char_table)
+    save_hashtag_data(np_tweet_pairs, np_tweet_pair_labels, hashtag, directory=tweet_pair_path)
+    return hashtag
+
+
+def map_hashtags(function, hashtag_names, shared_args=(), workers=1, ordered=True):
+    """Call function(hashtag_name, *shared_args) for each hashtag and yield the results in
+    hashtag order. With workers > 1, hashtags are spread across a pool of worker processes.
+    If ordered is False, (hashtag_name, result) pairs are yielded as soon as each hashtag is
+    done instead, so callers can act on results while slower hashtags are still running.
+    The function and shared_args are handed to each worker once when the pool forks, so large
+    read-only tables (GloVe, phonetic embeddings) are shared with the workers instead of being
+    pickled into every task. Only hashtag names and results are sent between processes.
+    Functions that use random numbers must seed per hashtag for results to match a serial run.
+
+    function - module-level function taking a hashtag name followed by shared_args
+    hashtag_names - hashtags to process
+    shared_args - tuple of read-only arguments passed after the hashtag name
+    workers - number of worker processes, 1 to run serially in this process
+    ordered - yield results in hashtag order, or (hashtag_name, result) pairs in order of completion"""
+    if workers <= 1 or len(hashtag_names) <= 1:
+        for hashtag_name in hashtag_names:
+            result = function(hashtag_name, *shared_args)
+            yield result if ordered else (hashtag_name, result)
+        return
+    pool = multiprocessing.Pool(min(workers, len(hashtag_names)), initializer=_initialize_hashtag_worker,
+                                initargs=(function, shared_args))
+    try:
+        if ordered:
+            results = pool.imap(_call_hashtag_worker, hashtag_names)
+        else:
+            results = pool.imap_unordered(_call_named_hashtag_worker, hashtag_names)
+        for result in results:
+            yield result
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    finally:
+        pool.join()
+
+
+def _initialize_hashtag_worker(function, shared_args):
+    global _worker_function, _worker_shared_args
+    _worker_function = function
+    _worker_shared_args = shared_args
+
+
+def _call_hashtag_worker(hashtag_name):
+    return _worker_function(hashtag_name, *_worker_shared_args)
+
+
+def _call_named_hashtag_worker(hashtag_name):
+    return hashtag_name, _worker_function(hashtag_name, *_worker_shared_args)
+
+
+def get_worker_count(argv):
+    """Returns N if '--workers N' appears in command line arguments argv, otherwise 1."""
+    if '--workers' in argv:
+        position = argv.index('--workers')
+        if position + 1 < len(argv):
+            return int(argv[position + 1])
+    return 1
+
+
+def prefetch_batches(tasks, generate_batches, num_threads=2, max_prefetched_batches=8):
+    """Yield the batches of all tasks while worker threads assemble upcoming batches in the background.
+    Each worker takes the next task (i.e. a hashtag name) and puts every batch from generate_batches(task)
+    into a queue holding at most max_prefetched_batches, so loading and batch assembly overlap with
+    whatever the caller does with each batch (i.e. a training step). With more than one thread, batches
+    of different tasks are interleaved. An exception raised in a worker is raised again in the caller.
+
+    tasks - list of tasks, started in order
+    generate_batches - function taking a task and returning an iterable of batches
+    num_threads - number of worker threads
+    max_prefetched_batches - maximum number of batches waiting to be consumed"""
+    task_queue = Queue()
+    for task in tasks:
+        task_queue.put(task)
+    batch_queue = Queue(maxsize=max_prefetched_batches)
+    stop_event = threading.Event()
+    finished_marker = object()
+
+    def work():
+        try:
+            while not stop_event.is_set():
+                try:
+                    task = task_queue.get_nowait()
+                except Empty:
+                    break
+                for batch in generate_batches(task):
+                    batch_queue.put(('batch', batch))
+                    if stop_event.is_set():
+                        break
+        except Exception:
+            batch_queue.put(('error', sys.exc_info()))
+        batch_queue.put(('finished', finished_marker))
+
+    num_threads = max(1, min(num_threads, len(tasks)))
+    threads = [threading.Thread(target=work) for _ in range(num_threads)]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    num_finished_threads = 0
+    try:
+        while num_finished_threads < num_threads:
+            kind, value = batch_queue.get()
+            if kind == 'batch':
+                yield value
+            elif kind == 'error':
+                raise value[0], value[1], value[2]
+            else:
+                num_finished_threads += 1
+    finally:
+        # Let workers blocked on a full queue finish if the caller stops early.
+        stop_event.set()
+        while any([thread.is_alive() for thread in threads]):
+            while not batch_queue.empty():
+                batch_queue.get()
+            for thread in threads:
+                thread.join(0.01)
+
+
+def sample_pair_batches(pair_counts, batch_size, random_state, stratified=False, tail='pad'):
+    """Pool the tweet pairs of several hashtags and split them into shuffled batches of batch_size pairs,
+    so that batches mix hashtags and all have the same shape. Returns a list of int numpy arrays, one per
+    batch, each row holding (hashtag position in pair_counts, pair index within that hashtag).
+
+    pair_counts - number of tweet pairs of each hashtag
+    batch_size - number of pairs per batch
+    random_state - numpy RandomState used for shuffling
+    stratified - if True, every stretch of the shuffled pool holds pairs of all hashtags in proportion
+        to their size, instead of whatever a plain shuffle gives
+    tail - what to do with leftover pairs that do not fill a batch: 'pad' fills the last batch with pairs
+        drawn at random from the pool, 'drop' leaves them out, 'keep' keeps a smaller last batch"""
+    if tail not in ['pad', 'drop', 'keep']:
+        raise ValueError('Unknown tail mode: %s' % tail)
+    np_pair_counts = np.array(pair_counts, dtype=int)
+    num_pairs = int(np.sum(np_pair_counts))
+    if num_pairs == 0:
+        return []
+    np_hashtag_index = np.repeat(np.arange(np_pair_counts.size), np_pair_counts)
+    np_pair_index = np.arange(num_pairs) - np.repeat(np.cumsum(np_pair_counts) - np_pair_counts, np_pair_counts)
+    if stratified:
+        # Give each pair a random slot within its hashtag and sort all pairs by the relative position of their slot.
+        np_slots = np.concatenate([random_state.permutation(count) for count in np_pair_counts])
+        np_keys = (np_slots + random_state.uniform(size=num_pairs)) / np_pair_counts[np_hashtag_index]
+        np_order = np.argsort(np_keys, kind='mergesort')
+    else:
+        np_order = random_state.permutation(num_pairs)
+    np_pairs = np.stack([np_hashtag_index[np_order], np_pair_index[np_order]], axis=1)
+    batches = [np_pairs[start:start + batch_size] for start in range(0, num_pairs, batch_size)]
+    if batches[-1].shape[0] < batch_size:
+        if tail == 'drop':
+            batches = batches[:-1]
+        elif tail == 'pad':
+            np_padding = np_pairs[random_state.randint(0, num_pairs, batch_size - batches[-1].shape[0])]
+            batches[-1] = np.concatenate([batches[-1], np_padding], axis=0)
+    return batches
+
+
+class MicroBatcher(object):
+    """Coalesces concurrent prediction requests into batches. Any thread can submit a dictionary of numpy
+    arrays sharing their first dimension (i.e. model inputs for n tweet pairs). A single background thread
+    waits up to max_wait seconds for more requests after the first one arrives, or until max_batch_size rows
+    are pending, then concatenates them and calls run_batch once. run_batch must return a tuple of numpy
+    arrays with one row per input row, which are split back between the requests. Because run_batch always
+    runs in the same thread, it can use resources that are not thread-safe (i.e. a TF session). Work that
+    should not be batched can be run in that thread too (see call), between batches.
+
+    run_batch - function taking a dictionary of concatenated input arrays and returning a tuple of arrays
+    max_batch_size - number of rows after which a batch is run without waiting any longer
+    max_wait - seconds to wait for further requests after the first request of a batch"""
+    def __init__(self, run_batch, max_batch_size=64, max_wait=0.005):
+        self.run_batch = run_batch
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.request_queue = Queue()
+        self.thread = threading.Thread(target=self._work)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, inputs):
+        """Queue inputs for the next batch and block until its outputs are ready. Returns the rows of
+        each array returned by run_batch that belong to inputs. Exceptions raised by run_batch are
+        raised again here."""
+        return self._wait({'inputs': inputs,
+                           'size': len(inputs.values()[0]),
+                           'done': threading.Event(),
+                           'outputs': None,
+                           'error': None})
+
+    def call(self, function, *args):
+        """Run function(*args) in the background thread on its own, after the batch being gathered, and block
+        until it returns. Returns its result. Exceptions raised by function are raised again here."""
+        return self._wait({'function': function,
+                           'args': args,
+                           'done': threading.Event(),
+                           'outputs': None,
+                           'error': None})
+
+    def _wait(self, request):
+        self.request_queue.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error'][0], request['error'][1], request['error'][2]
+        return request['outputs']
+
+    def close(self):
+        """Run all pending requests and stop the background thread."""
+        self.request_queue.put(None)
+        self.thread.join()
+
+    def _work(self):
+        running = True
+        while running:
+            request = self.request_queue.get()
+            if request is None:
+                break
+            if 'function' in request:
+                self._run_call(request)
+                continue
+            requests = [request]
+            num_rows = request['size']
+            call_request = None
+            deadline = time.time() + self.max_wait
+            while num_rows < self.max_batch_size:
+                remaining_wait = deadline - time.time()
+                if remaining_wait <= 0:
+                    break
+                try:
+                    request = self.request_queue.get(timeout=remaining_wait)
+                except Empty:
+                    break
+                if request is None:
+                    running = False
+                    break
+                if 'function' in request:
+                    call_request = request
+                    break
+                requests.append(request)
+                num_rows += request['size']
+            self._run_requests(requests)
+            if call_request is not None:
+                self._run_call(call_request)
+
+    def _run_call(self, request):
+        try:
+            request['outputs'] = request['function'](*request['args'])
+        except Exception:
+            request['error'] = sys.exc_info()
+        request['done'].set()
+
+    def _run_requests(self, requests):
+        try:
+            inputs = {key: np.concatenate([request['inputs'][key] for request in requests], axis=0)
+                      for key in requests[0]['inputs']}
+            outputs = self.run_batch(inputs)
+            start = 0
+            for request in requests:
+                end = start + request['size']
+                request['outputs'] = tuple([np_output[start:end] for np_output in outputs])
+                start = end
+        except Exception:
+            error = sys.exc_info()
+            for request in requests:
+                request['error'] = error
+        for request in requests:
+            request['done'].set()
+
+
+class BuildManifest(object):
+    """Remembers what each output of a preprocessing stage was built from, so that a rebuild
+    only recomputes outputs whose inputs changed. Each output is recorded under a key (usually a
+    hashtag name) with a hash of its inputs (see hash_build_inputs) and the paths of its artifacts.
+    All entries are discarded if the build configuration (i.e. HUMOR_MAX_WORDS_IN_TWEET, TWEET_SIZE,
+    random seed) differs from the one the manifest was saved with. Stages can keep extra state
+    needed for the next build in the data dictionary.
+
+    manifest_path - file the manifest is loaded from and saved to
+    config - dictionary of configuration values the outputs depend on"""
+    def __init__(self, manifest_path, config):
+        self.manifest_path = manifest_path
+        self.config = config
+        self.entries = {}
+        self.data = {}
+        if os.path.exists(manifest_path):
+            saved_manifest = pickle.load(open(manifest_path, 'rb'))
+            if saved_manifest['config'] == config:
+                self.entries = saved_manifest['entries']
+                self.data = saved_manifest['data']
+
+    def is_fresh(self, key, input_hash):
+        """Returns True if key was built from inputs with input_hash and all of its artifacts still exist."""
+        entry = self.entries.get(key)
+        return entry is not None and entry['input_hash'] == input_hash and \
+            all([os.path.exists(artifact_path) for artifact_path in entry['artifacts']])
+
+    def record(self, key, input_hash, artifact_paths=()):
+        """Record that key was built from inputs with input_hash into artifact_paths."""
+        self.entries[key] = {'input_hash': input_hash, 'artifacts': list(artifact_paths)}
+
+    def retain(self, keys):
+        """Forget entries that are not in keys, i.e. hashtags that were removed from the dataset."""
+        keys = set(keys)
+        self.entries = {key: entry for key, entry in self.entries.iteritems() if key in keys}
+
+    def save(self):
+        """Save the manifest. The file is replaced in one step, so an interrupted save keeps the old manifest."""
+        dump_pickle_atomically({'config': self.config, 'entries': self.entries, 'data': self.data},
+                               self.manifest_path)
+
+
+def dump_pickle_atomically(obj, file_path):
+    """Pickle obj to file_path through a temporary file that is renamed into place, so the file is
+    either complete or not replaced at all if the process dies while writing. Each call writes its own
+    temporary file, so concurrent writers never mix their output. Creates missing directories."""
+    temp_fd, temp_path = create_temporary_file(file_path)
+    try:
+        with os.fdopen(temp_fd, 'wb') as f:
+            pickle.dump(obj, f, pickle.HIGHEST_PROTOCOL)
+        os.rename(temp_path, file_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def create_temporary_file(file_path):
+    """Create a uniquely named temporary file next to file_path, to be renamed to file_path once written.
+    Unlike tempfile.mkstemp files, which only the owner can read, it gets the permissions a file created
+    with open() would get, and keeps them after the rename. Creates missing directories. Returns the open
+    file descriptor and the path of the temporary file."""
+    file_dir = os.path.dirname(file_path)
+    if file_dir != '' and not os.path.exists(file_dir):
+        os.makedirs(file_dir)
+    temp_fd, temp_path = tempfile.mkstemp(dir=file_dir or '.', prefix=os.path.basename(file_path) + '.',
+                                          suffix='.tmp')
+    os.fchmod(temp_fd, 0666 & ~_file_creation_mask)
+    return temp_fd, temp_path
+
+
+def hash_build_inputs(file_paths, words=(), word_tables=()):
+    """Returns a SHA-1 hex digest of the contents of file_paths. If word_tables (i.e. word_to_glove)
+    are given, the vector of each word in words is hashed as well, so that an output only goes stale
+    when the vectors of the words it actually uses change.
+
+    file_paths - input files, hashed in the order given
+    words - words whose vectors an output depends on
+    word_tables - dictionaries mapping from words to vectors"""
+    digest = hashlib.sha1()
+    for file_path in file_paths:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    for word in sorted(set(words)):
+        digest.update(word + '\0')
+        for word_table in word_tables:
+            if word in word_table:
+                digest.update(np.asarray(word_table[word], dtype=np.float64).tobytes())
+            else:
+                digest.update('\0')
+    return digest.hexdigest()
+
+
+def format_tweet_pairs(data, char_to_index, max_tweet_size=140, np_char_table=None):
     """This script converts every character in all tweets into an index.
-    It stores each tweet side by side, each tweet constrained to 150 characters long.
-    The total matrix is m x 300, for m tweet pairs, two 150 word tweets per row."""
+    It stores each tweet side by side, each tweet constrained to 140 characters long.
+    The total matrix is m x 280, for m tweet pairs, two 140 character tweets per row.
+    Each unique tweet is converted once and then gathered into every pair it appears in.
+    A lookup table from build_character_lookup_table() can be passed in as np_char_table
+    to avoid rebuilding it on every call."""
     labels_exist = (len(data[0]) > 4)
-    # Create numpy matrices to hold tweet pairs and their labels.
-    np_tweet_pairs = np.zeros(shape=[len(data), max_tweet_size * 2], dtype=int)
+    if np_char_table is None:
+        np_char_table = build_character_lookup_table(char_to_index)
+    # Assign a row to each unique tweet.
+    tweet_to_row = {}
+    first_tweet_rows = [tweet_to_row.setdefault(tweet_pair[0], len(tweet_to_row)) for tweet_pair in data]
+    second_tweet_rows = [tweet_to_row.setdefault(tweet_pair[2], len(tweet_to_row)) for tweet_pair in data]
+    unique_tweets = [None] * len(tweet_to_row)
+    for tweet, row in tweet_to_row.iteritems():
+        unique_tweets[row] = tweet
+    np_tweet_indices = convert_tweets_to_character_indices(unique_tweets, np_char_table, max_tweet_size)
+    # Gather first and second tweet of every pair side by side.
+    np_tweet_pairs = np.concatenate([np_tweet_indices[first_tweet_rows],
+                                     np_tweet_indices[second_tweet_rows]], axis=1)
     if labels_exist:
-        np_tweet_pair_labels = np.zeros(shape=[len(data)], dtype=int)
+        np_tweet_pair_labels = np.array([tweet_pair[4] for tweet_pair in data], dtype=int)
     else:
         np_tweet_pair_labels = None
-    for pair_index in range(len(data)):
-        first_tweet = data[pair_index][0]
-        second_tweet = data[pair_index][2]
-        # Insert label for tweet pair into numpy array.
-        if labels_exist:
-            np_tweet_pair_labels[pair_index] = data[pair_index][4]
-        # Insert first tweet of pair into numpy array.
-        for i in range(len(first_tweet)):
-            if i < max_tweet_size:
-                character = first_tweet[i]
-                if character in char_to_index:
-                    np_tweet_pairs[pair_index][i] = char_to_index[character]
-        # Insert second tweet of pair into numpy array.
-        for i in range(len(second_tweet)):
-            if i < max_tweet_size:
-                character = second_tweet[i]
-                if character in char_to_index:
-                    np_tweet_pairs[pair_index][i + max_tweet_size] = char_to_index[character]
 
     return np_tweet_pairs, np_tweet_pair_labels
 
 
-def convert_tweet_to_embeddings(tweets, word_to_glove, word_to_phonetic, max_number_of_words, glove_size, phonetic_emb_size):
+def build_character_lookup_table(char_to_index):
+    """Convert char_to_index into a numpy array indexed by character code point,
+    so that whole tweets can be converted to indices with one fancy-indexing operation.
+    Characters that do not appear in char_to_index map to index 0."""
+    code_points = [ord(char) for char in char_to_index if len(char) == 1]
+    np_char_table = np.zeros([max(code_points + [255]) + 1], dtype=int)
+    for char, index in char_to_index.iteritems():
+        if len(char) == 1:
+            np_char_table[ord(char)] = index
+    return np_char_table
+
+
+def convert_tweets_to_character_indices(tweets, np_char_table, max_tweet_size=TWEET_SIZE):
+    """Convert a list of tweets into an n x max_tweet_size numpy array of character indices
+    in a single pass. Tweets longer than max_tweet_size are cut off and shorter tweets are
+    padded with zeros.
+
+    tweets - list of tweet strings
+    np_char_table - lookup table from character code point to index (see build_character_lookup_table)
+    max_tweet_size - number of characters kept per tweet"""
+    truncated_tweets = [tweet[:max_tweet_size] for tweet in tweets]
+    np_lengths = np.array([len(tweet) for tweet in truncated_tweets], dtype=int)
+    np_tweet_indices = np.zeros([len(tweets), max_tweet_size], dtype=int)
+    if np.sum(np_lengths) == 0:
+        return np_tweet_indices
+    np_code_points = convert_text_to_code_points(''.join(truncated_tweets))
+    np_code_points[np_code_points >= np_char_table.size] = 0
+    # Row of each character is its tweet, column is its position inside that tweet.
+    np_rows = np.repeat(np.arange(len(tweets)), np_lengths)
+    np_tweet_starts = np.cumsum(np_lengths) - np_lengths
+    np_columns = np.arange(np_code_points.size) - np.repeat(np_tweet_starts, np_lengths)
+    np_tweet_indices[np_rows, np_columns] = np_char_table[np_code_points]
+    return np_tweet_indices
+
+
+def convert_text_to_code_points(text):
+    """Returns a numpy array holding the code point of each character in text."""
+    if isinstance(text, unicode):
+        return np.array([ord(char) for char in text], dtype=int)
+    return np.frombuffer(text, dtype=np.uint8).astype(int)
+
+
+def convert_tweet_to_embeddings(tweets, word_to_glove, word_to_phonetic, max_number_of_words, glove_size, phonetic_emb_size,
+                                word_embeddings=None, ids_only=False):
     """Pack GloVe vectors and phonetic embeddings side by side for each word in each tweet as a numpy array.
+    Tweets are converted to a matrix of word ids once, then all embeddings are looked up with a single
+    gather from a float32 word embedding matrix (see build_word_embedding_matrix).
 
     tweets - list of tweet strings
     word_to_glove - dictionary mapping from words to their glove vectors
     word_to_phonetic - dictionary mapping from words to their phonetic embeddings
     max_number_of_words - leave padding to fit all tweets in same space
     glove_size - size of glove vectors used
+    phonetic_emb_size - size of phonetic embeddings used
+    word_embeddings - optional (word_to_id, np_word_embeddings) from build_word_embedding_matrix(), to reuse
+        one matrix across calls; by default a matrix is built for the words in tweets
+    ids_only - if True, return the int32 [tweets, max_number_of_words] word id matrix and the word embedding
+        matrix instead of the embeddings, so that the lookup can be done elsewhere (i.e. in the model graph)"""
+    if word_embeddings is None:
+        tweet_words = set([word for tweet in tweets for word in tweet.split()[:max_number_of_words]])
+        word_embeddings = build_word_embedding_matrix(sorted(tweet_words), word_to_glove, word_to_phonetic,
+                                                      glove_size, phonetic_emb_size)
+    word_to_id, np_word_embeddings = word_embeddings
+    np_word_ids = convert_tweets_to_word_ids(tweets, word_to_id, max_number_of_words)
+    if ids_only:
+        return np_word_ids, np_word_embeddings
+    np_tweet_embs = np.take(np_word_embeddings, np_word_ids, axis=0)
+    return np.reshape(np_tweet_embs, [len(tweets), max_number_of_words * (glove_size + phonetic_emb_size)])
+
+
+def build_word_embedding_matrix(words, word_to_glove, word_to_phonetic, glove_size, phonetic_emb_size):
+    """Stack the embeddings of words into a float32 matrix with one row per word, GloVe columns
+    followed by phonetic columns. Row 0 is all zeros and stands for padding and for words without
+    embeddings. GloVe columns are left at zero, as in the embeddings the humor models were trained on.
+    Returns a dictionary mapping from words to rows, and the matrix.
+
+    words - words to include, i.e. a model vocabulary or the words of a hashtag
+    word_to_glove - dictionary mapping from words to their glove vectors
+    word_to_phonetic - dictionary mapping from words to their phonetic embeddings
+    glove_size - size of glove vectors used
     phonetic_emb_size - size of phonetic embeddings used"""
-    word_embedding_size = glove_size + phonetic_emb_size
-    np_tweet_embs = np.zeros([len(tweets), max_number_of_words * word_embedding_size])
-    for i in range(len(tweets)):
-        tokens = tweets[i].split()
-        for j in range(len(tokens)):
-            if j < max_number_of_words:
-                # if tokens[j] in word_to_glove:
-                #     np_token_glove = np.array(word_to_glove[tokens[j]])
-                #     np_tweet_embs[i, j*word_embedding_size:j*word_embedding_size+glove_size] = np_token_glove
-                if tokens[j] in word_to_phonetic:
-                    np_token_phonetic = np.array(word_to_phonetic[tokens[j]])
-                    np_tweet_embs[i, j*word_embedding_size + glove_size:
-                                     j*word_embedding_size + glove_size + phonetic_emb_size] = np_token_phonetic
-    return np_tweet_embs
+    vocabulary = Vocabulary([''])
+    vocabulary.add_all([word for word in words if word in word_to_glove or word in word_to_phonetic])
+    np_word_embeddings = np.zeros([len(vocabulary), glove_size + phonetic_emb_size], dtype=np.float32)
+    phonetic_words = [word for word in vocabulary.index_to_token[1:] if word in word_to_phonetic]
+    if len(phonetic_words) > 0:
+        np_rows = np.array([vocabulary.index(word) for word in phonetic_words])
+        np_word_embeddings[np_rows, glove_size:] = np.array([word_to_phonetic[word] for word in phonetic_words],
+                                                            dtype=np.float32)
+    return vocabulary.to_dictionary(), np_word_embeddings
+
+
+def convert_tweets_to_word_ids(tweets, word_to_id, max_number_of_words):
+    """Convert a list of tweets into an int32 n x max_number_of_words numpy array of word ids.
+    Tweets with more words are cut off, and padding and unknown words get id 0.
+
+    tweets - list of tweet strings
+    word_to_id - dictionary mapping from words to ids (see build_word_embedding_matrix)
+    max_number_of_words - number of words kept per tweet"""
+    tweet_tokens = [tweet.split()[:max_number_of_words] for tweet in tweets]
+    np_lengths = np.array([len(tokens) for tokens in tweet_tokens], dtype=int)
+    np_word_ids = np.zeros([len(tweets), max_number_of_words], dtype=np.int32)
+    if np.sum(np_lengths) == 0:
+        return np_word_ids
+    np_ids = np.array([word_to_id.get(token, 0) for tokens in tweet_tokens for token in tokens], dtype=np.int32)
+    # Row of each word is its tweet, column is its position inside that tweet.
+    np_rows = np.repeat(np.arange(len(tweets)), np_lengths)
+    np_tweet_starts = np.cumsum(np_lengths) - np_lengths
+    np_columns = np.arange(np_ids.size) - np.repeat(np_tweet_starts, np_lengths)
+    np_word_ids[np_rows, np_columns] = np_ids
+    return np_word_ids
 
 
 def convert_hashtag_to_embedding_tweet_pairs(tweet_input_dir, hashtag_name, word_to_glove, word_to_phonetic):
@@ -196,30 +781,135 @@ def convert_hashtag_to_embedding_tweet_pairs(tweet_input_dir, hashtag_name, word
     tweet2_id - tweet id of all second tweets in np_tweet2_gloves
     np_label - numpy array of funnier tweet labels; None if hashtag does not contain labels
     np_hashtag_gloves - numpy array of glove/phonetic vectors for hashtag name"""
+    np_tweet_gloves, np_first_index, np_second_index, np_label, tweet_ids, np_hashtag_gloves_col = \
+        convert_hashtag_to_embedding_tweet_store(tweet_input_dir, hashtag_name, word_to_glove, word_to_phonetic)
+    np_tweet1_gloves = gather_tweet_embeddings(np_tweet_gloves, np_first_index)
+    np_tweet2_gloves = gather_tweet_embeddings(np_tweet_gloves, np_second_index)
+    tweet1_id = [tweet_ids[index] for index in np_first_index]
+    tweet2_id = [tweet_ids[index] for index in np_second_index]
+    np_hashtag_gloves = np.repeat(np_hashtag_gloves_col, np_first_index.size, axis=0)
+    return np_tweet1_gloves, np_tweet2_gloves, tweet1_id, tweet2_id, np_label, np_hashtag_gloves
+
+
+def convert_hashtag_to_embedding_tweet_store(tweet_input_dir, hashtag_name, word_to_glove, word_to_phonetic):
+    """Load tweets from a hashtag by its directory and name. Each tweet is converted to glove/phonetic
+    embeddings only once. Tweet pairs are stored as indices into the converted tweets, and can be
+    turned into model input with gather_tweet_embeddings().
+
+    tweet_input_dir - location of tweet .tsv file
+    hashtag_name - name of hashtag file without .tsv extension
+    word_to_glove - dictionary mapping from words to glove vectors
+    word_to_phonetic - dictionary mapping from words to phonetic embeddings
+    Returns:
+    np_tweet_gloves - float32 numpy array of glove/phonetic vectors for each tweet in the hashtag,
+        shaped [tweets, HUMOR_MAX_WORDS_IN_TWEET, GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE]
+    np_first_index - int32 numpy array, index into np_tweet_gloves of the first tweet of each pair
+    np_second_index - int32 numpy array, index into np_tweet_gloves of the second tweet of each pair
+    np_label - int32 numpy array of funnier tweet labels; None if hashtag does not contain labels
+    tweet_ids - tweet id of each tweet in np_tweet_gloves
+    np_hashtag_gloves - float32 numpy array of glove/phonetic vectors for hashtag name (a single row)"""
     formatted_hashtag_name = ' '.join(hashtag_name.split('_')).lower()
     tweets, labels, tweet_ids = load_tweets_from_hashtag(tweet_input_dir + hashtag_name + '.tsv',
-                                                         explicit_hashtag=formatted_hashtag_name)  # formatted_hashtag_name)
+                                                         explicit_hashtag=formatted_hashtag_name)
     random.seed(TWEET_PAIR_LABEL_RANDOM_SEED + hashtag_name)
-    if len(labels) > 0:
-        tweet_pairs = extract_tweet_pairs_by_rank(tweets, labels, tweet_ids)
-    else:
-        tweet_pairs = extract_tweet_pairs_by_combination(tweets, tweet_ids)
-    tweet1 = [tweet_pair[0] for tweet_pair in tweet_pairs]
-    tweet1_id = [tweet_pair[1] for tweet_pair in tweet_pairs]
-    tweet2 = [tweet_pair[2] for tweet_pair in tweet_pairs]
-    tweet2_id = [tweet_pair[3] for tweet_pair in tweet_pairs]
-    np_label = None
-    if len(labels) > 0:
-        labels = [tweet_pair[4] for tweet_pair in tweet_pairs]
-        np_label = np.array(labels)
-    np_hashtag_gloves_col = convert_tweet_to_embeddings([formatted_hashtag_name], word_to_glove, word_to_phonetic,
-                                                        HUMOR_MAX_WORDS_IN_HASHTAG, GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
-    np_hashtag_gloves = np.repeat(np_hashtag_gloves_col, len(tweet1), axis=0)
-    np_tweet1_gloves = convert_tweet_to_embeddings(tweet1, word_to_glove, word_to_phonetic, HUMOR_MAX_WORDS_IN_TWEET,
-                                                   GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
-    np_tweet2_gloves = convert_tweet_to_embeddings(tweet2, word_to_glove, word_to_phonetic, HUMOR_MAX_WORDS_IN_TWEET,
-                                                   GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
-    return np_tweet1_gloves, np_tweet2_gloves, tweet1_id, tweet2_id, np_label, np_hashtag_gloves
+    np_first_index, np_second_index, np_label = extract_tweet_pair_indices(tweet_ids, labels)
+    hashtag_words = set(formatted_hashtag_name.split())
+    for tweet in tweets:
+        hashtag_words.update(tweet.split())
+    word_embeddings = build_word_embedding_matrix(sorted(hashtag_words), word_to_glove, word_to_phonetic,
+                                                  GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
+    np_hashtag_gloves = convert_tweet_to_embeddings([formatted_hashtag_name], word_to_glove, word_to_phonetic,
+                                                    HUMOR_MAX_WORDS_IN_HASHTAG, GLOVE_EMB_SIZE,
+                                                    PHONETIC_EMB_SIZE, word_embeddings=word_embeddings)
+    np_tweet_gloves = convert_tweet_to_embeddings(tweets, word_to_glove, word_to_phonetic, HUMOR_MAX_WORDS_IN_TWEET,
+                                                  GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE, word_embeddings=word_embeddings)
+    np_tweet_gloves = np.reshape(np_tweet_gloves, [len(tweets), HUMOR_MAX_WORDS_IN_TWEET,
+                                                   GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE])
+    return np_tweet_gloves, np_first_index, np_second_index, np_label, tweet_ids, np_hashtag_gloves
+
+
+def gather_tweet_embeddings(np_tweet_gloves, np_index):
+    """Look up the tweets at np_index in np_tweet_gloves and flatten each one into a
+    single row, the input format expected by the embedding humor model.
+
+    np_tweet_gloves - numpy array of tweet embeddings, shaped [tweets, words, word embedding size]
+    np_index - indices of tweets to gather, i.e. a batch of first or second tweets"""
+    np_gathered_tweets = np.take(np_tweet_gloves, np_index, axis=0)
+    return np.reshape(np_gathered_tweets, [len(np_index), -1]).astype(np.float32, copy=False)
+
+
+def segment_reduce(np_values, segment_lengths):
+    """Reduce consecutive segments of rows, e.g. the token rows of each tweet stacked into one array.
+    Returns max, min and mean arrays shaped [segments] + np_values.shape[1:]. Empty segments reduce to nan.
+
+    np_values - numpy array whose rows are grouped into consecutive segments
+    segment_lengths - number of rows in each segment, summing to the number of rows of np_values"""
+    np_lengths = np.asarray(segment_lengths, dtype=np.int64)
+    assert np.sum(np_lengths) == np_values.shape[0]
+    output_shape = (len(np_lengths),) + np_values.shape[1:]
+    np_max = np.full(output_shape, np.nan)
+    np_min = np.full(output_shape, np.nan)
+    np_mean = np.full(output_shape, np.nan)
+    np_non_empty = np_lengths > 0
+    if np.any(np_non_empty):
+        # reduceat reduces from each start to the next one, so skipping empty segments leaves the others intact.
+        np_starts = (np.cumsum(np_lengths) - np_lengths)[np_non_empty]
+        np_max[np_non_empty] = np.maximum.reduceat(np_values, np_starts, axis=0)
+        np_min[np_non_empty] = np.minimum.reduceat(np_values, np_starts, axis=0)
+        np_counts = np.reshape(np_lengths[np_non_empty], (-1,) + (1,) * (np_values.ndim - 1))
+        np_mean[np_non_empty] = np.add.reduceat(np_values, np_starts, axis=0) / np_counts.astype(np.float64)
+    return np_max, np_min, np_mean
+
+
+def convert_hashtag_to_word_ids(tweet_input_dir, hashtag_name, word_to_id):
+    """Convert each tweet of a hashtag into word ids, for models that look up word embeddings
+    inside the graph (see build_humor_model). Tweets are in the same order as the rows of the
+    hashtag's tweet store, so tweet pair indices from the store can be used on the result.
+
+    tweet_input_dir - location of tweet .tsv file
+    hashtag_name - name of hashtag file without .tsv extension
+    word_to_id - dictionary mapping from words to rows of the model's word embedding matrix
+    Returns:
+    np_tweet_word_ids - int32 numpy array of word ids, shaped [tweets, HUMOR_MAX_WORDS_IN_TWEET]
+    np_hashtag_word_ids - int32 numpy array of word ids of the hashtag name, shaped [1, HUMOR_MAX_WORDS_IN_HASHTAG]
+    tweet_ids - tweet id of each row of np_tweet_word_ids"""
+    formatted_hashtag_name = ' '.join(hashtag_name.split('_')).lower()
+    tweets, labels, tweet_ids = load_tweets_from_hashtag(tweet_input_dir + hashtag_name + '.tsv',
+                                                         explicit_hashtag=formatted_hashtag_name)
+    np_tweet_word_ids = convert_tweets_to_word_ids(tweets, word_to_id, HUMOR_MAX_WORDS_IN_TWEET)
+    np_hashtag_word_ids = convert_tweets_to_word_ids([formatted_hashtag_name], word_to_id, HUMOR_MAX_WORDS_IN_HASHTAG)
+    return np_tweet_word_ids, np_hashtag_word_ids, tweet_ids
+
+
+def load_word_embedding_matrix(word_to_glove_path=HUMOR_WORD_TO_GLOVE_FILE_PATH,
+                               word_to_phonetic_path=HUMOR_WORD_TO_PHONETIC_FILE_PATH):
+    """Build the word embedding matrix for all words with a GloVe or phonetic embedding, as saved
+    by the humor_processing vocabulary step. Words are sorted, so the same mappings always give the
+    same word ids. Returns word_to_id and the matrix (see build_word_embedding_matrix)."""
+    word_to_glove = pickle.load(open(word_to_glove_path, 'rb'))
+    word_to_phonetic = pickle.load(open(word_to_phonetic_path, 'rb'))
+    words = sorted(set(word_to_glove) | set(word_to_phonetic))
+    return build_word_embedding_matrix(words, word_to_glove, word_to_phonetic, GLOVE_EMB_SIZE, PHONETIC_EMB_SIZE)
+
+
+def extract_tweet_pair_indices(tweet_ids, labels, random_generator=random):
+    """Creates the same tweet pairs as extract_tweet_pairs_by_rank (labels available)
+    or extract_tweet_pairs_by_combination (no labels), but refers to each tweet by its
+    position in the hashtag file instead of its text. Seed the random module first (or pass
+    a seeded random.Random as random_generator, i.e. from several threads) to reproduce the
+    pair ordering of other models. Returns int32 numpy arrays np_first_index, np_second_index
+    and np_label (None if there are no labels)."""
+    if len(labels) == 0:
+        index_chunks = list(generate_tweet_pair_index_chunks(len(tweet_ids)))
+        np_first_index = np.concatenate([np.zeros([0], dtype=np.int32)] + [chunk[0] for chunk in index_chunks])
+        np_second_index = np.concatenate([np.zeros([0], dtype=np.int32)] + [chunk[1] for chunk in index_chunks])
+        return np_first_index, np_second_index, None
+    tweet_indices = range(len(tweet_ids))
+    tweet_pairs = extract_tweet_pairs_by_rank(tweet_indices, labels, tweet_ids, random_generator=random_generator)
+    np_first_index = np.array([tweet_pair[0] for tweet_pair in tweet_pairs], dtype=np.int32)
+    np_second_index = np.array([tweet_pair[2] for tweet_pair in tweet_pairs], dtype=np.int32)
+    np_label = np.array([tweet_pair[4] for tweet_pair in tweet_pairs], dtype=np.int32)
+    return np_first_index, np_second_index, np_label
 
 
 def extract_tweet_pair_from_hashtag_datas(hashtag_datas, hashtag_name, tweet_size=TWEET_SIZE):
@@ -262,25 +952,14 @@ def extract_tweet_pairs_from_file(hashtag_file):
 
 def remove_hashtag_from_tweets(tweets):
     """Takes a list of tweets. For each tweet, if it contains
-    a hashtag, that hashtag is removed. Returns the tweets
-    without hashtags. Copies input tweets."""
-    tweets_without_hashtags = []
-    for tweet in tweets:
-        tweet_without_hashtags = ''
-        outside_hashtag = True
-        for char in tweet:
-            if char == '#':
-                outside_hashtag = False
-            if outside_hashtag:
-                tweet_without_hashtags += char
-            if not outside_hashtag and char == ' ':
-                outside_hashtag = True
-        tweets_without_hashtags.append(tweet_without_hashtags)
-    return tweets_without_hashtags
-
-
-def extract_tweet_pairs_by_rank(tweets, tweet_ranks, tweet_ids):
-    """Creates pairs of the form [first_tweet, first_tweet_id, second_tweet, second_tweet_id, first_tweet_is_funnier]"""
+    a hashtag, that hashtag is removed along with the space
+    that ends it. Returns the tweets without hashtags. Copies input tweets."""
+    return [HASHTAG_PATTERN.sub('', tweet) for tweet in tweets]
+
+
+def extract_tweet_pairs_by_rank(tweets, tweet_ranks, tweet_ids, random_generator=random):
+    """Creates pairs of the form [first_tweet, first_tweet_id, second_tweet, second_tweet_id, first_tweet_is_funnier].
+    Which tweet comes first is drawn from random_generator (the random module by default)."""
     winner, winner_ids, top_ten, top_ten_ids, non_winners, non_winner_ids = \
         divide_tweets_by_rank(tweets, tweet_ids, tweet_ranks)
 
@@ -290,7 +969,7 @@ def extract_tweet_pairs_by_rank(tweets, tweet_ranks, tweet_ids):
     for non_winning_tweet, non_winning_id in zip(non_winners, non_winner_ids):
         for top_ten_tweet, top_ten_id in zip(winner + top_ten, winner_ids + top_ten_ids):
             # Create pair
-            funnier_tweet_first = bool(random.getrandbits(1))
+            funnier_tweet_first = bool(random_generator.getrandbits(1))
             if funnier_tweet_first:
                 pairs.append([top_ten_tweet, top_ten_id, non_winning_tweet, non_winning_id, 1])
             else:
@@ -299,7 +978,7 @@ def extract_tweet_pairs_by_rank(tweets, tweet_ranks, tweet_ids):
     for top_ten_tweet, top_ten_id in zip(top_ten, top_ten_ids):
         for winning_tweet, winning_id in zip(winner, winner_ids):
             # Create pair
-            funnier_tweet_first = bool(random.getrandbits(1))
+            funnier_tweet_first = bool(random_generator.getrandbits(1))
             if funnier_tweet_first:
                 pairs.append([winning_tweet, winning_id, top_ten_tweet, top_ten_id, 1])
             else:
@@ -321,6 +1000,22 @@ def extract_tweet_pairs_by_combination(tweets, tweet_ids):
     return pairs
 
 
+def generate_tweet_pair_index_chunks(number_of_tweets, chunk_size=TWEET_PAIR_CHUNK_SIZE):
+    """Generates every combination of tweets as pairs of tweet positions, in the order of
+    extract_tweet_pairs_by_combination (as numpy.triu_indices with k=1). Yields int32 numpy
+    arrays np_first_index and np_second_index of at most chunk_size pairs, so that the pairs
+    of large hashtags are never all held in memory."""
+    # Pairs with first tweet i start at position i * (n - 1) - i * (i - 1) / 2.
+    np_tweets = np.arange(number_of_tweets, dtype=np.int64)
+    np_row_starts = np_tweets * (number_of_tweets - 1) - np_tweets * (np_tweets - 1) // 2
+    number_of_pairs = number_of_tweets * (number_of_tweets - 1) // 2
+    for chunk_start in range(0, number_of_pairs, chunk_size):
+        np_pairs = np.arange(chunk_start, min(chunk_start + chunk_size, number_of_pairs), dtype=np.int64)
+        np_first_index = np.searchsorted(np_row_starts, np_pairs, side='right') - 1
+        np_second_index = np_first_index + 1 + np_pairs - np_row_starts[np_first_index]
+        yield np_first_index.astype(np.int32), np_second_index.astype(np.int32)
+
+
 def divide_tweets_by_rank(tweets, tweet_ids, tweet_ranks):
     """Tweets are labelled as 'winner', 'top-ten' or 'non-winner'.
     Divide tweets by their rank and return lists of tweets from
@@ -358,60 +1053,125 @@ def format_text_for_embedding_model(text, hashtag_replace=None):
     hashtag_replace='', no hashtag will be added to the beginning. If
     hashtag_replace is a series of words, they will be placed at the beginning
     of the tweet. A # token will be placed after hashtags placed at the beginning
-    of the tweet."""
-    # If you hit a hashtag symbol, you are inside a hashtag.
-    # While inside hashtag, don't add characters to output.
-    # You are no longer inside a hashtag if you encounter a space (don't add space to output).
-    formatted_text = ''
-    formatted_hashtag = ''
-    inside_hashtag = False
-    for i in range(len(text)):
-        if text[i] == '#':
-            inside_hashtag = True
-            continue
-        if inside_hashtag:
-            if hashtag_replace is None:
-                if text[i].isupper():
-                    formatted_hashtag += ' '
-                if not text[i].isalpha() and text[i-1].isalpha():
-                    formatted_hashtag += ' '
-                formatted_hashtag += text[i]
-        else:
-            if text[i].isalpha() or text[i] == ' ' or text[i] == '@':
-                formatted_text += text[i]
-            # if text[i] == '_' or text[i] == '-':
-            #     formatted_text += ' '
-        if text[i] == ' ':
-            inside_hashtag = False
-    if hashtag_replace is not None:
-        formatted_hashtag += hashtag_replace
+    of the tweet. Unicode text is encoded as UTF-8 first, so it is formatted like the same
+    tweet read from a hashtag file, which holds byte strings."""
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    if isinstance(hashtag_replace, unicode):
+        hashtag_replace = hashtag_replace.encode('utf-8')
+    # A hashtag starts at a hashtag symbol and ends after the next space.
+    # Outside of hashtags, only letters, spaces and @ are kept.
+    formatted_text = HASHTAG_PATTERN.sub('', text).translate(None, NON_TWEET_TEXT_CHARACTERS)
+    if hashtag_replace is None:
+        # Break hashtags into words before capitals and between letters and other characters.
+        hashtags = ''.join(HASHTAG_PATTERN.findall(text))
+        formatted_hashtag = HASHTAG_WORD_START_PATTERN.sub(lambda match: ' ' + match.group(), hashtags).replace('#', '')
+    else:
+        formatted_hashtag = hashtag_replace
     if hashtag_replace != '':
         formatted_hashtag += ' # '
     raw_output = (formatted_hashtag + formatted_text).lower()
     return ' '.join(raw_output.split())
 
 
-def load_tweets_from_hashtag(filename, explicit_hashtag=None):
+def format_texts_for_embedding_model(texts, hashtag_replace=None):
+    """Format a list of tweets (see format_text_for_embedding_model)."""
+    return [format_text_for_embedding_model(text, hashtag_replace=hashtag_replace) for text in texts]
+
+
+def tokenize_tweet_for_embedding_model(tweet, explicit_hashtag=None):
+    """Format a raw tweet (see format_text_for_embedding_model) and split it into space-separated,
+    lowercase word tokens, the form in which tweets are converted to word embeddings."""
+    formatted_tweet = format_text_for_embedding_model(tweet, hashtag_replace=explicit_hashtag)
+    tweet_tokens = nltk.word_tokenize(formatted_tweet)
+    return ' '.join(tweet_tokens).lower()
+
+
+def load_tweets_from_hashtag(filename, explicit_hashtag=None, cache_dir=TOKENIZED_TWEET_CACHE_DIR):
     """Open hashtag file, and read each line. For each line,
     read a tweet, its corresponding tweet id, and a label that indicates
     if the tweet was a winner (2), top-ten (1) or non-winner (0) tweet.
-    Format the tweet and return [tweets, labels, tweet_ids]."""
+    Format the tweet and return [tweets, labels, tweet_ids]. Results are cached
+    in cache_dir by file contents and explicit_hashtag, so each file is only tokenized
+    once per explicit_hashtag. Set cache_dir=None to disable the cache."""
+    if cache_dir is not None:
+        cache_path = get_tokenized_tweet_cache_path(filename, explicit_hashtag, cache_dir)
+        if os.path.exists(cache_path):
+            cached_tweets = load_tokenized_tweets(cache_path)
+            if cached_tweets is not None:
+                return cached_tweets
+    raw_tweets, labels, tweet_ids = read_hashtag_file(filename)
+    tweets = [tokenize_tweet_for_embedding_model(tweet, explicit_hashtag=explicit_hashtag) for tweet in raw_tweets]
+    if cache_dir is not None:
+        save_tokenized_tweets(cache_path, tweets, labels, tweet_ids)
+    return tweets, labels, tweet_ids
+
+
+def get_tokenized_tweet_cache_path(filename, explicit_hashtag, cache_dir=TOKENIZED_TWEET_CACHE_DIR):
+    """Returns the cache file for the tokenized tweets of hashtag file filename. It changes when the contents
+    of the file, explicit_hashtag, TWEET_TOKENIZER_VERSION or the NLTK version change."""
+    digest = hashlib.sha1()
+    digest.update(hash_build_inputs([filename]))
+    digest.update(repr(explicit_hashtag))
+    digest.update(str(TWEET_TOKENIZER_VERSION))
+    digest.update(nltk.__version__)
+    return os.path.join(cache_dir, digest.hexdigest() + '.npz')
+
+
+def save_tokenized_tweets(cache_path, tweets, labels, tweet_ids):
+    """Save tokenized tweets as a token vocabulary, the token ids of all tweets one after another, and the
+    offset of each tweet in the token ids. The file is replaced in one step through a temporary file of its
+    own, as in dump_pickle_atomically."""
+    token_to_id = {}
+    token_ids = [token_to_id.setdefault(token, len(token_to_id)) for tweet in tweets for token in tweet.split(' ')]
+    vocabulary = [None] * len(token_to_id)
+    for token, token_id in token_to_id.iteritems():
+        vocabulary[token_id] = token
+    np_offsets = np.cumsum([0] + [len(tweet.split(' ')) for tweet in tweets])
+    temp_fd, temp_path = create_temporary_file(cache_path)
+    try:
+        with os.fdopen(temp_fd, 'wb') as f:
+            np.savez(f, vocabulary=np.array(vocabulary, dtype=np.string_),
+                     token_ids=np.array(token_ids, dtype=np.int32), offsets=np_offsets.astype(np.int64),
+                     labels=np.array(labels, dtype=np.int64), tweet_ids=np.array(tweet_ids, dtype=np.int64))
+        os.rename(temp_path, cache_path)
+    except:
+        os.remove(temp_path)
+        raise
+
+
+def load_tokenized_tweets(cache_path):
+    """Load tokenized tweets saved by save_tokenized_tweets. Returns [tweets, labels, tweet_ids], or None
+    if the file cannot be read, in which case it is removed so that the tweets are tokenized and saved again."""
+    try:
+        cache = np.load(cache_path)
+        np_tokens = cache['vocabulary'][cache['token_ids']]
+        np_offsets = cache['offsets']
+        labels = cache['labels'].tolist()
+        tweet_ids = cache['tweet_ids'].tolist()
+    except (IOError, ValueError, KeyError, EOFError, zipfile.BadZipfile) as error:
+        print 'Discarding unreadable tokenized tweet cache %s: %s' % (cache_path, error)
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        return None
+    tweets = [' '.join(np_tokens[np_offsets[i]:np_offsets[i + 1]]) for i in range(len(np_offsets) - 1)]
+    return tweets, labels, tweet_ids
+
+
+def read_hashtag_file(filename):
+    """Read the tweets of a hashtag file as they appear in the file, without formatting.
+    Returns [tweets, labels, tweet_ids]; labels is empty if the file has no labels."""
     tweet_ids = []
     tweets = []
     labels = []
     # Open hashtag file line for line. File is tsv.
     # Tweet is second variable, tweet win/top10/lose status is third variable
-    # Replace any Twitter hashtag with a '$'
     line_does_not_contain_label = False
     with open(filename, 'rb') as f:
         tsvread = csv.reader(f, delimiter='\t')
         for line in tsvread:
-            tweet_id = line[0]
-            tweet = line[1]
-            formatted_tweet = format_text_for_embedding_model(tweet, hashtag_replace=explicit_hashtag)
-            tweet_tokens = nltk.word_tokenize(formatted_tweet)
-            tweet_ids.append(int(tweet_id))
-            tweets.append(' '.join(tweet_tokens).lower())
+            tweet_ids.append(int(line[0]))
+            tweets.append(line[1])
             if len(line) > 2:
                 if line_does_not_contain_label:
                     print 'Warning: Hashtag labels not formatted correctly.'
@@ -472,11 +1232,139 @@ def get_hashtag_file_names(tweet_pairs_dir):
     return g
 
 
+def save_tweet_store(directory, hashtag_stores, dtype=np.float32):
+    """Save the tweet stores of all hashtags in a dataset split into one consolidated store, so
+    that training can memory-map a single file instead of reading several files per hashtag.
+    Tweet embeddings of all hashtags are written back to back into one raw array file, tweet pairs
+    into one int32 [pairs, 3] array of (first tweet index, second tweet index, label), and tweet
+    ids and hashtag embeddings into one array each. An index file maps each hashtag name to its
+    offsets in these arrays. All files are written under temporary names and renamed into place
+    once complete, index last, so hashtag_stores may read from the store being replaced.
+
+    directory - output directory for the split, i.e. HUMOR_TRAIN_TWEET_PAIR_EMBEDDING_DIR
+    hashtag_stores - iterable of (hashtag_name, output of convert_hashtag_to_embedding_tweet_store())
+    dtype - numpy dtype to store tweet embeddings as (float32 or float16)"""
+    tweet_store_index = {'dtype': np.dtype(dtype).str,
+                         'tweet_shape': [HUMOR_MAX_WORDS_IN_TWEET, GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE],
+                         'hashtags': {}}
+    pair_arrays = []
+    tweet_ids_arrays = []
+    hashtag_glove_rows = []
+    num_tweets = 0
+    num_pairs = 0
+    with open(directory + TWEET_STORE_GLOVE_FILE + '.tmp', 'wb') as f:
+        for hashtag_name, hashtag_store in hashtag_stores:
+            np_tweet_gloves, np_first_index, np_second_index, np_label, tweet_ids, np_hashtag_gloves = hashtag_store
+            f.write(np.ascontiguousarray(np_tweet_gloves, dtype=dtype).tobytes())
+            np_pairs = np.zeros([np_first_index.size, 3], dtype=np.int32)
+            np_pairs[:, 0] = np_first_index
+            np_pairs[:, 1] = np_second_index
+            np_pairs[:, 2] = np_label if np_label is not None else -1
+            pair_arrays.append(np_pairs)
+            tweet_ids_arrays.append(np.array(tweet_ids, dtype=np.int64))
+            tweet_store_index['hashtags'][hashtag_name] = {'tweet_offset': num_tweets,
+                                                           'num_tweets': len(tweet_ids),
+                                                           'pair_offset': num_pairs,
+                                                           'num_pairs': np_pairs.shape[0],
+                                                           'hashtag_row': len(hashtag_glove_rows),
+                                                           'labels_exist': np_label is not None}
+            hashtag_glove_rows.append(np_hashtag_gloves)
+            num_tweets += len(tweet_ids)
+            num_pairs += np_pairs.shape[0]
+    tweet_store_index['num_tweets'] = num_tweets
+    # Empty arrays start each list, so a split without hashtags saves an empty store.
+    pair_arrays.insert(0, np.zeros([0, 3], dtype=np.int32))
+    tweet_ids_arrays.insert(0, np.zeros([0], dtype=np.int64))
+    hashtag_glove_rows.insert(0, np.zeros([0, HUMOR_MAX_WORDS_IN_HASHTAG * (GLOVE_EMB_SIZE + PHONETIC_EMB_SIZE)],
+                                          dtype=np.float32))
+    store_arrays = [(TWEET_STORE_PAIRS_FILE, np.concatenate(pair_arrays, axis=0)),
+                    (TWEET_STORE_TWEET_IDS_FILE, np.concatenate(tweet_ids_arrays, axis=0)),
+                    (TWEET_STORE_HASHTAG_GLOVE_FILE, np.concatenate(hashtag_glove_rows, axis=0).astype(np.float32))]
+    for file_name, np_array in store_arrays:
+        with open(directory + file_name + '.tmp', 'wb') as f:
+            np.save(f, np_array)
+    with open(directory + TWEET_STORE_INDEX_FILE + '.tmp', 'wb') as f:
+        pickle.dump(tweet_store_index, f)
+    # Remove the old index first, so an interrupted rename never pairs it with new arrays.
+    if os.path.exists(directory + TWEET_STORE_INDEX_FILE):
+        os.remove(directory + TWEET_STORE_INDEX_FILE)
+    for file_name in [TWEET_STORE_GLOVE_FILE, TWEET_STORE_PAIRS_FILE, TWEET_STORE_TWEET_IDS_FILE,
+                      TWEET_STORE_HASHTAG_GLOVE_FILE, TWEET_STORE_INDEX_FILE]:
+        os.rename(directory + file_name + '.tmp', directory + file_name)
+
+
+def load_tweet_store(directory):
+    """Memory-map the consolidated tweet store saved by save_tweet_store() in directory. Nothing
+    is read from disk until it is sliced. Stores are opened once per process and reused.
+    Returns a dictionary with entries 'index', 'tweet_gloves', 'pairs', 'tweet_ids' and 'hashtag_gloves'."""
+    index_path = directory + TWEET_STORE_INDEX_FILE
+    index_modified_time = os.path.getmtime(index_path)
+    if directory in _opened_tweet_stores and _opened_tweet_stores[directory][0] == index_modified_time:
+        return _opened_tweet_stores[directory][1]
+    tweet_store_index = pickle.load(open(index_path, 'rb'))
+    tweet_gloves_shape = tuple([tweet_store_index['num_tweets']] + tweet_store_index['tweet_shape'])
+    if tweet_store_index['num_tweets'] > 0:
+        np_tweet_gloves = np.memmap(directory + TWEET_STORE_GLOVE_FILE, mode='r',
+                                    dtype=np.dtype(tweet_store_index['dtype']), shape=tweet_gloves_shape)
+    else:
+        # An empty file cannot be memory-mapped.
+        np_tweet_gloves = np.zeros(tweet_gloves_shape, dtype=np.dtype(tweet_store_index['dtype']))
+    tweet_store = {'index': tweet_store_index,
+                   'tweet_gloves': np_tweet_gloves,
+                   'pairs': np.load(directory + TWEET_STORE_PAIRS_FILE, mmap_mode='r'),
+                   'tweet_ids': np.load(directory + TWEET_STORE_TWEET_IDS_FILE, mmap_mode='r'),
+                   'hashtag_gloves': np.load(directory + TWEET_STORE_HASHTAG_GLOVE_FILE, mmap_mode='r')}
+    _opened_tweet_stores[directory] = (index_modified_time, tweet_store)
+    return tweet_store
+
+
+def load_hashtag_tweet_store(directory, hashtag_name):
+    """Load tweet embeddings, tweet pair indices, labels, tweet ids and hashtag
+    embedding for the hashtag from the consolidated store in directory. The tweet embeddings
+    are a slice of the memory-mapped store, so only tweets that are gathered are read from disk.
+    Data saved in the older one-row-per-pair format is loaded with each pair row acting as its
+    own tweet. Returns np_tweet_gloves, np_first_index, np_second_index, np_labels (None if the
+    hashtag has no labels), tweet_ids and np_hashtag (a single row)."""
+    if not os.path.exists(directory + TWEET_STORE_INDEX_FILE):
+        np_first_tweets, np_second_tweets, np_labels, first_tweet_ids, second_tweet_ids, np_hashtag = \
+            load_hashtag_data(directory, hashtag_name)
+        num_pairs = np_first_tweets.shape[0]
+        np_tweet_gloves = np.reshape(np.concatenate([np_first_tweets, np_second_tweets], axis=0),
+                                     [num_pairs * 2, HUMOR_MAX_WORDS_IN_TWEET, -1])
+        np_first_index = np.arange(num_pairs, dtype=np.int32)
+        np_second_index = np.arange(num_pairs, num_pairs * 2, dtype=np.int32)
+        return np_tweet_gloves, np_first_index, np_second_index, np_labels, \
+            first_tweet_ids + second_tweet_ids, np_hashtag[:1]
+    tweet_store = load_tweet_store(directory)
+    hashtag_entry = tweet_store['index']['hashtags'][hashtag_name]
+    tweet_offset = hashtag_entry['tweet_offset']
+    pair_offset = hashtag_entry['pair_offset']
+    hashtag_row = hashtag_entry['hashtag_row']
+    np_tweet_gloves = tweet_store['tweet_gloves'][tweet_offset:tweet_offset + hashtag_entry['num_tweets']]
+    np_pairs = np.array(tweet_store['pairs'][pair_offset:pair_offset + hashtag_entry['num_pairs']])
+    np_labels = None
+    if hashtag_entry['labels_exist']:
+        np_labels = np_pairs[:, 2]
+    tweet_ids = tweet_store['tweet_ids'][tweet_offset:tweet_offset + hashtag_entry['num_tweets']].tolist()
+    np_hashtag = np.array(tweet_store['hashtag_gloves'][hashtag_row:hashtag_row + 1])
+    return np_tweet_gloves, np_pairs[:, 0], np_pairs[:, 1], np_labels, tweet_ids, np_hashtag
+
+
 def load_hashtag_data(directory, hashtag_name):
     """Load first tweet, second tweet, and
     tweet pair winner label for the hashtag file.
     Example hashtag: America_In_4_Words"""
     #print 'Loading hashtag data for %s' % hashtag_name
+    if os.path.exists(directory + TWEET_STORE_INDEX_FILE):
+        # Expand tweet store into one row per tweet pair.
+        np_tweet_gloves, np_first_index, np_second_index, np_labels, tweet_ids, np_hashtag = \
+            load_hashtag_tweet_store(directory, hashtag_name)
+        np_first_tweets = gather_tweet_embeddings(np_tweet_gloves, np_first_index)
+        np_second_tweets = gather_tweet_embeddings(np_tweet_gloves, np_second_index)
+        first_tweet_ids = [tweet_ids[index] for index in np_first_index]
+        second_tweet_ids = [tweet_ids[index] for index in np_second_index]
+        np_hashtag = np.repeat(np_hashtag, np_first_index.size, axis=0)
+        return np_first_tweets, np_second_tweets, np_labels, first_tweet_ids, second_tweet_ids, np_hashtag
     np_first_tweets = np.load(open(directory + hashtag_name + '_first_tweet_glove.npy', 'rb'))
     first_tweet_ids = pickle.load(open(directory + hashtag_name + '_first_tweet_ids.cpkl', 'rb'))
     np_second_tweets = np.load(open(directory + hashtag_name + '_second_tweet_glove.npy', 'rb'))
@@ -486,6 +1374,57 @@ def load_hashtag_data(directory, hashtag_name):
     return np_first_tweets, np_second_tweets, np_labels, first_tweet_ids, second_tweet_ids, np_hashtag
 
 
+def convert_glove_text_to_binary(glove_file_path=WORD_VECTORS_FILE_PATH,
+                                 matrix_file_path=WORD_VECTORS_MATRIX_FILE_PATH,
+                                 index_file_path=WORD_VECTORS_INDEX_FILE_PATH):
+    """One-time conversion of the GloVe text file into a raw float32 matrix with one row per word,
+    and a pickled index mapping each (lowercased) word to its row. The text file is read line by line.
+    Lines whose vector size differs from the first line are skipped. If a word appears more than once
+    after lowercasing, the last occurrence is used."""
+    print 'Converting %s to binary GloVe cache' % glove_file_path
+    word_to_row = {}
+    glove_size = None
+    num_rows = 0
+    num_skipped_lines = 0
+    with open(glove_file_path, 'rb') as f, open(matrix_file_path, 'wb') as matrix_file:
+        for line in f:
+            line_tokens = line.split()
+            if glove_size is None:
+                glove_size = len(line_tokens) - 1
+            if len(line_tokens) < 2 or len(line_tokens) - 1 != glove_size:
+                num_skipped_lines += 1
+                continue
+            matrix_file.write(np.array(line_tokens[1:], dtype=np.float32).tobytes())
+            word_to_row[line_tokens[0].lower()] = num_rows
+            num_rows += 1
+    print 'Number of GloVe vectors: %s (skipped %s lines)' % (num_rows, num_skipped_lines)
+    pickle.dump({'word_to_row': word_to_row, 'shape': [num_rows, glove_size]},
+                open(index_file_path, 'wb'), pickle.HIGHEST_PROTOCOL)
+
+
+def load_glove_binary(matrix_file_path=WORD_VECTORS_MATRIX_FILE_PATH, index_file_path=WORD_VECTORS_INDEX_FILE_PATH):
+    """Load the word to row index and memory-map the GloVe matrix saved by convert_glove_text_to_binary().
+    The cache is opened once per process and reused. Returns word_to_row and np_glove_matrix."""
+    if matrix_file_path not in _opened_glove_binaries:
+        glove_index = pickle.load(open(index_file_path, 'rb'))
+        np_glove_matrix = np.memmap(matrix_file_path, mode='r', dtype=np.float32, shape=tuple(glove_index['shape']))
+        _opened_glove_binaries[matrix_file_path] = (glove_index['word_to_row'], np_glove_matrix)
+    return _opened_glove_binaries[matrix_file_path]
+
+
+def look_up_glove_matrix(words, matrix_file_path=WORD_VECTORS_MATRIX_FILE_PATH,
+                         index_file_path=WORD_VECTORS_INDEX_FILE_PATH):
+    """Look up a GloVe vector for each word in words using the binary GloVe cache.
+    Returns a float32 numpy array with one row per word (zeros for words without a GloVe
+    vector) and a boolean numpy array marking the words that have one."""
+    word_to_row, np_glove_matrix = load_glove_binary(matrix_file_path, index_file_path)
+    np_rows = np.array([word_to_row.get(word, -1) for word in words], dtype=np.int64)
+    np_found = np_rows >= 0
+    np_words_glove = np.zeros([len(words), np_glove_matrix.shape[1]], dtype=np.float32)
+    np_words_glove[np_found] = np_glove_matrix[np_rows[np_found]]
+    return np_words_glove, np_found
+
+
 def expected_value(np_prob):
     weighted_sum = 0.0
     for i in range(np_prob.size):
@@ -1,9 +1,15 @@
 """David Donahue 2016. Script to test tools.py and tf_tools.py functionality."""
+import cPickle as pickle
 import tools
 from tools import expected_value
 from tools import find_indices_larger_than_threshold
 from tools import format_text_for_embedding_model
 import numpy as np
+import os
+import random
+import shutil
+import tempfile
+import threading
 
 
 def main():
@@ -11,6 +17,21 @@ def main():
     test_expected_value()
     test_find_indices_of_largest_n_values()
     test_format_text_with_hashtag()
+    test_format_tweet_pairs()
+    test_extract_tweet_pair_indices()
+    test_save_and_load_tweet_store()
+    test_glove_binary_lookup()
+    test_vocabulary()
+    test_map_hashtags()
+    test_build_manifest()
+    test_convert_tweets_to_word_ids()
+    test_prefetch_batches()
+    test_sample_pair_batches()
+    test_micro_batcher()
+    test_segment_reduce()
+    test_tokenized_tweet_cache()
+    test_format_texts_for_embedding_model()
+    test_generate_tweet_pair_index_chunks()
 
 
 def test_convert_tweet_to_embeddings():
@@ -54,7 +75,8 @@ def test_convert_tweet_to_embeddings():
                 word_index * (glove_size + phone_size) + glove_size], np.zeros(glove_size))
             if word in word_to_phonetic:
                 assert np.array_equal(np_embeddings[tweet_index, word_index * (glove_size+phone_size) + glove_size:
-                       word_index * (glove_size+phone_size) + glove_size + phone_size], np.array(word_to_phonetic[word]))
+                       word_index * (glove_size+phone_size) + glove_size + phone_size],
+                                      np.array(word_to_phonetic[word], dtype=np.float32))
             else:
                 assert np.array_equal(np_embeddings[tweet_index, word_index * (glove_size + phone_size) + glove_size:
                 word_index * (glove_size + phone_size) + glove_size + phone_size], np.zeros(phone_size))
@@ -70,6 +92,361 @@ def test_format_text_with_hashtag():
     assert tweet_proc3 == 'this is an example hashtag'
 
 
+def test_format_texts_for_embedding_model():
+    print 'TEST: format_texts_for_embedding_model'
+    tweets = ['#DogJobs Walking the dog, 24/7! @owner', 'No hashtag here...', '#a#Bc#9x  two  spaces #end']
+    assert tools.format_texts_for_embedding_model(tweets) == ['dog jobs # walking the dog @owner',
+                                                             '# no hashtag here',
+                                                             'a bc9x end # two spaces']
+    assert tools.format_texts_for_embedding_model(tweets, hashtag_replace='dog jobs') == \
+        ['dog jobs # walking the dog @owner', 'dog jobs # no hashtag here', 'dog jobs # two spaces']
+    # Unicode tweets, i.e. passed to HumorPredictor in memory, are formatted like the same tweets in a hashtag file.
+    assert tools.format_texts_for_embedding_model([tweet.decode('utf-8') for tweet in tweets]) == \
+        tools.format_texts_for_embedding_model(tweets)
+    unicode_tweet = u'#Caf\xe9Jobs na\xefve'
+    assert tools.format_text_for_embedding_model(unicode_tweet, hashtag_replace=u'caf\xe9 jobs') == \
+        tools.format_text_for_embedding_model(unicode_tweet.encode('utf-8'), hashtag_replace='caf\xc3\xa9 jobs')
+    assert tools.remove_hashtag_from_tweets(tweets) == ['Walking the dog, 24/7! @owner', 'No hashtag here...',
+                                                        ' two  spaces ']
+
+
+def test_format_tweet_pairs():
+    print 'TEST: format_tweet_pairs'
+    char_to_index = {'': 0, 'a': 1, 'b': 2, ' ': 3}
+    data = [['ab a', 1, 'ba', 2, 1],
+            ['ba', 2, 'aaaaaa', 3, 0],
+            ['a?b', 4, 'ab a', 1, 1]]
+    np_tweet_pairs, np_tweet_pair_labels = tools.format_tweet_pairs(data, char_to_index, max_tweet_size=5)
+    assert np.array_equal(np_tweet_pairs, np.array([[1, 2, 3, 1, 0, 2, 1, 0, 0, 0],
+                                                    [2, 1, 0, 0, 0, 1, 1, 1, 1, 1],
+                                                    [1, 0, 2, 0, 0, 1, 2, 3, 1, 0]]))
+    assert np.array_equal(np_tweet_pair_labels, np.array([1, 0, 1]))
+    np_unlabeled_pairs, np_no_labels = tools.format_tweet_pairs([pair[:4] for pair in data], char_to_index,
+                                                                max_tweet_size=5)
+    assert np.array_equal(np_unlabeled_pairs, np_tweet_pairs)
+    assert np_no_labels is None
+
+
+def test_extract_tweet_pair_indices():
+    print 'TEST: extract_tweet_pair_indices'
+    tweets = ['winner', 'top one', 'top two', 'loser one', 'loser two', 'loser three']
+    tweet_ids = [10, 11, 12, 13, 14, 15]
+    labels = [2, 1, 1, 0, 0, 0]
+    random.seed('test seed')
+    tweet_pairs = tools.extract_tweet_pairs_by_rank(tweets, labels, tweet_ids)
+    random.seed('test seed')
+    np_first_index, np_second_index, np_label = tools.extract_tweet_pair_indices(tweet_ids, labels)
+    assert [tweets[index] for index in np_first_index] == [tweet_pair[0] for tweet_pair in tweet_pairs]
+    assert [tweets[index] for index in np_second_index] == [tweet_pair[2] for tweet_pair in tweet_pairs]
+    assert list(np_label) == [tweet_pair[4] for tweet_pair in tweet_pairs]
+    random.seed('other seed')
+    np_random_first_index, _, np_random_label = tools.extract_tweet_pair_indices(
+        tweet_ids, labels, random_generator=random.Random('test seed'))
+    assert np.array_equal(np_random_first_index, np_first_index)
+    assert np.array_equal(np_random_label, np_label)
+
+    np_tweet_gloves = np.arange(len(tweets) * 2 * 3).reshape([len(tweets), 2, 3])
+    np_first_tweets = tools.gather_tweet_embeddings(np_tweet_gloves, np_first_index)
+    assert np_first_tweets.shape == (len(tweet_pairs), 6)
+    assert np.array_equal(np_first_tweets[0], np_tweet_gloves[np_first_index[0]].flatten())
+
+    np_first_index, np_second_index, np_label = tools.extract_tweet_pair_indices(tweet_ids[:3], [])
+    assert list(np_first_index) == [0, 0, 1]
+    assert list(np_second_index) == [1, 2, 2]
+    assert np_label is None
+
+
+def test_generate_tweet_pair_index_chunks():
+    print 'TEST: generate_tweet_pair_index_chunks'
+    tweets = ['a', 'b', 'c', 'd', 'e']
+    tweet_pairs = tools.extract_tweet_pairs_by_combination(tweets, range(len(tweets)))
+    chunks = list(tools.generate_tweet_pair_index_chunks(len(tweets), chunk_size=3))
+    assert [len(np_first_index) for np_first_index, np_second_index in chunks] == [3, 3, 3, 1]
+    assert [(tweets[first_index], tweets[second_index]) for np_first_index, np_second_index in chunks
+            for first_index, second_index in zip(np_first_index, np_second_index)] == \
+        [(tweet_pair[0], tweet_pair[2]) for tweet_pair in tweet_pairs]
+    assert list(tools.generate_tweet_pair_index_chunks(1)) == []
+
+
+def test_save_and_load_tweet_store():
+    print 'TEST: save_tweet_store and load_hashtag_tweet_store'
+    directory = tempfile.mkdtemp() + '/'
+    word_emb_size = tools.GLOVE_EMB_SIZE + tools.PHONETIC_EMB_SIZE
+    hashtag_stores = []
+    for hashtag_index, num_tweets in enumerate([3, 4]):
+        np_tweet_gloves = np.random.uniform(size=[num_tweets, tools.HUMOR_MAX_WORDS_IN_TWEET, word_emb_size])
+        np_first_index = np.array([0, 1, 2], dtype=np.int32)
+        np_second_index = np.array([1, 2, 0], dtype=np.int32)
+        np_label = np.array([1, 0, 1], dtype=np.int32) if hashtag_index == 0 else None
+        tweet_ids = range(hashtag_index * 10, hashtag_index * 10 + num_tweets)
+        np_hashtag = np.random.uniform(size=[1, tools.HUMOR_MAX_WORDS_IN_HASHTAG * word_emb_size])
+        hashtag_stores.append(('Hashtag_%s' % hashtag_index, (np_tweet_gloves, np_first_index, np_second_index,
+                                                              np_label, tweet_ids, np_hashtag)))
+    tools.save_tweet_store(directory, hashtag_stores, dtype=np.float16)
+    for hashtag_name, hashtag_store in hashtag_stores:
+        loaded_store = tools.load_hashtag_tweet_store(directory, hashtag_name)
+        assert np.allclose(loaded_store[0], hashtag_store[0], atol=1e-2)
+        assert np.array_equal(loaded_store[1], hashtag_store[1])
+        assert np.array_equal(loaded_store[2], hashtag_store[2])
+        if hashtag_store[3] is None:
+            assert loaded_store[3] is None
+        else:
+            assert np.array_equal(loaded_store[3], hashtag_store[3])
+        assert loaded_store[4] == hashtag_store[4]
+        assert np.allclose(loaded_store[5], hashtag_store[5])
+        np_first_tweets = tools.load_hashtag_data(directory, hashtag_name)[0]
+        assert np_first_tweets.dtype == np.float32
+        assert np_first_tweets.shape == (3, tools.HUMOR_MAX_WORDS_IN_TWEET * word_emb_size)
+    tools.save_tweet_store(directory, [])
+    assert tools.load_tweet_store(directory)['index']['hashtags'] == {}
+    assert tools.load_tweet_store(directory)['pairs'].shape == (0, 3)
+    shutil.rmtree(directory)
+
+
+def test_glove_binary_lookup():
+    print 'TEST: convert_glove_text_to_binary and look_up_glove_matrix'
+    directory = tempfile.mkdtemp() + '/'
+    with open(directory + 'glove.txt', 'wb') as f:
+        f.write('the 0.1 0.2 0.3\n')
+        f.write('Park 1.5 -2.5 3.0\n')
+        f.write('broken 1.0\n')
+        f.write('zoo -0.5 0.25 8\n')
+    tools.convert_glove_text_to_binary(directory + 'glove.txt', directory + 'glove.bin', directory + 'glove.cpkl')
+    np_words_glove, np_found = tools.look_up_glove_matrix(['zoo', 'missing', 'park', 'the', 'broken'],
+                                                          directory + 'glove.bin', directory + 'glove.cpkl')
+    assert np_words_glove.dtype == np.float32
+    assert list(np_found) == [True, False, True, True, False]
+    assert np.allclose(np_words_glove, [[-0.5, 0.25, 8], [0, 0, 0], [1.5, -2.5, 3.0], [0.1, 0.2, 0.3], [0, 0, 0]])
+    shutil.rmtree(directory)
+
+
+def test_vocabulary():
+    print 'TEST: Vocabulary'
+    vocabulary = tools.Vocabulary([''])
+    vocabulary.add_all('banana bread'.split())
+    vocabulary.add_all('bread bread toast'.split())
+    assert list(vocabulary) == ['', 'banana', 'bread', 'toast']
+    assert vocabulary.to_dictionary() == {'': 0, 'banana': 1, 'bread': 2, 'toast': 3}
+    assert vocabulary.index('jam') is None
+    assert 'toast' in vocabulary and 'jam' not in vocabulary
+    pruned_vocabulary = vocabulary.prune(min_count=2, keep_tokens=[''])
+    assert list(pruned_vocabulary) == ['', 'bread']
+    assert list(vocabulary.prune(max_size=2)) == ['', 'bread']
+    filename = tempfile.mkdtemp() + '/vocabulary.cpkl'
+    vocabulary.save(filename)
+    loaded_vocabulary = tools.Vocabulary.load(filename)
+    assert list(loaded_vocabulary) == list(vocabulary)
+    assert loaded_vocabulary.counts == [1, 1, 3, 1]
+    shutil.rmtree(filename[:filename.rindex('/')])
+
+
+def test_map_hashtags():
+    print 'TEST: map_hashtags'
+    hashtag_names = ['hashtag_%s' % i for i in range(7)]
+    serial_results = list(tools.map_hashtags(sample_hashtag_numbers, hashtag_names, shared_args=(5,)))
+    parallel_results = list(tools.map_hashtags(sample_hashtag_numbers, hashtag_names, shared_args=(5,), workers=3))
+    assert [result[0] for result in parallel_results] == hashtag_names
+    assert parallel_results == serial_results
+    unordered_results = list(tools.map_hashtags(sample_hashtag_numbers, hashtag_names, shared_args=(5,), workers=3,
+                                                ordered=False))
+    assert sorted(unordered_results) == zip(hashtag_names, serial_results)
+    assert tools.get_worker_count(['humor_processing.py', 'tweet_pairs', '--workers', '4']) == 4
+    assert tools.get_worker_count(['humor_processing.py', 'tweet_pairs']) == 1
+
+
+def sample_hashtag_numbers(hashtag_name, number_of_samples):
+    random.seed(hashtag_name)
+    return hashtag_name, [random.random() for _ in range(number_of_samples)]
+
+
+def test_build_manifest():
+    print 'TEST: BuildManifest'
+    directory = tempfile.mkdtemp() + '/'
+    with open(directory + 'hashtag.tsv', 'wb') as f:
+        f.write('1\tfunny tweet\t1\n')
+    with open(directory + 'artifact.npy', 'wb') as f:
+        f.write('output')
+    word_to_glove = {'funny': [0.5, 1.0], 'unused': [1.0, 2.0]}
+    input_hash = tools.hash_build_inputs([directory + 'hashtag.tsv'], words=['funny', 'tweet'],
+                                         word_tables=[word_to_glove])
+    config = {'TWEET_SIZE': 140}
+    manifest = tools.BuildManifest(directory + tools.BUILD_MANIFEST_FILE, config)
+    assert not manifest.is_fresh('hashtag', input_hash)
+    manifest.record('hashtag', input_hash, [directory + 'artifact.npy'])
+    manifest.save()
+    manifest = tools.BuildManifest(directory + tools.BUILD_MANIFEST_FILE, config)
+    assert manifest.is_fresh('hashtag', input_hash)
+    # Vectors of words the output does not use do not change its hash.
+    word_to_glove['unused'] = [3.0, 4.0]
+    assert input_hash == tools.hash_build_inputs([directory + 'hashtag.tsv'], words=['funny', 'tweet'],
+                                                 word_tables=[word_to_glove])
+    word_to_glove['funny'] = [0.0, 1.0]
+    assert input_hash != tools.hash_build_inputs([directory + 'hashtag.tsv'], words=['funny', 'tweet'],
+                                                 word_tables=[word_to_glove])
+    assert not tools.BuildManifest(directory + tools.BUILD_MANIFEST_FILE, {'TWEET_SIZE': 100}).is_fresh('hashtag',
+                                                                                                       input_hash)
+    os.remove(directory + 'artifact.npy')
+    assert not manifest.is_fresh('hashtag', input_hash)
+    # Pickles are written in place of the old file in one step, creating missing directories.
+    tools.dump_pickle_atomically({'fold': 0}, directory + 'folds/fold_0.cpkl')
+    tools.dump_pickle_atomically({'fold': 1}, directory + 'folds/fold_0.cpkl')
+    assert os.listdir(directory + 'folds/') == ['fold_0.cpkl']
+    assert pickle.load(open(directory + 'folds/fold_0.cpkl', 'rb')) == {'fold': 1}
+    # They get the permissions of files created with open(), not the owner-only ones of temporary files.
+    open(directory + 'opened.txt', 'wb').close()
+    assert os.stat(directory + 'folds/fold_0.cpkl').st_mode == os.stat(directory + 'opened.txt').st_mode
+    shutil.rmtree(directory)
+
+
+def test_tokenized_tweet_cache():
+    print 'TEST: tokenized tweet cache'
+    directory = tempfile.mkdtemp() + '/'
+    hashtag_file = directory + 'Dog_Jobs.tsv'
+    open(hashtag_file, 'wb').write('1\tWalking the #dog\t2\n2\tfetch\t0\n')
+    cache_path = tools.get_tokenized_tweet_cache_path(hashtag_file, None, directory + 'cache/')
+    assert cache_path != tools.get_tokenized_tweet_cache_path(hashtag_file, 'dog jobs', directory + 'cache/')
+    tweets = ['dog # walking the', '', "can't  stop"]
+    tools.save_tokenized_tweets(cache_path, tweets, [2, 0, 1], [1, 2, 3])
+    assert tools.load_tokenized_tweets(cache_path) == (tweets, [2, 0, 1], [1, 2, 3])
+    assert os.stat(cache_path).st_mode == os.stat(hashtag_file).st_mode
+    # Tweets are loaded from the cache instead of being tokenized again.
+    assert tools.load_tweets_from_hashtag(hashtag_file, cache_dir=directory + 'cache/') == \
+        (tweets, [2, 0, 1], [1, 2, 3])
+    # An unreadable cache file is removed, so the tweets are tokenized again.
+    open(cache_path, 'wb').write('PK\x03\x04 interleaved writes')
+    assert tools.load_tokenized_tweets(cache_path) is None
+    assert not os.path.exists(cache_path)
+    assert os.listdir(directory + 'cache/') == []
+    open(hashtag_file, 'ab').write('3\tnew tweet\t0\n')
+    assert tools.get_tokenized_tweet_cache_path(hashtag_file, None, directory + 'cache/') != cache_path
+    shutil.rmtree(directory)
+
+
+def test_convert_tweets_to_word_ids():
+    print 'TEST: convert_tweets_to_word_ids'
+    word_to_phonetic = {'went': [.5, .5], 'park': [.25, .75]}
+    word_to_id, np_word_embeddings = tools.build_word_embedding_matrix(['went', 'to', 'park'], {}, word_to_phonetic,
+                                                                       1, 2)
+    assert np_word_embeddings.dtype == np.float32
+    assert np.array_equal(np_word_embeddings, [[0, 0, 0], [0, .5, .5], [0, .25, .75]])
+    np_word_ids = tools.convert_tweets_to_word_ids(['i went to the park today', '', 'park'], word_to_id, 4)
+    assert np_word_ids.dtype == np.int32
+    assert np.array_equal(np_word_ids, [[0, 1, 0, 0], [0, 0, 0, 0], [2, 0, 0, 0]])
+
+
+def test_prefetch_batches():
+    print 'TEST: prefetch_batches'
+    def generate_batches(task):
+        if task == 'broken':
+            raise ValueError('cannot load %s' % task)
+        for i in range(task):
+            yield task, i
+    tasks = [3, 0, 5, 2]
+    expected_batches = [(task, i) for task in tasks for i in range(task)]
+    assert list(tools.prefetch_batches(tasks, generate_batches, num_threads=1)) == expected_batches
+    assert sorted(tools.prefetch_batches(tasks, generate_batches, num_threads=3, max_prefetched_batches=2)) == \
+        sorted(expected_batches)
+    try:
+        list(tools.prefetch_batches([3, 'broken'], generate_batches, num_threads=2))
+        assert False
+    except ValueError:
+        pass
+    # Stopping early must not leave workers blocked on a full queue.
+    for batch in tools.prefetch_batches([50, 50], generate_batches, num_threads=2, max_prefetched_batches=1):
+        break
+
+
+def test_sample_pair_batches():
+    print 'TEST: sample_pair_batches'
+    pair_counts = [7, 0, 20, 3]
+    all_pairs = sorted((hashtag, pair) for hashtag, count in enumerate(pair_counts) for pair in range(count))
+    for stratified in [False, True]:
+        batches = tools.sample_pair_batches(pair_counts, 8, np.random.RandomState(0), stratified=stratified,
+                                            tail='keep')
+        assert [batch.shape[0] for batch in batches] == [8, 8, 8, 6]
+        assert sorted(tuple(row) for batch in batches for row in batch) == all_pairs
+        batches = tools.sample_pair_batches(pair_counts, 8, np.random.RandomState(0), stratified=stratified,
+                                            tail='pad')
+        assert [batch.shape[0] for batch in batches] == [8, 8, 8, 8]
+        assert set(tuple(row) for batch in batches for row in batch) == set(all_pairs)
+        batches = tools.sample_pair_batches(pair_counts, 8, np.random.RandomState(0), stratified=stratified,
+                                            tail='drop')
+        assert [batch.shape[0] for batch in batches] == [8, 8, 8]
+    # Stratified batches hold hashtags in proportion to their size.
+    batches = tools.sample_pair_batches([40, 40], 10, np.random.RandomState(1), stratified=True)
+    for batch in batches:
+        assert abs(np.sum(batch[:, 0] == 0) - 5) <= 1
+    assert tools.sample_pair_batches([0, 0], 4, np.random.RandomState(0)) == []
+
+
+def test_segment_reduce():
+    print 'TEST: segment_reduce'
+    np_values = np.random.RandomState(0).uniform(size=[9, 3])
+    segment_lengths = [2, 0, 4, 3, 0]
+    np_max, np_min, np_mean = tools.segment_reduce(np_values, segment_lengths)
+    assert np_max.shape == (5, 3)
+    start = 0
+    for segment, length in enumerate(segment_lengths):
+        if length == 0:
+            assert np.all(np.isnan(np_max[segment])) and np.all(np.isnan(np_mean[segment]))
+        else:
+            np_segment = np_values[start:start + length]
+            assert np.allclose(np_max[segment], np.max(np_segment, axis=0))
+            assert np.allclose(np_min[segment], np.min(np_segment, axis=0))
+            assert np.allclose(np_mean[segment], np.mean(np_segment, axis=0))
+        start += length
+    np_max, np_min, np_mean = tools.segment_reduce(np.zeros([0]), [0, 0])
+    assert np.all(np.isnan(np_max))
+
+
+def test_micro_batcher():
+    print 'TEST: MicroBatcher'
+    batch_sizes = []
+
+    def run_batch(inputs):
+        if np.any(inputs['x'] < 0):
+            raise ValueError('negative input')
+        batch_sizes.append(inputs['x'].shape[0])
+        return inputs['x'] * 2, inputs['x'] + inputs['y']
+
+    batcher = tools.MicroBatcher(run_batch, max_batch_size=100, max_wait=0.2)
+    results = {}
+
+    def submit(i):
+        results[i] = batcher.submit({'x': np.arange(i, i + 3), 'y': np.ones(3)})
+
+    threads = [threading.Thread(target=submit, args=(i,)) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    for i in range(5):
+        assert np.array_equal(results[i][0], np.arange(i, i + 3) * 2)
+        assert np.array_equal(results[i][1], np.arange(i, i + 3) + 1)
+    # Concurrent requests share batches.
+    assert sum(batch_sizes) == 15 and len(batch_sizes) < 5
+    try:
+        batcher.submit({'x': np.array([-1]), 'y': np.ones(1)})
+        assert False
+    except ValueError:
+        pass
+    # Calls run in the batching thread, on their own.
+    call_threads = []
+
+    def increment(x):
+        call_threads.append(threading.current_thread())
+        return x + 1
+
+    assert batcher.call(increment, 1) == 2
+    assert call_threads == [batcher.thread]
+    try:
+        batcher.call(int, 'not a number')
+        assert False
+    except ValueError:
+        pass
+    batcher.close()
+
+
 def test_find_indices_of_largest_n_values():
     my_array = np.array([4, 2, 7, 1, 9, 0, 5, 14, 22, -4])
     indices = find_indices_larger_than_threshold(my_array, 5)